@@ -0,0 +1,106 @@
+import math
+import numpy as np
+
+#
+# anomaly scores for a stream of Temporal_Memory steps
+#
+# functions:
+#           raw_anomaly_score(active_columns, predicted_columns)
+#
+# object: Anomaly_Likelihood, how unusual the recent raw anomaly scores are compared with those of a sliding window
+#
+# the last window raw scores are kept in a ring buffer with their running sum and sum of squares, and the last
+# average_window of them likewise, so every update costs the same and the memory is fixed; the likelihood is the
+# probability, under a normal distribution with the mean and variance of the window, of a short-term average at
+# most as high as the current one: close to 1 when the recent scores are unusually high
+#
+# attributes:
+#           window = an integer, the number of raw scores the distribution is estimated from
+#           average_window = an integer, the number of raw scores averaged into the short-term score
+#           learning_period = an integer, the number of raw scores seen before a likelihood other than 0.5 is given
+#           min_std = a float, the smallest standard deviation used, so that a flat history does not make every
+#                       small change look certain
+#           scores = a float64 ndarray of window raw scores (a ring buffer)
+#           recent = a float64 ndarray of average_window raw scores (a ring buffer)
+#           count = an integer, the number of raw scores seen
+#           total, total_squares = floats, the running sum and sum of squares of scores
+#           recent_total = a float, the running sum of recent
+#
+# functions:
+#           __init__(., window, average_window, learning_period, min_std)
+#           update(., score)
+#           get_mean_std(.)
+
+def raw_anomaly_score(active_columns, predicted_columns):
+    #
+    # a function that finds the fraction of the active columns that were not predicted
+    #
+    # arguments:
+    #       active_columns = a collection of column indexes (i,j), the spatial pooler output of the step
+    #       predicted_columns = a collection of the column indexes with a predictive cell at the previous step
+    #
+    # returns: score = a float between 0 and 1; 0 if no column is active
+    #
+    if len(active_columns) == 0:
+        return 0.0
+    unpredicted = sum(1 for col in active_columns if col not in predicted_columns)
+
+    return unpredicted / len(active_columns)
+
+
+class Anomaly_Likelihood():
+    def __init__(self, window=100, average_window=10, learning_period=None, min_std=0.05):
+        self.window = window
+        self.average_window = average_window
+        self.learning_period = window if learning_period is None else learning_period
+        self.min_std = min_std
+
+        self.scores = np.zeros(window, dtype=np.float64)
+        self.recent = np.zeros(average_window, dtype=np.float64)
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.recent_total = 0.0
+
+    def update(self, score):
+        #
+        # a function that adds the raw score of the next step
+        #
+        # arguments:
+        #       score = a float between 0 and 1, see raw_anomaly_score
+        #
+        # returns: likelihood = a float between 0 and 1, 0.5 during the learning period
+        #
+        position = self.count % self.window
+        old = self.scores[position]
+        self.scores[position] = score
+        self.total += score - old
+        self.total_squares += score * score - old * old
+
+        position = self.count % self.average_window
+        self.recent_total += score - self.recent[position]
+        self.recent[position] = score
+        self.count += 1
+
+        if self.count < self.learning_period:
+            return 0.5
+
+        mean, std = self.get_mean_std()
+        average = self.recent_total / min(self.count, self.average_window)
+        # the normal distribution function at average
+        return 0.5 * math.erfc((mean - average) / (std * math.sqrt(2)))
+
+    def get_mean_std(self):
+        #
+        # a function that gives the mean and the standard deviation of the raw scores in the window
+        #
+        # returns: mean, std = floats, std at least min_std
+        #
+        n = min(self.count, self.window)
+        if n == 0:
+            return 0.0, self.min_std
+        mean = self.total / n
+        # the running sums drift a little, so the variance is kept from going below 0
+        variance = max(self.total_squares / n - mean * mean, 0.0)
+
+        return mean, max(math.sqrt(variance), self.min_std)
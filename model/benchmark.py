@@ -0,0 +1,440 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+#
+# a headless benchmark harness for the encoder, the Spatial_Pooler and the Temporal_Memory, with results written as
+# JSON; every measurement that reports memory runs in a fresh interpreter (this file run with --child), so the
+# memory of one does not hide in the peak of another
+#
+# benchmarks:
+#       stream = every configuration (pooler size, cells per column, sequence length, sequence kind) goes through
+#                the stages a stream goes through, with fixed seeds, and reports for each stage the steps per second
+#                and the p50 and p99 step latencies in milliseconds, and for the configuration the peak resident
+#                memory of its process in MB; the stages, with the entry point each one times (also written in the
+#                JSON, as entry_point):
+#                   encoder = Scalar_Encoder.encode_stream, one value at a time
+#                   numeric_encoder = numeric_encoder, the whole sequence in one call (no step latencies)
+#                   spatial_pooler = Spatial_Pooler.transform, one encoded value at a time, learning
+#                   temporal_memory = Temporal_Memory.compute, one spatial pooler output at a time, learning
+#                   temporal_memory_learn = Temporal_Memory.learn, the whole sequence in one call on a fresh
+#                                           Temporal_Memory (the same steps as temporal_memory, no step latencies)
+#       sp_startup = for every (pooler size, input size) pair, the time to build the Spatial_Pooler permanences:
+#                   legacy_scipy = one Spatial_Pooler_Neuron-style dict per column, filled from one scipy truncnorm
+#                                  call per column (the construction Spatial_Pooler used to do; skipped when scipy
+#                                  is not installed)
+#                   per_neuron = one Spatial_Pooler_Neuron per column with the numpy permanence draw
+#                   bulk = Spatial_Pooler, one seeded draw for the whole permanence matrix
+#                and, once, the time to import spatial_pooler in a fresh interpreter
+#       tm_startup = for every spatial pooler size, eager and lazy, the seconds spent in Temporal_Memory(...), the
+#                growth of the peak resident memory during construction in MB, and the seconds spent on the first
+#                steps of random input (lazy mode pays for columns there)
+#       workers = for every spatial pooler size and number of worker processes (0 for none), the steps per second
+#                and the p50 and p99 step latencies of Temporal_Memory.compute, learning a repeating sequence of
+#                random inputs, and the speedup over no workers; the number of CPUs is written with the results,
+#                there is no speedup to expect from more workers than CPUs
+#
+# the sequences are synthetic, values between 0 and 10:
+#       repeating = a fixed pattern of 5 values over and over
+#       noisy = the repeating pattern with gaussian noise (standard deviation 0.5)
+#       random = uniformly random values
+#
+# usage:
+#       python benchmark.py
+#       python benchmark.py stream --sizes 10x10 32x32 64x64 --cells 5 10 --lengths 100 500 --output results.json
+#       python benchmark.py sp_startup --sizes 10x10:7x7 64x64:100x100 --repeat 3
+#       python benchmark.py tm_startup --sizes 10x10 100x100 --cells 5 --steps 10
+#       python benchmark.py workers --sizes 32x32 64x64 --workers 0 1 2 4 --steps 100
+#
+
+KINDS = ("repeating", "noisy", "random")
+
+
+def make_sequence(kind, length, seed=0):
+    #
+    # a function that makes a synthetic sequence
+    #
+    # arguments:
+    #       kind = a string, one of KINDS
+    #       length = an integer
+    #       seed = an integer, default is 0
+    #
+    # returns: values = a float64 ndarray of length values between 0 and 10
+    #
+    rng = np.random.default_rng(seed)
+    pattern = np.array([1.0, 5.0, 7.0, 3.0, 2.0])
+    if kind == "repeating":
+        return np.resize(pattern, length)
+    if kind == "noisy":
+        return np.clip(np.resize(pattern, length) + rng.normal(0, 0.5, length), 0, 10)
+    if kind == "random":
+        return rng.uniform(0, 10, length)
+    raise ValueError("kind must be one of " + ", ".join(KINDS) + ", got " + repr(kind))
+
+
+def summarize(entry_point, latencies):
+    #
+    # a function that sums up the latencies of the steps of a stage
+    #
+    # returns: a dictionary of entry_point, steps_per_sec, p50_ms and p99_ms
+    #
+    latencies = np.asarray(latencies)
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+
+    return {"entry_point": entry_point, "steps_per_sec": len(latencies) / latencies.sum(), "p50_ms": p50,
+            "p99_ms": p99}
+
+
+def summarize_call(entry_point, steps, seconds):
+    #
+    # a function that sums up a stage timed as one call over every step, which has no step latencies
+    #
+    # returns: a dictionary of entry_point, steps_per_sec, p50_ms and p99_ms (None)
+    #
+    return {"entry_point": entry_point, "steps_per_sec": steps / seconds, "p50_ms": None, "p99_ms": None}
+
+
+def best_time(function, *arguments, repeat=1):
+    #
+    # a function that returns the fastest of repeat runs of function(*arguments), in seconds
+    #
+    times = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stream(config):
+    #
+    # a function that runs one stream configuration through every stage, in the current process
+    #
+    # arguments:
+    #       config = a dictionary of pooler_size (a pair), cells_per_column, length and kind
+    #
+    # returns: a dictionary of the results of every stage and peak_rss_mb
+    #
+    from numeric_encoder import Scalar_Encoder, numeric_encoder
+    from spatial_pooler import Spatial_Pooler
+    from temporal_memory_v3 import Temporal_Memory
+
+    values = make_sequence(config["kind"], config["length"])
+    pooler_size = tuple(config["pooler_size"])
+    results = {}
+
+    encoder = Scalar_Encoder(min_val=0, max_val=10)
+    stream = encoder.encode_stream(values)
+    encodings, latencies = [], []
+    for v in range(len(values)):
+        start = time.perf_counter()
+        encodings.append(next(stream))
+        latencies.append(time.perf_counter() - start)
+    results["encoder"] = summarize("numeric_encoder.Scalar_Encoder.encode_stream", latencies)
+    results["numeric_encoder"] = summarize_call("numeric_encoder.numeric_encoder", len(values),
+                                                best_time(numeric_encoder, values))
+
+    sp = Spatial_Pooler(pooler_size=pooler_size, input_size=encoder.shape, seed=0)
+    columns, latencies = [], []
+    for encoding in encodings:
+        start = time.perf_counter()
+        matrix_ls, mapping = sp.transform([encoding])
+        latencies.append(time.perf_counter() - start)
+        columns.extend(matrix_ls)
+    results["spatial_pooler"] = summarize("spatial_pooler.Spatial_Pooler.transform", latencies)
+
+    def make_temporal_memory():
+        return Temporal_Memory(spatial_pooler_input_output_mapping=mapping, spatial_pooler_dim=pooler_size,
+                               cells_per_column=config["cells_per_column"], seed=0)
+
+    tm = make_temporal_memory()
+    latencies = []
+    for active_columns in columns:
+        start = time.perf_counter()
+        tm.compute(active_columns)
+        latencies.append(time.perf_counter() - start)
+    results["temporal_memory"] = summarize("temporal_memory_v3.Temporal_Memory.compute", latencies)
+    results["temporal_memory_learn"] = summarize_call("temporal_memory_v3.Temporal_Memory.learn", len(columns),
+                                                      best_time(make_temporal_memory().learn, columns))
+
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    return results
+
+
+def run_tm_startup(config):
+    #
+    # a function that builds one Temporal_Memory, then runs a few random inputs through it, in the current process
+    #
+    # arguments:
+    #       config = a dictionary of pooler_size (a pair), cells_per_column, lazy and steps
+    #
+    # returns: a dictionary of construction_s, rss_mb (the growth of the peak during construction) and
+    #          first_steps_s
+    #
+    from temporal_memory_v3 import Temporal_Memory
+
+    x, y = config["pooler_size"]
+    rng = np.random.default_rng(0)
+    inputs = [[(int(i), int(j)) for i, j in np.argwhere(rng.random((x, y)) < 0.02)] for s in range(config["steps"])]
+
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    tm = Temporal_Memory(spatial_pooler_dim=(x, y), cells_per_column=config["cells_per_column"], seed=0,
+                         lazy=config["lazy"])
+    construction = time.perf_counter() - start
+    rss = peak_rss_mb() - before
+
+    return {"construction_s": construction, "rss_mb": rss,
+            "first_steps_s": best_time(lambda: [tm.compute(active_columns) for active_columns in inputs])}
+
+
+def run_tm_workers(config):
+    #
+    # a function that times the learning steps of one Temporal_Memory with some worker processes, in the current
+    # process
+    #
+    # arguments:
+    #       config = a dictionary of pooler_size (a pair), cells_per_column, workers (0 for none) and steps
+    #
+    # returns: a dictionary of entry_point, steps_per_sec, p50_ms and p99_ms
+    #
+    from temporal_memory_v3 import Temporal_Memory
+
+    x, y = config["pooler_size"]
+    rng = np.random.default_rng(0)
+    patterns = [[(int(i), int(j)) for i, j in np.argwhere(rng.random((x, y)) < 0.02)] for p in range(8)]
+
+    tm = Temporal_Memory(spatial_pooler_dim=(x, y), cells_per_column=config["cells_per_column"], seed=0,
+                         workers=config["workers"] or None)
+    latencies = []
+    for s in range(config["steps"]):
+        start = time.perf_counter()
+        tm.compute(patterns[s % len(patterns)])
+        latencies.append(time.perf_counter() - start)
+    tm.close()
+
+    return summarize("temporal_memory_v3.Temporal_Memory.compute", latencies)
+
+
+def run_import(config):
+    #
+    # a function that times "import spatial_pooler" in the current process (numpy is already imported)
+    #
+    start = time.perf_counter()
+    import spatial_pooler
+
+    return {"import_s": time.perf_counter() - start}
+
+
+# what a child process can run, by the name given in its config
+CHILDREN = {"stream": run_stream, "tm_startup": run_tm_startup, "tm_workers": run_tm_workers, "import": run_import}
+
+
+def measure(config):
+    #
+    # a function that runs one configuration in a fresh interpreter, so its time and peak memory are its own
+    #
+    # arguments:
+    #       config = a dictionary, with child (a key of CHILDREN) and the arguments of that function
+    #
+    # returns: a dictionary of what the child function returned
+    #
+    output = subprocess.run([sys.executable, __file__, "--child", json.dumps(config)], capture_output=True, text=True,
+                            check=True)
+
+    return json.loads(output.stdout)
+
+
+def legacy_scipy_construction(pooler_size, input_size):
+    #
+    # a function that reproduces the construction of the per-column dictionaries with one scipy call per column
+    #
+    from scipy import stats
+
+    m, n = input_size
+    cells_dict = {}
+    for i in range(pooler_size[0]):
+        for j in range(pooler_size[1]):
+            perm_ls = stats.truncnorm.rvs(0, 1, loc=0.3, scale=0.5, size=m*n)
+            connections = {}
+            for a in range(m):
+                for b in range(n):
+                    connections[(a, b)] = perm_ls[a*n+b]
+            cells_dict[(i, j)] = connections
+
+    return cells_dict
+
+
+def per_neuron_construction(pooler_size, input_size):
+    from spatial_pooler_neuron import Spatial_Pooler_Neuron
+
+    rng = np.random.default_rng(0)
+    return [Spatial_Pooler_Neuron((i, j), input_size, rng) for i in range(pooler_size[0]) for j in range(pooler_size[1])]
+
+
+def bulk_construction(pooler_size, input_size):
+    from spatial_pooler import Spatial_Pooler
+
+    return Spatial_Pooler(pooler_size=pooler_size, input_size=input_size, seed=0)
+
+
+def parse_size(text):
+    #
+    # a function that reads a size given as MxN, or a pair of sizes given as MxN:MxN
+    #
+    if ":" in text:
+        return tuple(parse_size(part) for part in text.split(":"))
+    return tuple(int(v) for v in text.split("x"))
+
+
+def stream_benchmark(args):
+    runs = []
+    print("%-8s %5s %6s %-9s %12s %12s %12s %10s %9s" % ("size", "cells", "length", "kind", "encoder/s", "pooler/s",
+                                                         "tm/s", "tm p99 ms", "rss MB"))
+    for size, cells, length, kind in itertools.product(args.sizes, args.cells, args.lengths, args.kinds):
+        config = {"child": "stream", "pooler_size": parse_size(size), "cells_per_column": cells, "length": length,
+                  "kind": kind}
+        results = measure(config)
+        runs.append({"config": config, "results": results})
+        print("%-8s %5d %6d %-9s %12.0f %12.1f %12.1f %10.2f %9.1f" % (
+            size, cells, length, kind, results["encoder"]["steps_per_sec"], results["spatial_pooler"]["steps_per_sec"],
+            results["temporal_memory"]["steps_per_sec"], results["temporal_memory"]["p99_ms"], results["peak_rss_mb"]))
+
+    return runs
+
+
+def sp_startup_benchmark(args):
+    try:
+        import scipy
+        has_scipy = True
+    except ImportError:
+        has_scipy = False
+
+    import_s = measure({"child": "import"})["import_s"]
+    runs = [{"config": {"child": "import"}, "results": {"import_s": import_s}}]
+    print("import spatial_pooler: %.4f s" % import_s)
+    print("%-20s %14s %14s %14s %10s" % ("pooler:input", "legacy_scipy", "per_neuron", "bulk", "speedup"))
+    for text in args.sizes:
+        pooler_size, input_size = parse_size(text)
+        legacy = best_time(legacy_scipy_construction, pooler_size, input_size, repeat=args.repeat) if has_scipy else None
+        per_neuron = best_time(per_neuron_construction, pooler_size, input_size, repeat=args.repeat)
+        bulk = best_time(bulk_construction, pooler_size, input_size, repeat=args.repeat)
+        baseline = legacy if has_scipy else per_neuron
+        runs.append({"config": {"pooler_size": pooler_size, "input_size": input_size, "repeat": args.repeat},
+                     "results": {"legacy_scipy_s": legacy, "per_neuron_s": per_neuron, "bulk_s": bulk}})
+        print("%-20s %12.4f s %12.4f s %12.4f s %9.1fx" % (text, float("nan") if legacy is None else legacy, per_neuron,
+                                                          bulk, baseline / bulk))
+
+    return runs
+
+
+def tm_startup_benchmark(args):
+    runs = []
+    print("%-10s %-6s %14s %12s %14s" % ("size", "mode", "construction", "rss", "first_steps"))
+    for text in args.sizes:
+        for lazy in (False, True):
+            config = {"child": "tm_startup", "pooler_size": parse_size(text), "cells_per_column": args.cells,
+                      "lazy": lazy, "steps": args.steps}
+            results = measure(config)
+            runs.append({"config": config, "results": results})
+            print("%-10s %-6s %12.4f s %9.1f MB %12.4f s" % (text, "lazy" if lazy else "eager", results["construction_s"],
+                                                             results["rss_mb"], results["first_steps_s"]))
+
+    return runs
+
+
+def workers_benchmark(args):
+    runs = []
+    print("%d CPUs" % os.cpu_count())
+    print("%-10s %7s %12s %10s %10s %9s" % ("size", "workers", "tm/s", "p50 ms", "p99 ms", "speedup"))
+    for text in args.sizes:
+        serial = None
+        for workers in args.workers:
+            config = {"child": "tm_workers", "pooler_size": parse_size(text), "cells_per_column": args.cells,
+                      "workers": workers, "steps": args.steps}
+            results = measure(config)
+            if serial is None:
+                serial = results["steps_per_sec"]
+            results["speedup"] = results["steps_per_sec"] / serial
+            results["cpu_count"] = os.cpu_count()
+            runs.append({"config": config, "results": results})
+            print("%-10s %7d %12.1f %10.2f %10.2f %8.2fx" % (text, workers, results["steps_per_sec"], results["p50_ms"],
+                                                             results["p99_ms"], results["speedup"]))
+
+    return runs
+
+
+# the benchmarks by name, with their options
+BENCHMARKS = {"stream": stream_benchmark, "sp_startup": sp_startup_benchmark, "tm_startup": tm_startup_benchmark,
+              "workers": workers_benchmark}
+
+
+def main():
+    if "--child" in sys.argv:
+        config = json.loads(sys.argv[sys.argv.index("--child") + 1])
+        print(json.dumps(CHILDREN[config["child"]](config)))
+        return
+
+    parser = argparse.ArgumentParser(description="encoder, Spatial_Pooler and Temporal_Memory benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    stream = subparsers.add_parser("stream", help="steps per second, step latencies and peak memory of every stage")
+    stream.add_argument("--sizes", nargs="+", default=["10x10", "32x32"], help="spatial pooler sizes as MxN")
+    stream.add_argument("--cells", nargs="+", type=int, default=[5, 10], help="cells per column")
+    stream.add_argument("--lengths", nargs="+", type=int, default=[100], help="sequence lengths")
+    stream.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS, help="sequence kinds")
+
+    sp_startup = subparsers.add_parser("sp_startup", help="Spatial_Pooler construction and import time")
+    sp_startup.add_argument("--sizes", nargs="+", default=["10x10:7x7", "32x32:28x28", "64x64:50x50"],
+                            help="pooler and input sizes as MxN:MxN")
+    sp_startup.add_argument("--repeat", type=int, default=3, help="runs per construction, the fastest is kept")
+
+    tm_startup = subparsers.add_parser("tm_startup", help="Temporal_Memory construction time and memory")
+    tm_startup.add_argument("--sizes", nargs="+", default=["10x10", "32x32", "64x64", "128x128"],
+                            help="spatial pooler sizes as MxN")
+    tm_startup.add_argument("--cells", type=int, default=5, help="cells per column")
+    tm_startup.add_argument("--steps", type=int, default=5, help="random inputs run after construction")
+
+    workers = subparsers.add_parser("workers", help="Temporal_Memory steps per second by number of worker processes")
+    workers.add_argument("--sizes", nargs="+", default=["32x32", "64x64"], help="spatial pooler sizes as MxN")
+    workers.add_argument("--cells", type=int, default=5, help="cells per column")
+    workers.add_argument("--workers", nargs="+", type=int, default=[0, 1, 2, 4],
+                         help="numbers of worker processes, 0 for none; the speedup is over the first one")
+    workers.add_argument("--steps", type=int, default=100, help="learning steps timed per run")
+
+    for subparser in (stream, sp_startup, tm_startup, workers):
+        subparser.add_argument("--output", help="where the JSON results are written, default is "
+                                                "benchmark_<benchmark>.json")
+
+    # the stream benchmark is the default
+    arguments = sys.argv[1:]
+    if not arguments or arguments[0] not in BENCHMARKS and arguments[0] not in ("-h", "--help"):
+        arguments = ["stream"] + arguments
+    args = parser.parse_args(arguments)
+
+    runs = BENCHMARKS[args.benchmark](args)
+
+    report = {"benchmark": args.benchmark, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+              "runs": runs}
+    with open(args.output or "benchmark_" + args.benchmark + ".json", "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
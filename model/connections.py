@@ -0,0 +1,963 @@
+import numpy as np
+from permanences import get_ranges
+
+#
+# Object called Connections - the flat connectivity store of the temporal memory space
+#
+# cells are numbered cell = (i*y + j)*z + k for the cell at height k of column (i,j); every segment belongs to one
+# cell and owns a contiguous range of synapse slots, start to start+size, inside a block of capacity slots; when a
+# segment outgrows its block it is moved to a bigger block at the end of the synapse arrays and the old block
+# becomes free space, which compact() reclaims
+#
+# growth is bounded: a cell holds at most max_segments_per_cell segments, the least recently active one being
+# destroyed to make room for a new one, and a segment holds at most max_synapses_per_segment synapses, the weakest
+# ones being removed to make room for new ones; destroyed segment ids are handed out again
+#
+# attributes:
+#           x, y, z = integers, the size of TM space
+#           num_cells = an integer, x*y*z
+#           min_segment_capacity = an integer, default is 8, the smallest block of synapse slots given to a segment
+#           max_segments_per_cell = an integer, default is 16, the most segments a cell can hold
+#           max_synapses_per_segment = an integer, default is 64, the most synapses a segment can hold
+#           segment_cell = an int32 ndarray, the cell of every segment (-1 for unused segment ids)
+#           segment_start = an int64 ndarray, the first synapse slot of every segment
+#           segment_size = an int32 ndarray, the number of synapses of every segment
+#           segment_capacity = an int32 ndarray, the number of synapse slots reserved for every segment
+#           num_segments = an integer, the number of segment ids handed out
+#           segment_perm_sum = a float64 ndarray, the total permanence value of every segment, kept up to date by
+#                           every function that adds, removes or changes synapses
+#           segment_last_active = an int64 ndarray, the iteration at which every segment was last active (or created)
+#           free_segments = a list of the ids of destroyed segments, to be handed out again
+#           cell_segments = a dictionary {cell: list of its segment ids, oldest first}
+#           iteration = an integer, the current time step, set by the temporal memory; segments are stamped with it
+#           num_evicted_segments = an integer, how many segments were destroyed to make room for new ones
+#           num_removed_synapses = an integer, how many synapses were removed (pruned, displaced by new ones or
+#                           destroyed with their segment)
+#           dirty_segments = a boolean ndarray, True for every segment id created, destroyed or changed (synapses or
+#                           permanence values) since the last call to get_state
+#           dirty_cells = a set of the cells whose list of segments changed since the last call to get_state
+#           synapse_presyn = an int32 ndarray, the presynaptic cell (the other end) of every synapse slot, -1 if unused
+#           synapse_perm = a float32 ndarray, the permanence value of every synapse slot, the only copy of it (change it
+#                           through update_perms so segment_perm_sum follows)
+#           synapse_segment = an int32 ndarray, the segment owning every synapse slot, -1 if unused
+#           synapse_top = an integer, the number of synapse slots handed out to segment blocks
+#           free_slots = an integer, the number of slots below synapse_top that no block owns any more
+#           presyn_segments = a dictionary {cell: {segment: number of synapses of the segment whose presynaptic cell
+#                           is that cell}}, the reverse index used to find the segments an active cell feeds without
+#                           visiting any other synapse; cells that feed no segment have no entry
+#
+# functions:
+#           __init__(., x, y, z, min_segment_capacity, max_segments_per_cell, max_synapses_per_segment)
+#           cell_index(., position)
+#           cell_position(., cell)
+#           reserve_segments(., count)
+#           allocate_slots(., count)
+#           create_segment(., cell, capacity, segment)
+#           destroy_segment(., segment)
+#           load_segments(., cells, sizes, presyn, perms)
+#           relocate(., segment, capacity)
+#           add_synapses(., segment, presyn, perms)
+#           remove_synapses(., segment, keep)
+#           make_room(., segment, count)
+#           replace_weakest(., segments, presyn, perms)
+#           prune_synapses(., segments, perm_floor)
+#           update_perms(., slots, deltas)
+#           append_synapses(., segments, presyn, perms)
+#           connect(., segment, presyn, perms)
+#           connect_ends(., cell, presyn, perms)
+#           append_in_order(., segments, presyn, perms)
+#           grow_segment(., cell, presyn, perms)
+#           connect_cells(., cells, presyn_ls, perms_ls, new_segments)
+#           append_queued(., segments_ls, presyn_ls, perms_ls)
+#           get_synapses(., segment)
+#           get_segments(., cell)
+#           get_current_segment(., cell)
+#           index_synapses(., segments, presyn)
+#           get_active_segments(., active_cells)
+#           record_activity(., segments)
+#           get_active_mask(., active_cells)
+#           get_overlap_scores(., segments, active_mask)
+#           get_best_overlaps(., cells, active_mask)
+#           adapt_segments(., cells, active_mask, inc_val, dec_val, perm_floor)
+#           activate_segments(., active_cells, threshold)
+#           get_segment_perm_sums(., segments)
+#           compute_segment_perm_sums(., segments)
+#           get_live_synapses(.)
+#           get_num_segments(.)
+#           get_num_synapses(.)
+#           get_nbytes(.)
+#           get_counts(.)
+#           check_consistency(.)
+#           get_state(., delta)
+#           set_state(., state)
+#           compact(.)
+#
+# functions outside the object:
+#           grow(array, size, fill)
+
+class Connections():
+    def __init__(self, x, y, z, min_segment_capacity=8, max_segments_per_cell=16, max_synapses_per_segment=64):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.num_cells = x * y * z
+        self.min_segment_capacity = min_segment_capacity
+        self.max_segments_per_cell = max_segments_per_cell
+        self.max_synapses_per_segment = max_synapses_per_segment
+
+        self.segment_cell = np.full(64, -1, dtype=np.int32)
+        self.segment_start = np.zeros(64, dtype=np.int64)
+        self.segment_size = np.zeros(64, dtype=np.int32)
+        self.segment_capacity = np.zeros(64, dtype=np.int32)
+        self.segment_perm_sum = np.zeros(64, dtype=np.float64)
+        self.segment_last_active = np.zeros(64, dtype=np.int64)
+        self.num_segments = 0
+        self.free_segments = []
+        self.cell_segments = {}
+        self.iteration = 0
+        self.num_evicted_segments = 0
+        self.num_removed_synapses = 0
+        self.dirty_segments = np.zeros(64, dtype=bool)
+        self.dirty_cells = set()
+
+        self.synapse_presyn = np.full(256, -1, dtype=np.int32)
+        self.synapse_perm = np.zeros(256, dtype=np.float32)
+        self.synapse_segment = np.full(256, -1, dtype=np.int32)
+        self.synapse_top = 0
+        self.free_slots = 0
+
+        self.presyn_segments = {}
+
+    def cell_index(self, position):
+        #
+        # a function that turns a cell position (i,j,k) in TM space into its cell number
+        #
+        i, j, k = position
+        return (i * self.y + j) * self.z + k
+
+    def cell_position(self, cell):
+        #
+        # a function that turns a cell number into its position (i,j,k) in TM space
+        #
+        column, k = divmod(int(cell), self.z)
+        i, j = divmod(column, self.y)
+        return (i, j, k)
+
+    def reserve_segments(self, count):
+        #
+        # a function that makes room for count more segment ids
+        #
+        needed = self.num_segments + count
+        if needed <= len(self.segment_cell):
+            return
+        size = max(needed, 2 * len(self.segment_cell))
+        self.segment_cell = grow(self.segment_cell, size, -1)
+        self.segment_start = grow(self.segment_start, size, 0)
+        self.segment_size = grow(self.segment_size, size, 0)
+        self.segment_capacity = grow(self.segment_capacity, size, 0)
+        self.segment_perm_sum = grow(self.segment_perm_sum, size, 0)
+        self.segment_last_active = grow(self.segment_last_active, size, 0)
+        self.dirty_segments = grow(self.dirty_segments, size, False)
+
+    def allocate_slots(self, count):
+        #
+        # a function that hands out a block of count synapse slots at the end of the synapse arrays
+        #
+        # returns: start = an integer, the first slot of the block
+        #
+        needed = self.synapse_top + count
+        if needed > len(self.synapse_presyn):
+            size = max(needed, 2 * len(self.synapse_presyn))
+            self.synapse_presyn = grow(self.synapse_presyn, size, -1)
+            self.synapse_perm = grow(self.synapse_perm, size, 0)
+            self.synapse_segment = grow(self.synapse_segment, size, -1)
+        start = self.synapse_top
+        self.synapse_top = needed
+        return start
+
+    def create_segment(self, cell, capacity=0, segment=None):
+        #
+        # a function that adds an empty segment to a cell
+        #
+        # arguments:
+        #           cell = an integer, the cell number
+        #           capacity = an integer, how many synapse slots to reserve (at least min_segment_capacity)
+        #           segment = an integer, the id to give the new segment, default is the next free one; an id given
+        #                     here is not taken from the free list (a store that only holds some cells gets the ids
+        #                     of its segments from the store that holds them all)
+        #
+        # returns: segment = an integer, the id of the new segment
+        #
+        cell_segments = self.cell_segments.setdefault(int(cell), [])
+        # a full cell gives up its least recently active segment (the oldest one among equals)
+        if len(cell_segments) >= self.max_segments_per_cell:
+            oldest = cell_segments[int(np.argmin(self.segment_last_active[cell_segments]))]
+            self.destroy_segment(oldest)
+            self.num_evicted_segments += 1
+
+        if segment is not None:
+            self.reserve_segments(segment + 1 - self.num_segments)
+            self.num_segments = max(self.num_segments, segment + 1)
+        elif self.free_segments:
+            segment = self.free_segments.pop()
+        else:
+            self.reserve_segments(1)
+            segment = self.num_segments
+            self.num_segments += 1
+
+        capacity = min(max(capacity, self.min_segment_capacity), self.max_synapses_per_segment)
+        self.segment_cell[segment] = cell
+        self.segment_start[segment] = self.allocate_slots(capacity)
+        self.segment_size[segment] = 0
+        self.segment_capacity[segment] = capacity
+        self.segment_perm_sum[segment] = 0
+        self.segment_last_active[segment] = self.iteration
+        cell_segments.append(segment)
+        self.dirty_segments[segment] = True
+        self.dirty_cells.add(int(cell))
+
+        return segment
+
+    def destroy_segment(self, segment):
+        #
+        # a function that removes a segment and all of its synapses; its id and block are freed
+        #
+        self.remove_synapses(segment, np.zeros(int(self.segment_size[segment]), dtype=bool))
+        self.cell_segments[int(self.segment_cell[segment])].remove(segment)
+        self.dirty_cells.add(int(self.segment_cell[segment]))
+        self.free_slots += int(self.segment_capacity[segment])
+        self.segment_cell[segment] = -1
+        self.segment_capacity[segment] = 0
+        self.free_segments.append(segment)
+
+    def load_segments(self, cells, sizes, presyn, perms):
+        #
+        # a function that creates many segments at once, each already holding its synapses
+        #
+        # arguments:
+        #           cells = an ndarray, the cell of every new segment
+        #           sizes = an ndarray, the number of synapses of every new segment
+        #           presyn = an ndarray, the presynaptic cells of all synapses, grouped by segment in the order of cells
+        #           perms = an ndarray, the permanence values in the same order as presyn
+        #
+        # returns: segments = an ndarray of the ids of the new segments
+        #
+        cells = np.asarray(cells, dtype=np.int32)
+        sizes = np.asarray(sizes, dtype=np.int64)
+        count = len(cells)
+
+        # a segment keeps only its first max_synapses_per_segment synapses
+        if len(sizes) > 0 and sizes.max() > self.max_synapses_per_segment:
+            rank = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            keep = rank < self.max_synapses_per_segment
+            presyn, perms = np.asarray(presyn)[keep], np.asarray(perms)[keep]
+            sizes = np.minimum(sizes, self.max_synapses_per_segment)
+        self.reserve_segments(count)
+        segments = np.arange(self.num_segments, self.num_segments + count)
+        self.num_segments += count
+
+        capacities = np.maximum(sizes, self.min_segment_capacity)
+        first = self.allocate_slots(int(capacities.sum()))
+        starts = first + np.cumsum(capacities) - capacities
+        self.segment_cell[segments] = cells
+        self.segment_start[segments] = starts
+        self.segment_size[segments] = sizes
+        self.segment_capacity[segments] = capacities
+        self.segment_last_active[segments] = self.iteration
+
+        slots = get_ranges(starts, sizes)
+        self.synapse_presyn[slots] = presyn
+        self.synapse_perm[slots] = perms
+        self.synapse_segment[slots] = np.repeat(segments, sizes)
+        self.index_synapses(self.synapse_segment[slots], presyn)
+        self.segment_perm_sum[segments] = np.bincount(np.repeat(np.arange(count), sizes),
+                                                      weights=self.synapse_perm[slots], minlength=count)
+
+        for cell, segment in zip(cells.tolist(), segments.tolist()):
+            self.cell_segments.setdefault(cell, []).append(segment)
+        self.dirty_cells.update(cells.tolist())
+
+        return segments
+
+    def relocate(self, segment, capacity):
+        #
+        # a function that moves a segment's synapses to a new block of capacity slots
+        #
+        start = int(self.segment_start[segment])
+        size = int(self.segment_size[segment])
+        new_start = self.allocate_slots(capacity)
+
+        new_slots = slice(new_start, new_start + size)
+        old_slots = slice(start, start + size)
+        self.synapse_presyn[new_slots] = self.synapse_presyn[old_slots]
+        self.synapse_perm[new_slots] = self.synapse_perm[old_slots]
+        self.synapse_segment[new_slots] = segment
+        self.synapse_presyn[old_slots] = -1
+        self.synapse_segment[old_slots] = -1
+
+        self.free_slots += int(self.segment_capacity[segment])
+        self.segment_start[segment] = new_start
+        self.segment_capacity[segment] = capacity
+
+        # reclaim the free space once it makes up most of the synapse arrays
+        if self.free_slots > 4096 and 2 * self.free_slots > self.synapse_top:
+            self.compact()
+
+    def add_synapses(self, segment, presyn, perms):
+        #
+        # a function that appends synapses to one segment
+        #
+        # arguments:
+        #           segment = an integer, the segment id
+        #           presyn = an ndarray of the presynaptic cells
+        #           perms = an ndarray of the permanence values
+        #
+        presyn = np.asarray(presyn)[:self.max_synapses_per_segment]
+        perms = np.asarray(perms)[:self.max_synapses_per_segment]
+        count = len(presyn)
+        self.make_room(segment, count)
+        size = int(self.segment_size[segment])
+        if size + count > self.segment_capacity[segment]:
+            self.relocate(segment, min(max(2 * int(self.segment_capacity[segment]), size + count),
+                                       self.max_synapses_per_segment))
+
+        start = int(self.segment_start[segment]) + size
+        self.synapse_presyn[start:start + count] = presyn
+        self.synapse_perm[start:start + count] = perms
+        self.synapse_segment[start:start + count] = segment
+        self.segment_size[segment] = size + count
+        self.segment_perm_sum[segment] += self.synapse_perm[start:start + count].sum(dtype=np.float64)
+        self.index_synapses(np.full(count, segment), presyn)
+
+    def remove_synapses(self, segment, keep):
+        #
+        # a function that removes synapses from a segment, the others keep their order
+        #
+        # arguments:
+        #           segment = an integer, the segment id
+        #           keep = a boolean ndarray, one entry per synapse of the segment, False for those to remove
+        #
+        slots = self.get_synapses(segment)
+        presyn = self.synapse_presyn[slots]
+        self.dirty_segments[segment] = True
+        for cell in presyn[~keep].tolist():
+            fed = self.presyn_segments[cell]
+            fed[segment] -= 1
+            if fed[segment] == 0:
+                del fed[segment]
+                if len(fed) == 0:
+                    del self.presyn_segments[cell]
+
+        self.segment_perm_sum[segment] -= self.synapse_perm[slots][~keep].sum(dtype=np.float64)
+
+        count = int(np.count_nonzero(keep))
+        self.synapse_presyn[slots.start:slots.start + count] = presyn[keep]
+        self.synapse_perm[slots.start:slots.start + count] = self.synapse_perm[slots][keep]
+        self.synapse_presyn[slots.start + count:slots.stop] = -1
+        self.synapse_segment[slots.start + count:slots.stop] = -1
+        self.segment_size[segment] = count
+        self.num_removed_synapses += len(keep) - count
+
+    def make_room(self, segment, count):
+        #
+        # a function that removes the weakest synapses of a segment so count more fit under max_synapses_per_segment
+        #
+        excess = int(self.segment_size[segment]) + count - self.max_synapses_per_segment
+        if excess <= 0:
+            return
+        perms = self.synapse_perm[self.get_synapses(segment)]
+        keep = np.ones(len(perms), dtype=bool)
+        keep[np.argsort(perms, kind='stable')[:excess]] = False
+        self.remove_synapses(segment, keep)
+
+    def prune_synapses(self, segments, perm_floor):
+        #
+        # a function that removes the synapses whose permanence value has fallen to perm_floor or below
+        #
+        # arguments:
+        #           segments = a list of segment ids
+        #           perm_floor = a float
+        #
+        for segment in segments:
+            keep = self.synapse_perm[self.get_synapses(segment)] > perm_floor
+            if not keep.all():
+                self.remove_synapses(segment, keep)
+
+    def update_perms(self, slots, deltas):
+        #
+        # a function that changes the permanence values of some synapses and the totals of their segments
+        #
+        # arguments:
+        #           slots = an ndarray (or slice) of synapse slots, each listed once
+        #           deltas = a float or an ndarray, what to add to the permanence value of each synapse
+        #
+        old = self.synapse_perm[slots].astype(np.float64)
+        self.synapse_perm[slots] += np.asarray(deltas, dtype=np.float32)
+        # the change actually stored, after rounding to float32
+        changes = self.synapse_perm[slots] - old
+        np.add.at(self.segment_perm_sum, self.synapse_segment[slots], changes)
+        self.dirty_segments[self.synapse_segment[slots]] = True
+
+    def append_synapses(self, segments, presyn, perms):
+        #
+        # a function that appends one synapse to each of several different segments
+        #
+        # arguments:
+        #           segments = an ndarray of distinct segment ids
+        #           presyn = an ndarray, the presynaptic cell of the synapse for every segment
+        #           perms = an ndarray, the permanence value of the synapse for every segment
+        #
+        segments = np.asarray(segments, dtype=np.int64)
+        presyn = np.asarray(presyn)
+        perms = np.asarray(perms)
+
+        # a full segment gets the new synapse in place of its weakest one
+        full = self.segment_size[segments] >= self.max_synapses_per_segment
+        if full.any():
+            self.replace_weakest(segments[full], presyn[full], perms[full])
+            segments, presyn, perms = segments[~full], presyn[~full], perms[~full]
+
+        for segment in segments[self.segment_size[segments] >= self.segment_capacity[segments]].tolist():
+            self.relocate(segment, min(2 * int(self.segment_capacity[segment]), self.max_synapses_per_segment))
+
+        slots = self.segment_start[segments] + self.segment_size[segments]
+        self.synapse_presyn[slots] = presyn
+        self.synapse_perm[slots] = perms
+        self.synapse_segment[slots] = segments
+        self.segment_size[segments] += 1
+        self.segment_perm_sum[segments] += self.synapse_perm[slots]
+        self.index_synapses(segments, presyn)
+
+    def replace_weakest(self, segments, presyn, perms):
+        #
+        # a function that overwrites the weakest synapse of each of several different segments with a new one
+        #
+        # arguments:
+        #           segments = an ndarray of distinct segment ids
+        #           presyn = an ndarray, the presynaptic cell of the new synapse for every segment
+        #           perms = an ndarray, the permanence value of the new synapse for every segment
+        #
+        sizes = self.segment_size[segments]
+        slots = get_ranges(self.segment_start[segments], sizes)
+        owners = np.repeat(np.arange(len(segments)), sizes)
+        # the first synapse of each segment holding its smallest permanence value
+        perms_now = self.synapse_perm[slots]
+        smallest = np.minimum.reduceat(perms_now, np.cumsum(sizes) - sizes)
+        candidates = np.flatnonzero(perms_now == smallest[owners])
+        weakest = slots[candidates[np.unique(owners[candidates], return_index=True)[1]]]
+
+        for segment, cell in zip(segments.tolist(), self.synapse_presyn[weakest].tolist()):
+            fed = self.presyn_segments[cell]
+            fed[segment] -= 1
+            if fed[segment] == 0:
+                del fed[segment]
+                if len(fed) == 0:
+                    del self.presyn_segments[cell]
+        self.segment_perm_sum[segments] -= self.synapse_perm[weakest]
+        self.num_removed_synapses += len(segments)
+
+        self.synapse_presyn[weakest] = presyn
+        self.synapse_perm[weakest] = perms
+        self.segment_perm_sum[segments] += self.synapse_perm[weakest]
+        self.index_synapses(segments, presyn)
+
+    def connect(self, segment, presyn, perms):
+        #
+        # a function that adds a synapse from a segment to every presynaptic cell; like every synapse in TM space,
+        # each one is also recorded in the current (newest) segment of the cell at its other end
+        #
+        # arguments:
+        #           segment = an integer, the segment id
+        #           presyn = an ndarray of the cells to connect to (the segment's own cell is skipped)
+        #           perms = an ndarray of the permanence values, one per presynaptic cell
+        #
+        cell = int(self.segment_cell[segment])
+        presyn = np.asarray(presyn, dtype=np.int64)
+        perms = np.asarray(perms)
+        keep = presyn != cell
+        presyn, perms = presyn[keep], perms[keep]
+        if len(presyn) == 0:
+            return
+
+        self.add_synapses(segment, presyn, perms)
+
+        # the other ends: cells seen for the first time get their first segment
+        for other in np.unique(presyn).tolist():
+            if not self.cell_segments.get(other):
+                self.create_segment(other)
+        self.connect_ends(cell, presyn, perms)
+
+    def connect_ends(self, cell, presyn, perms):
+        #
+        # a function that records synapses from a cell in the current (newest) segment of every cell at their
+        # other end, the second half of connect; every cell at the other end already has a segment
+        #
+        # arguments:
+        #           cell = an integer, the cell the synapses start from
+        #           presyn = an int64 ndarray of the cells at the other ends
+        #           perms = an ndarray of the permanence values, one per other end
+        #
+        targets = [self.cell_segments[c][-1] for c in presyn.tolist()]
+        self.append_in_order(targets, np.full(len(presyn), cell), perms)
+
+    def append_in_order(self, segments, presyn, perms):
+        #
+        # a function that appends one synapse per entry to the segments, in rounds of distinct segments: a segment
+        # listed more than once gets its synapses one after the other, in the order given, see append_synapses
+        #
+        # arguments:
+        #           segments = a list or ndarray of segment ids, repeats allowed
+        #           presyn = an ndarray of the presynaptic cells, one per entry
+        #           perms = an ndarray of the permanence values, one per entry
+        #
+        segments = np.asarray(segments, dtype=np.int64)
+        if len(segments) == 0:
+            return
+        presyn = np.asarray(presyn, dtype=np.int64)
+        perms = np.asarray(perms)
+
+        # the round of an entry is the number of earlier entries to the same segment
+        order = np.argsort(segments, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(segments[order]) != 0])
+        rounds = np.empty(len(segments), dtype=np.int64)
+        rounds[order] = np.arange(len(segments)) - np.repeat(starts, np.diff(np.r_[starts, len(segments)]))
+        for r in range(int(rounds.max()) + 1):
+            batch = rounds == r
+            self.append_synapses(segments[batch], presyn[batch], perms[batch])
+
+    def grow_segment(self, cell, presyn, perms):
+        #
+        # a function that adds a new segment to a cell and connects it to every presynaptic cell, see connect
+        #
+        # returns: segment = an integer, the id of the new segment
+        #
+        segment = self.create_segment(cell, len(presyn))
+        self.connect(segment, presyn, perms)
+
+        return segment
+
+    def connect_cells(self, cells, presyn_ls, perms_ls, new_segments=True):
+        #
+        # a function that connects each of several cells, one after the other, to its presynaptic cells, see connect
+        #
+        # arguments:
+        #           cells = a list of cell numbers
+        #           presyn_ls = a list of ndarrays, the presynaptic cells of every cell
+        #           perms_ls = a list of ndarrays, the permanence values of every cell
+        #           new_segments = a boolean, default is True; if True every cell grows a new segment for its
+        #                          synapses, see grow_segment, otherwise they go to its first segment (created if the
+        #                          cell has none)
+        #
+        # the other ends are queued and appended in rounds, see append_in_order; the queue is emptied before a cell
+        # with queued synapses changes its segments, so every segment gets its synapses in the serial order
+        queued_segments, queued_presyn, queued_perms = [], [], []
+        queued_cells = set()
+        for cell, presyn, perms in zip(cells, presyn_ls, perms_ls):
+            if cell in queued_cells:
+                self.append_queued(queued_segments, queued_presyn, queued_perms)
+                queued_cells.clear()
+            segments = self.get_segments(cell)
+            if new_segments:
+                segment = self.create_segment(cell, len(presyn))
+            elif segments:
+                segment = segments[0]
+            else:
+                segment = self.create_segment(cell)
+
+            presyn = np.asarray(presyn, dtype=np.int64)
+            perms = np.asarray(perms)
+            keep = presyn != cell
+            presyn, perms = presyn[keep], perms[keep]
+            if len(presyn) == 0:
+                continue
+            self.add_synapses(segment, presyn, perms)
+            for other in np.unique(presyn).tolist():
+                if not self.cell_segments.get(other):
+                    self.create_segment(other)
+
+            queued_segments.append(np.array([self.cell_segments[c][-1] for c in presyn.tolist()], dtype=np.int64))
+            queued_presyn.append(np.full(len(presyn), cell, dtype=np.int64))
+            queued_perms.append(perms)
+            queued_cells.update(presyn.tolist())
+        self.append_queued(queued_segments, queued_presyn, queued_perms)
+
+    def append_queued(self, segments_ls, presyn_ls, perms_ls):
+        #
+        # a function that appends the queued synapses of connect_cells and empties the queue, see append_in_order
+        #
+        # arguments:
+        #           segments_ls = a list of ndarrays, the target segments of every queued cell
+        #           presyn_ls = a list of ndarrays, the presynaptic cells of every queued cell
+        #           perms_ls = a list of ndarrays, the permanence values of every queued cell
+        #
+        if segments_ls:
+            self.append_in_order(np.concatenate(segments_ls), np.concatenate(presyn_ls), np.concatenate(perms_ls))
+            del segments_ls[:], presyn_ls[:], perms_ls[:]
+
+    def get_synapses(self, segment):
+        #
+        # a function that gives the synapse slots of a segment
+        #
+        # returns: slots = a slice into the synapse arrays
+        #
+        start = int(self.segment_start[segment])
+        return slice(start, start + int(self.segment_size[segment]))
+
+    def get_segments(self, cell):
+        #
+        # a function that lists the segment ids of a cell, oldest first
+        #
+        return self.cell_segments.get(int(cell), [])
+
+    def get_current_segment(self, cell):
+        #
+        # a function that gives the newest segment of a cell, or None if it has none
+        #
+        segments = self.cell_segments.get(int(cell))
+        if not segments:
+            return None
+        return segments[-1]
+
+    def index_synapses(self, segments, presyn):
+        #
+        # a function that records new synapses in the reverse index
+        #
+        # arguments:
+        #           segments = an ndarray, the segment of every new synapse
+        #           presyn = an ndarray, the presynaptic cell of every new synapse
+        #
+        self.dirty_segments[np.asarray(segments, dtype=np.int64)] = True
+        for segment, cell in zip(np.asarray(segments).tolist(), np.asarray(presyn).tolist()):
+            fed = self.presyn_segments.setdefault(cell, {})
+            fed[segment] = fed.get(segment, 0) + 1
+
+    def get_active_segments(self, active_cells):
+        #
+        # a function that finds the segments fed by the active cells, visiting only the synapses of those cells
+        #
+        # arguments:
+        #           active_cells = an ndarray of the active cell numbers
+        #
+        # returns:
+        #           segments = an int64 ndarray, the sorted ids of the segments with at least one active synapse
+        #
+        fed_segments = []
+        for cell in np.unique(active_cells).tolist():
+            fed_segments.extend(self.presyn_segments.get(cell, {}))
+
+        return np.unique(np.array(fed_segments, dtype=np.int64))
+
+    def record_activity(self, segments):
+        #
+        # a function that marks segments as active at the current iteration, so they are the last to be evicted
+        #
+        self.segment_last_active[np.asarray(segments, dtype=np.int64)] = self.iteration
+
+    def get_active_mask(self, active_cells):
+        #
+        # a function that turns a list of active cell numbers into a boolean array over every cell
+        #
+        active_mask = np.zeros(self.num_cells, dtype=bool)
+        active_mask[np.asarray(active_cells, dtype=np.int64)] = True
+        return active_mask
+
+    def get_overlap_scores(self, segments, active_mask):
+        #
+        # a function that counts, for each segment, the synapses with an active end (its own cell or the
+        # presynaptic cell), in one pass over all the segments' synapses
+        #
+        # arguments:
+        #           segments = an ndarray of segment ids
+        #           active_mask = a boolean ndarray, True for every active cell
+        #
+        # returns: scores = an int64 ndarray, one count per segment
+        #
+        segments = np.asarray(segments, dtype=np.int64)
+        sizes = self.segment_size[segments]
+        slots = get_ranges(self.segment_start[segments], sizes)
+        owners = np.repeat(np.arange(len(segments)), sizes)
+        active = active_mask[self.synapse_presyn[slots]] | active_mask[self.segment_cell[segments]][owners]
+
+        return np.bincount(owners[active], minlength=len(segments))
+
+    def get_best_overlaps(self, cells, active_mask):
+        #
+        # a function that gets, for every cell, the best overlap score between the active cells and one of its
+        # segments; all segments of the cells are scored together
+        #
+        # arguments:
+        #           cells = a list of cell numbers
+        #           active_mask = a boolean ndarray, True for every active cell
+        #
+        # returns: scores = an int64 ndarray, one score per cell (0 for a cell without segments)
+        #
+        segment_ls = [self.get_segments(cell) for cell in cells]
+        segments = np.array([segment for segments in segment_ls for segment in segments], dtype=np.int64)
+        counts = np.array([len(segments) for segments in segment_ls], dtype=np.int64)
+
+        scores = np.zeros(len(cells), dtype=np.int64)
+        np.maximum.at(scores, np.repeat(np.arange(len(cells)), counts), self.get_overlap_scores(segments, active_mask))
+
+        return scores
+
+    def adapt_segments(self, cells, active_mask, inc_val, dec_val, perm_floor):
+        #
+        # a function that updates the permanence values of every segment of some cells: synapses with an active end
+        # are increased by inc_val, the others are decreased by dec_val; then the synapses whose permanence value
+        # has fallen to perm_floor or below are removed
+        #
+        # arguments:
+        #           cells = a list of distinct cell numbers
+        #           active_mask = a boolean ndarray, True for every active cell
+        #           inc_val, dec_val, perm_floor = floats
+        #
+        segments = [segment for cell in cells for segment in self.get_segments(cell)]
+        segment_ids = np.array(segments, dtype=np.int64)
+        sizes = self.segment_size[segment_ids]
+        slots = get_ranges(self.segment_start[segment_ids], sizes)
+        owners = np.repeat(self.segment_cell[segment_ids], sizes)
+        matched = active_mask[self.synapse_presyn[slots]] | active_mask[owners]
+        self.update_perms(slots, np.where(matched, inc_val, -dec_val))
+        self.prune_synapses(segments, perm_floor)
+
+    def activate_segments(self, active_cells, threshold):
+        #
+        # a function that marks the segments fed by the active cells as active and picks those whose permanence
+        # values add up to more than threshold
+        #
+        # arguments:
+        #           active_cells = an ndarray of the active cell numbers
+        #           threshold = a float
+        #
+        # returns: segments = an int64 ndarray, the sorted ids of the picked segments
+        #
+        segments = self.get_active_segments(active_cells)
+        self.record_activity(segments)
+
+        return segments[self.get_segment_perm_sums(segments) > threshold]
+
+    def get_segment_perm_sums(self, segments=None):
+        #
+        # a function that gives the total permanence value of each segment, as kept up to date in segment_perm_sum
+        #
+        # arguments:
+        #           segments = an ndarray of segment ids, default is every segment
+        #
+        # returns: sums = a float64 ndarray, one total per segment
+        #
+        if segments is None:
+            return self.segment_perm_sum[:self.num_segments].copy()
+        return self.segment_perm_sum[np.asarray(segments, dtype=np.int64)]
+
+    def compute_segment_perm_sums(self, segments=None):
+        #
+        # a function that adds up the permanence values of every synapse of each segment from scratch
+        #
+        # arguments:
+        #           segments = an ndarray of segment ids, default is every segment
+        #
+        # returns: sums = a float64 ndarray, one total per segment
+        #
+        if segments is None:
+            live = self.get_live_synapses()
+            return np.bincount(self.synapse_segment[live], weights=self.synapse_perm[live], minlength=self.num_segments)
+
+        segments = np.asarray(segments, dtype=np.int64)
+        sizes = self.segment_size[segments]
+        slots = get_ranges(self.segment_start[segments], sizes)
+        owners = np.repeat(np.arange(len(segments)), sizes)
+        return np.bincount(owners, weights=self.synapse_perm[slots], minlength=len(segments))
+
+    def get_live_synapses(self):
+        #
+        # a function that lists the slots holding a synapse
+        #
+        return np.flatnonzero(self.synapse_segment[:self.synapse_top] >= 0)
+
+    def get_num_segments(self):
+        return int(np.count_nonzero(self.segment_cell[:self.num_segments] >= 0))
+
+    def get_num_synapses(self):
+        return int(self.segment_size[:self.num_segments].sum())
+
+    def get_nbytes(self):
+        arrays = [self.segment_cell, self.segment_start, self.segment_size, self.segment_capacity,
+                  self.segment_last_active, self.synapse_presyn, self.synapse_perm, self.synapse_segment]
+        return sum(array.nbytes for array in arrays)
+
+    def get_counts(self):
+        #
+        # a function that reports the size of the store
+        #
+        # returns: counts = a dictionary of the live segment and synapse counts, the evicted segment and removed
+        #                   synapse totals, and the bytes held by the arrays
+        #
+        return {'segments': self.get_num_segments(), 'synapses': self.get_num_synapses(),
+                'evicted_segments': self.num_evicted_segments, 'removed_synapses': self.num_removed_synapses,
+                'nbytes': self.get_nbytes()}
+
+    def check_consistency(self):
+        #
+        # a function that recomputes the segment totals, the reverse index and the segment lists from the synapse
+        # arrays and compares them with the ones kept up to date; for debugging, it visits every synapse
+        #
+        # raises: RuntimeError, naming the first structure that does not match
+        #
+        segments = np.flatnonzero(self.segment_cell[:self.num_segments] >= 0)
+        sums = self.compute_segment_perm_sums()
+        if not np.allclose(sums, self.segment_perm_sum[:self.num_segments], rtol=1e-9, atol=1e-6):
+            worst = int(np.argmax(np.abs(sums - self.segment_perm_sum[:self.num_segments])))
+            raise RuntimeError("segment_perm_sum of segment %d is %.6f, its synapses add up to %.6f"
+                               % (worst, self.segment_perm_sum[worst], sums[worst]))
+
+        live = self.get_live_synapses()
+        if len(live) != self.get_num_synapses() or np.any(self.segment_size[segments] > self.segment_capacity[segments]):
+            raise RuntimeError("segment sizes do not match the synapse slots")
+
+        index = {}
+        for cell, segment in zip(self.synapse_presyn[live].tolist(), self.synapse_segment[live].tolist()):
+            index[(cell, segment)] = index.get((cell, segment), 0) + 1
+        kept = {(cell, segment): count for cell, fed in self.presyn_segments.items()
+                for segment, count in fed.items()}
+        if index != kept:
+            raise RuntimeError("presyn_segments does not match the synapse arrays")
+
+        listed = sorted(segment for cell_segments in self.cell_segments.values() for segment in cell_segments)
+        if listed != segments.tolist():
+            raise RuntimeError("cell_segments does not match segment_cell")
+
+    def get_state(self, delta=False):
+        #
+        # a function that copies the store into flat arrays, ready to be saved with numpy.savez; every segment is
+        # written as its cell and list of (presynaptic cell, permanence value) pairs, so the state does not depend
+        # on where the blocks sit in the synapse arrays
+        #
+        # arguments:
+        #           delta = a boolean, default is False; if True only the segments and cell lists that changed since
+        #                   the last call are written, to be applied on top of the state saved then (the last
+        #                   activity of the segments, one integer each, is always written in full)
+        #
+        # returns: state = a dictionary of ndarrays
+        #
+        if delta:
+            segments = np.flatnonzero(self.dirty_segments[:self.num_segments])
+            cells = np.array(sorted(self.dirty_cells), dtype=np.int64)
+        else:
+            segments = np.arange(self.num_segments)
+            cells = np.array(sorted(self.cell_segments), dtype=np.int64)
+        sizes = self.segment_size[segments]
+        slots = get_ranges(self.segment_start[segments], sizes)
+        cell_lists = [self.cell_segments.get(cell, []) for cell in cells.tolist()]
+
+        state = {
+            'shape': np.array([self.x, self.y, self.z]),
+            'limits': np.array([self.min_segment_capacity, self.max_segments_per_cell, self.max_synapses_per_segment]),
+            'counters': np.array([self.num_segments, self.iteration, self.num_evicted_segments,
+                                  self.num_removed_synapses]),
+            'free_segments': np.array(self.free_segments, dtype=np.int64),
+            'segments': segments,
+            'segment_cell': self.segment_cell[segments],
+            'segment_size': sizes,
+            'segment_last_active': self.segment_last_active[:self.num_segments],
+            'synapse_presyn': self.synapse_presyn[slots],
+            'synapse_perm': self.synapse_perm[slots],
+            'list_cells': cells,
+            'list_lengths': np.array([len(cell_list) for cell_list in cell_lists], dtype=np.int64),
+            'list_segments': np.array([segment for cell_list in cell_lists for segment in cell_list], dtype=np.int64),
+        }
+
+        self.dirty_segments[:] = False
+        self.dirty_cells = set()
+
+        return state
+
+    def set_state(self, state):
+        #
+        # a function that loads a state written by get_state: a full state into an empty store, or a delta on top
+        # of the state it followed
+        #
+        # arguments:
+        #           state = a dictionary (or numpy npz file) of the ndarrays written by get_state
+        #
+        num_segments, iteration, num_evicted_segments, num_removed_synapses = state['counters'].tolist()
+        self.min_segment_capacity, self.max_segments_per_cell, self.max_synapses_per_segment = state['limits'].tolist()
+        self.reserve_segments(num_segments - self.num_segments)
+        self.num_segments = max(self.num_segments, num_segments)
+
+        # the segments in the state replace whatever the store holds under their ids
+        segments = state['segments']
+        for segment in segments.tolist():
+            if self.segment_cell[segment] >= 0:
+                self.remove_synapses(segment, np.zeros(int(self.segment_size[segment]), dtype=bool))
+                self.free_slots += int(self.segment_capacity[segment])
+
+        sizes = state['segment_size'].astype(np.int64)
+        live = state['segment_cell'] >= 0
+        capacities = np.where(live, np.maximum(sizes, self.min_segment_capacity), 0)
+        first = self.allocate_slots(int(capacities.sum()))
+        starts = first + np.cumsum(capacities) - capacities
+        self.segment_cell[segments] = state['segment_cell']
+        self.segment_start[segments] = starts
+        self.segment_size[segments] = sizes
+        self.segment_capacity[segments] = capacities
+        self.segment_last_active[:num_segments] = state['segment_last_active']
+
+        slots = get_ranges(starts, sizes)
+        owners = np.repeat(segments, sizes)
+        self.synapse_presyn[slots] = state['synapse_presyn']
+        self.synapse_perm[slots] = state['synapse_perm']
+        self.synapse_segment[slots] = owners
+        self.segment_perm_sum[segments] = np.bincount(np.repeat(np.arange(len(segments)), sizes),
+                                                      weights=self.synapse_perm[slots], minlength=len(segments))
+        self.index_synapses(owners, state['synapse_presyn'])
+
+        offsets = np.cumsum(state['list_lengths']) - state['list_lengths']
+        list_segments = state['list_segments'].tolist()
+        for cell, offset, length in zip(state['list_cells'].tolist(), offsets.tolist(), state['list_lengths'].tolist()):
+            if length > 0:
+                self.cell_segments[cell] = list_segments[offset:offset + length]
+            else:
+                self.cell_segments.pop(cell, None)
+        self.free_segments = state['free_segments'].tolist()
+        self.iteration = iteration
+        self.num_evicted_segments = num_evicted_segments
+        self.num_removed_synapses = num_removed_synapses
+
+        self.dirty_segments[:] = False
+        self.dirty_cells = set()
+
+    def compact(self):
+        #
+        # a function that packs every segment's block back to back, dropping the free space left by moved segments;
+        # blocks keep their capacity, as compact can run while a caller is filling segments it has just grown
+        #
+        segments = np.flatnonzero(self.segment_cell[:self.num_segments] >= 0)
+        sizes = self.segment_size[segments].astype(np.int64)
+        capacities = self.segment_capacity[segments].astype(np.int64)
+        new_starts = np.cumsum(capacities) - capacities
+
+        old_slots = get_ranges(self.segment_start[segments], sizes)
+        new_slots = get_ranges(new_starts, sizes)
+        total = int(capacities.sum())
+
+        presyn = np.full(max(total, 256), -1, dtype=np.int32)
+        perms = np.zeros(len(presyn), dtype=np.float32)
+        owners = np.full(len(presyn), -1, dtype=np.int32)
+        presyn[new_slots] = self.synapse_presyn[old_slots]
+        perms[new_slots] = self.synapse_perm[old_slots]
+        owners[new_slots] = self.synapse_segment[old_slots]
+
+        self.synapse_presyn, self.synapse_perm, self.synapse_segment = presyn, perms, owners
+        self.segment_start[segments] = new_starts
+        self.segment_capacity[segments] = capacities
+        self.synapse_top = total
+        self.free_slots = 0
+
+
+def grow(array, size, fill):
+    #
+    # a function that returns a copy of array extended to size entries, the new entries set to fill
+    #
+    output = np.full(size, fill, dtype=array.dtype)
+    output[:len(array)] = array
+    return output
@@ -0,0 +1,375 @@
+import numpy as np
+
+#
+# Object called Multi_Stream_Temporal_Memory - N independent temporal memories of the same size, advanced together
+#
+# every stream has its own cells, segments, permanence values, threshold and state between steps, exactly like
+# one Temporal_Memory, but all streams live in the same fixed-capacity arrays and one call to compute moves all of
+# them forward a step with numpy operations over the stack instead of python loops per stream and per cell
+#
+# a cell holds up to max_segments_per_cell segment slots and a segment up to max_synapses_per_segment synapse slots;
+# segment r of the stack is cell r // S of its stream, slot r % S (S = max_segments_per_cell), and its synapses are
+# kept packed at the start of row r of presyn and perm. All slots are allocated up front, so a stream holds
+# num_cells*(S*(max_synapses_per_segment*6 + 21) + 10) bytes from the first step (about 431 KB for 10x10x5 with the
+# defaults), where the Connections store of one Temporal_Memory starts small and grows as it learns; smaller
+# capacities save memory but make the streams predict less. The learning rules are those of Temporal_Memory:
+# synapses are recorded in the segments of both of their ends, a column with predictive cells activates one of them
+# at random and otherwise bursts, the learning cell of a bursting column is the one with the largest segment,
+# learning cells grow a segment to the next step's active cells, a full cell replaces its least recently active
+# segment, a full segment replaces its weakest synapse, and a cell is predictive when a segment fed by an active
+# cell has a total permanence above the stream's threshold
+#
+# attributes:
+#           num_streams = an integer, N
+#           x, y, z = integers, the size of the TM space of every stream
+#           num_columns, num_cells = integers, x*y and x*y*z, per stream
+#           max_synapses_count = an integer, for the maximum number of synapses per cell during initialization
+#           max_segments_per_cell, max_synapses_per_segment = integers, the capacity of a cell and of a segment
+#           learn_inc_val, learn_dec_val = floats, by how much permanence values are increased and decreased
+#           perm_floor = a float, synapses whose permanence value falls to perm_floor or below are removed
+#           rng = a numpy.random.Generator
+#           presyn = an ndarray of shape (N*num_cells*S, max_synapses_per_segment), the presynaptic cell (within
+#                           the stream) of every synapse slot, num_cells if the slot is empty
+#           perm = a float32 ndarray of the same shape, the permanence value of every synapse slot (0 if empty)
+#           segment_used = a boolean ndarray of shape (N, num_cells, S), True for every segment slot in use
+#           segment_size = an int32 ndarray of shape (N, num_cells, S), the number of synapses of every segment
+#           segment_perm_sum = a float64 ndarray of shape (N, num_cells, S), the total permanence of every segment
+#           segment_last_active = an int64 ndarray of shape (N, num_cells, S), the step every segment was last active
+#           newest_segment = an int64 ndarray of shape (N, num_cells), the slot of every cell's newest segment
+#           pred_state_threshold = a float64 ndarray of shape (N,), the threshold of every stream
+#           predictive_cells = a boolean ndarray of shape (N, num_cells), the cells predicted for the next step
+#           learning_cells = a boolean ndarray of shape (N, num_cells), the learning cells of the last step
+#           step = an integer, how many steps have been computed
+#           num_evicted_segments, num_removed_synapses = int64 ndarrays of shape (N,), the totals of every stream
+#
+# functions:
+#           __init__(., num_streams, spatial_pooler_dim, cells_per_column, max_synapses_count, pred_state_threshold,
+#                   learn_inc_val, learn_dec_val, max_segments_per_cell, max_synapses_per_segment, perm_floor, seed)
+#           initialize_connections(.)
+#           get_rows(., streams, cells, slots)
+#           append_synapses(., rows, presyn, perms)
+#           pack_rows(., rows)
+#           update_segments(., rows)
+#           get_active_columns(., active_columns)
+#           compute(., active_columns, learn)
+#           learn(., active_cells, winners)
+#           get_predictive_cells(., active_cells)
+#           get_counts(.)
+#
+# object: Multi_Stream_Result, what one step produced for every stream
+#
+# attributes:
+#           step = an integer
+#           active_cells = a boolean ndarray of shape (N, num_cells)
+#           learning_cells = a boolean ndarray of shape (N, num_cells)
+#           predictive_cells = a boolean ndarray of shape (N, num_cells), the cells predicted for the next step
+#           predicted_fraction = a float64 ndarray of shape (N,), the fraction of every stream's active columns that
+#                           had a predictive cell (1.0 for a stream without active columns)
+#
+
+class Multi_Stream_Temporal_Memory():
+    def __init__(self, num_streams, spatial_pooler_dim=(10, 10), cells_per_column=5, max_synapses_count=7,
+                 pred_state_threshold=0.7, learn_inc_val=0.1, learn_dec_val=0.2, max_segments_per_cell=4,
+                 max_synapses_per_segment=32, perm_floor=0.0, seed=None):
+        self.num_streams = num_streams
+        self.x, self.y = spatial_pooler_dim
+        self.z = cells_per_column
+        self.num_columns = self.x * self.y
+        self.num_cells = self.num_columns * self.z
+        self.max_synapses_count = max_synapses_count
+        self.max_segments_per_cell = max_segments_per_cell
+        self.max_synapses_per_segment = max_synapses_per_segment
+        self.learn_inc_val = learn_inc_val
+        self.learn_dec_val = learn_dec_val
+        self.perm_floor = perm_floor
+        self.rng = np.random.default_rng(seed)
+
+        # the smallest integer type that holds every cell number of a stream plus the empty marker
+        presyn_dtype = np.int16 if self.num_cells < np.iinfo(np.int16).max else np.int32
+        num_rows = num_streams * self.num_cells * max_segments_per_cell
+        self.presyn = np.full((num_rows, max_synapses_per_segment), self.num_cells, dtype=presyn_dtype)
+        self.perm = np.zeros((num_rows, max_synapses_per_segment), dtype=np.float32)
+        self.segment_used = np.zeros((num_streams, self.num_cells, max_segments_per_cell), dtype=bool)
+        self.segment_size = np.zeros((num_streams, self.num_cells, max_segments_per_cell), dtype=np.int32)
+        self.segment_perm_sum = np.zeros((num_streams, self.num_cells, max_segments_per_cell), dtype=np.float64)
+        self.segment_last_active = np.zeros((num_streams, self.num_cells, max_segments_per_cell), dtype=np.int64)
+        self.newest_segment = np.zeros((num_streams, self.num_cells), dtype=np.int64)
+
+        self.pred_state_threshold = np.full(num_streams, pred_state_threshold, dtype=np.float64)
+        self.predictive_cells = np.zeros((num_streams, self.num_cells), dtype=bool)
+        self.learning_cells = np.zeros((num_streams, self.num_cells), dtype=bool)
+        self.step = 0
+        self.num_evicted_segments = np.zeros(num_streams, dtype=np.int64)
+        self.num_removed_synapses = np.zeros(num_streams, dtype=np.int64)
+
+        self.initialize_connections()
+
+    def initialize_connections(self):
+        #
+        # a function that gives every cell of every stream its first segment, connected to between 1 and
+        # max_synapses_count randomly selected cells of the same stream, as Temporal_Memory does
+        #
+        counts = self.rng.integers(1, self.max_synapses_count + 1, size=(self.num_streams, self.num_cells)).ravel()
+        owners = np.repeat(np.arange(self.num_streams * self.num_cells), counts)
+        streams = owners // self.num_cells
+        cells = owners % self.num_cells
+        targets = self.rng.integers(0, self.num_cells, size=len(owners))
+        perms = self.rng.random(len(owners)).astype(np.float32)
+
+        # a cell does not connect to itself
+        keep = targets != cells
+        streams, cells, targets, perms = streams[keep], cells[keep], targets[keep], perms[keep]
+
+        self.segment_used[:, :, 0] = True
+        zero = np.zeros(len(cells), dtype=np.int64)
+        # every synapse is recorded in the segment of both of its ends
+        self.append_synapses(self.get_rows(streams, cells, zero), targets, perms)
+        self.append_synapses(self.get_rows(streams, targets, zero), cells, perms)
+
+    def get_rows(self, streams, cells, slots):
+        #
+        # a function that gives the rows of presyn and perm of segment slots
+        #
+        return (streams * self.num_cells + cells) * self.max_segments_per_cell + slots
+
+    def append_synapses(self, rows, presyn, perms):
+        #
+        # a function that appends synapses to segments, several per segment if need be; a synapse that does not fit
+        # replaces the weakest synapse the segment held before the call, and is dropped if those run out
+        #
+        # arguments:
+        #           rows = an ndarray, the segment row of every new synapse
+        #           presyn = an ndarray, the presynaptic cell (within the stream) of every new synapse
+        #           perms = an ndarray, the permanence value of every new synapse
+        #
+        if len(rows) == 0:
+            return
+        capacity = self.max_synapses_per_segment
+
+        # the rank of every new synapse among those going to the same segment
+        order = np.argsort(rows, kind='stable')
+        rows, presyn, perms = rows[order], presyn[order], perms[order]
+        targets, first, counts = np.unique(rows, return_index=True, return_counts=True)
+        rank = np.arange(len(rows)) - np.repeat(first, counts)
+
+        sizes = self.segment_size.ravel()[targets]
+        position = np.repeat(sizes, counts) + rank
+
+        # the synapses that do not fit take the places of the old ones, weakest first
+        overflow = position >= capacity
+        if overflow.any():
+            target_index = np.repeat(np.arange(len(targets)), counts)[overflow]
+            old_perms = np.where(np.arange(capacity) < sizes[:, None], self.perm[targets], np.inf)
+            weakest = np.argsort(old_perms[np.unique(target_index)], axis=1, kind='stable')
+            excess = position[overflow] - capacity
+            usable = excess < sizes[target_index]
+            row_of = np.searchsorted(np.unique(target_index), target_index)
+            position[np.flatnonzero(overflow)[usable]] = weakest[row_of[usable], excess[usable]]
+            position[np.flatnonzero(overflow)[~usable]] = -1
+            self.num_removed_synapses += np.bincount(rows[overflow] // (self.num_cells * self.max_segments_per_cell),
+                                                     minlength=self.num_streams)
+
+        keep = position >= 0
+        self.presyn[rows[keep], position[keep]] = presyn[keep]
+        self.perm[rows[keep], position[keep]] = perms[keep]
+        self.update_segments(targets)
+
+    def pack_rows(self, rows):
+        #
+        # a function that moves the synapses of segments back to the start of their rows after some were removed
+        #
+        order = np.argsort(self.presyn[rows] >= self.num_cells, axis=1, kind='stable')
+        self.presyn[rows] = np.take_along_axis(self.presyn[rows], order, axis=1)
+        self.perm[rows] = np.take_along_axis(self.perm[rows], order, axis=1)
+
+    def update_segments(self, rows):
+        #
+        # a function that recounts the size and the total permanence of segments whose synapses changed
+        #
+        self.segment_size.ravel()[rows] = np.count_nonzero(self.presyn[rows] < self.num_cells, axis=1)
+        self.segment_perm_sum.ravel()[rows] = self.perm[rows].sum(axis=1, dtype=np.float64)
+
+    def get_active_columns(self, active_columns):
+        #
+        # a function that turns the spatial pooler outputs of all streams into a boolean array
+        #
+        # arguments:
+        #           active_columns = a boolean ndarray of shape (N, x, y) or (N, x*y), or a list of N lists of
+        #                           the positions (i,j) of the active spatial pooler elements
+        #
+        # returns: columns = a boolean ndarray of shape (N, x*y)
+        #
+        if isinstance(active_columns, np.ndarray):
+            return active_columns.reshape(self.num_streams, self.num_columns).astype(bool)
+
+        columns = np.zeros((self.num_streams, self.num_columns), dtype=bool)
+        for stream, positions in enumerate(active_columns):
+            for i, j in positions:
+                columns[stream, i * self.y + j] = True
+
+        return columns
+
+    def compute(self, active_columns, learn=True):
+        #
+        # a function that moves every stream forward one step
+        #
+        # arguments:
+        #           active_columns = the spatial pooler output of every stream, see get_active_columns
+        #           learn = a boolean, default is True; if False, the permanence values, the segments and the
+        #                   thresholds are left as they are
+        #
+        # returns: result = a Multi_Stream_Result
+        #
+        self.step += 1
+        columns = self.get_active_columns(active_columns)
+        predictive = self.predictive_cells.reshape(self.num_streams, self.num_columns, self.z)
+
+        # a column with predictive cells activates one of them at random, any other active column bursts
+        predicted_columns = columns & predictive.any(axis=2)
+        bursting_columns = columns & ~predicted_columns
+        chosen = np.argmax(np.where(predictive, self.rng.random(predictive.shape), -1), axis=2)
+        active_cells = bursting_columns[:, :, None] & np.ones(self.z, dtype=bool)
+        active_cells |= predicted_columns[:, :, None] & (np.arange(self.z) == chosen[:, :, None])
+
+        # the learning cell of a bursting column is its cell with the largest segment (all of its cells are
+        # active, so every synapse of their segments counts), ties broken at random
+        largest = self.segment_size.reshape(self.num_streams, self.num_columns, self.z, -1)
+        streams, bursting = np.nonzero(bursting_columns)
+        scores = largest[streams, bursting].max(axis=2) + 0.5 * self.rng.random((len(bursting), self.z))
+        winners = chosen.copy()
+        winners[streams, bursting] = np.argmax(scores, axis=1)
+        learning_cells = columns[:, :, None] & (np.arange(self.z) == winners[:, :, None])
+
+        active_cells = active_cells.reshape(self.num_streams, self.num_cells)
+        learning_cells = learning_cells.reshape(self.num_streams, self.num_cells)
+
+        if learn:
+            self.learn(active_cells)
+            self.pred_state_threshold += 0.2
+            self.learning_cells = learning_cells
+        else:
+            self.learning_cells = np.zeros_like(learning_cells)
+
+        self.predictive_cells = self.get_predictive_cells(active_cells)
+
+        num_active = columns.sum(axis=1)
+        predicted_fraction = np.where(num_active > 0, predicted_columns.sum(axis=1) / np.maximum(num_active, 1), 1.0)
+
+        return Multi_Stream_Result(self.step, active_cells, learning_cells, self.predictive_cells, predicted_fraction)
+
+    def learn(self, active_cells):
+        #
+        # a function that makes the learning cells of the last step learn from the active cells of this one: the
+        # permanence values of all their segments are adjusted, decayed synapses are removed, and each grows a new
+        # segment connected to the active cells of its stream (at most max_synapses_per_segment of them)
+        #
+        # arguments:
+        #           active_cells = a boolean ndarray of shape (N, num_cells)
+        #
+        streams, cells = np.nonzero(self.learning_cells)
+        if len(cells) == 0:
+            return
+        S = self.max_segments_per_cell
+
+        # adjust: a synapse with an active end is increased, any other decreased
+        rows = (self.get_rows(streams, cells, 0)[:, None] + np.arange(S)).ravel()
+        row_streams = np.repeat(streams, S)
+        presyn = self.presyn[rows]
+        valid = presyn < self.num_cells
+        padded = np.concatenate([active_cells, np.zeros((self.num_streams, 1), dtype=bool)], axis=1)
+        matched = padded[row_streams[:, None], presyn] | np.repeat(active_cells[streams, cells], S)[:, None]
+        perm = self.perm[rows] + np.where(matched, self.learn_inc_val, -self.learn_dec_val).astype(np.float32)
+
+        # prune the synapses that have decayed away
+        pruned = valid & (perm <= self.perm_floor)
+        self.num_removed_synapses += np.bincount(row_streams, weights=pruned.sum(axis=1),
+                                                 minlength=self.num_streams).astype(np.int64)
+        self.perm[rows] = np.where(valid & ~pruned, perm, 0)
+        self.presyn[rows] = np.where(valid & ~pruned, presyn, self.num_cells)
+        self.pack_rows(rows)
+        self.update_segments(rows)
+
+        # a new segment for every learning cell, in a free slot or else its least recently active one
+        last_active = np.where(self.segment_used[streams, cells], self.segment_last_active[streams, cells], -1)
+        slots = np.argmin(last_active, axis=1)
+        evicted = self.segment_used[streams, cells, slots]
+        self.num_evicted_segments += np.bincount(streams[evicted], minlength=self.num_streams)
+        new_rows = self.get_rows(streams, cells, slots)
+        self.num_removed_synapses += np.bincount(streams, weights=self.segment_size.ravel()[new_rows],
+                                                 minlength=self.num_streams).astype(np.int64)
+        self.presyn[new_rows] = self.num_cells
+        self.perm[new_rows] = 0
+        self.update_segments(new_rows)
+        self.segment_used[streams, cells, slots] = True
+        self.segment_last_active[streams, cells, slots] = self.step
+        self.newest_segment[streams, cells] = slots
+
+        # pair every learning cell with the active cells of its stream, except itself
+        active_streams, active_ids = np.nonzero(active_cells)
+        per_stream = np.bincount(active_streams, minlength=self.num_streams)
+        stream_start = np.cumsum(per_stream) - per_stream
+        counts = per_stream[streams]
+        pair_learner = np.repeat(np.arange(len(cells)), counts)
+        pair_active = active_ids[np.repeat(stream_start[streams] - np.cumsum(counts) + counts, counts)
+                                 + np.arange(counts.sum())]
+        keep = pair_active != cells[pair_learner]
+        pair_learner, pair_active = pair_learner[keep], pair_active[keep]
+
+        # at most max_synapses_per_segment of them per new segment, chosen at random
+        order = np.lexsort((self.rng.random(len(pair_learner)), pair_learner))
+        pair_learner, pair_active = pair_learner[order], pair_active[order]
+        first = np.searchsorted(pair_learner, np.arange(len(cells)))
+        rank = np.arange(len(pair_learner)) - first[pair_learner]
+        keep = rank < self.max_synapses_per_segment
+        pair_learner, pair_active = pair_learner[keep], pair_active[keep]
+        perms = self.rng.random(len(pair_learner)).astype(np.float32)
+
+        pair_streams = streams[pair_learner]
+        self.append_synapses(new_rows[pair_learner], pair_active, perms)
+        # and the same synapses in the newest segment of the active cells
+        mirror_rows = self.get_rows(pair_streams, pair_active, self.newest_segment[pair_streams, pair_active])
+        self.append_synapses(mirror_rows, cells[pair_learner], perms)
+
+    def get_predictive_cells(self, active_cells):
+        #
+        # a function that finds, in every stream, the cells with a segment that is fed by an active cell and whose
+        # permanence values add up to more than the stream's threshold; only the segments above the threshold are
+        # looked at, and those fed by an active cell count as active at this step
+        #
+        # returns: predictive_cells = a boolean ndarray of shape (N, num_cells)
+        #
+        above = self.segment_perm_sum > self.pred_state_threshold[:, None, None]
+        streams, cells, slots = np.nonzero(above)
+        padded = np.concatenate([active_cells, np.zeros((self.num_streams, 1), dtype=bool)], axis=1)
+        fed = padded[streams[:, None], self.presyn[self.get_rows(streams, cells, slots)]].any(axis=1)
+
+        streams, cells, slots = streams[fed], cells[fed], slots[fed]
+        self.segment_last_active[streams, cells, slots] = self.step
+        predictive_cells = np.zeros((self.num_streams, self.num_cells), dtype=bool)
+        predictive_cells[streams, cells] = True
+
+        return predictive_cells
+
+    def get_counts(self):
+        #
+        # a function that reports the size of every stream
+        #
+        # returns: counts = a dictionary of int64 ndarrays of shape (N,): live segments and synapses, evicted
+        #                   segments and removed synapses; and the bytes held by all arrays, per stream
+        #
+        arrays = [self.presyn, self.perm, self.segment_used, self.segment_size, self.segment_perm_sum,
+                  self.segment_last_active, self.newest_segment, self.predictive_cells, self.learning_cells]
+        return {'segments': self.segment_used.sum(axis=(1, 2)),
+                'synapses': self.segment_size.sum(axis=(1, 2), dtype=np.int64),
+                'evicted_segments': self.num_evicted_segments.copy(),
+                'removed_synapses': self.num_removed_synapses.copy(),
+                'nbytes_per_stream': sum(array.nbytes for array in arrays) // self.num_streams}
+
+
+class Multi_Stream_Result():
+    def __init__(self, step, active_cells, learning_cells, predictive_cells, predicted_fraction):
+        self.step = step
+        self.active_cells = active_cells
+        self.learning_cells = learning_cells
+        self.predictive_cells = predictive_cells
+        self.predicted_fraction = predicted_fraction
@@ -1,32 +1,168 @@
-import numpy as np
-
-#
-# a function that takes a sequence of real numbers and encodes it into a sparse, binary matrix
-#
-# arguments: data, a list containing the elements of a numeric sequence
-#
-# returns: output_ls, a list containing the sparse, binary encoding of the elements of a numeric sequence
-#
-def numeric_encoder(data):
-
-    # determine range of numeric sequence
-    [n,m] = [np.min(data), np.max(data)]
-    # break that range up into 10 subintervals
-    i = 0; N = 10; h = (m-n)/N
-    output_ls = []
-    
-    for k in range(len(data)): 
-        
-        temp = [0 for j in range(N+1)]
-        # check to see which subinterval the sequence element is in
-        for i in range(N+1):
-            if (k >= (n + i*h)) & (k < (n + (i+1)*h)):
-                        # put a 1 in that subinterval
-                        temp[i] = 1
-
-            i+=1
-
-    output_ls.append(temp)
-
-    return output_ls 
-
+import numpy as np
+from sdr import SDR
+
+#
+# object: Scalar_Encoder, encodes real numbers into sparse, binary matrices: every value turns on a run of
+#         active_bits consecutive bits starting at its bucket, so close values share bits
+#
+# attributes:
+#           n_buckets = an integer, default is 43, the number of distinct positions a run of bits can start at
+#           active_bits = an integer, default is 7, the number of bits turned on for every value
+#           min_val, max_val = floats or None, default is None, the range of values; if either is None the range is
+#                       adaptive: it starts at the first values seen and widens to cover every later value
+#           periodic = a logical operator, default is False; if True the range wraps around (for example hour of
+#                       day) and the runs of bits wrap around the end of the encoding
+#           size = an integer, the number of bits used by the encoding, n_buckets if periodic, otherwise
+#                       n_buckets + active_bits - 1
+#           shape = a pair (m,n), default is (7,7), the shape of every encoded matrix, it has to hold at least size bits;
+#                       the default matches the default input_size of Spatial_Pooler
+#
+# functions:
+#           __init__(., n_buckets, active_bits, min_val, max_val, periodic, shape)
+#           update_range(., values)
+#           get_buckets(., values)
+#           encode(., data, as_sdr)
+#           encode_stream(., stream, as_sdr)
+#
+# functions outside the object:
+#           numeric_encoder(data)
+
+class Scalar_Encoder():
+    def __init__(self, n_buckets=43, active_bits=7, min_val=None, max_val=None, periodic=False, shape=(7,7)):
+        self.n_buckets = n_buckets
+        self.active_bits = active_bits
+        self.periodic = periodic
+        self.adaptive = min_val is None or max_val is None
+        self.min_val = min_val
+        self.max_val = max_val
+
+        if periodic:
+            self.size = n_buckets
+            if active_bits > n_buckets:
+                raise ValueError("a periodic encoder needs at least as many buckets as active bits")
+        else:
+            self.size = n_buckets + active_bits - 1
+
+        if shape is None:
+            shape = (1, self.size)
+        if shape[0] * shape[1] < self.size:
+            raise ValueError("shape " + str(shape) + " cannot hold " + str(self.size) + " bits")
+        self.shape = tuple(shape)
+
+        # offsets of the active bits from the start of a run
+        self.run = np.arange(active_bits)
+
+    def update_range(self, values):
+        #
+        # a function that widens an adaptive range so it covers the given values
+        #
+        # arguments:
+        #       values = an ndarray of floats
+        #
+        if not self.adaptive:
+            return
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        low, high = values.min(), values.max()
+        self.min_val = low if self.min_val is None else min(self.min_val, low)
+        self.max_val = high if self.max_val is None else max(self.max_val, high)
+
+    def get_buckets(self, values):
+        #
+        # a function that finds the bucket (the first active bit) of every value
+        #
+        # arguments:
+        #       values = an ndarray of floats
+        #
+        # returns:
+        #       buckets = an int ndarray, -1 for values that are NaN
+        #
+        # before an adaptive range has seen any value, everything goes to the first bucket
+        if self.min_val is None or self.max_val is None:
+            width = 0
+        else:
+            width = self.max_val - self.min_val
+        if width <= 0:
+            fraction = np.zeros(len(values))
+        else:
+            fraction = (values - self.min_val) / width
+
+        if self.periodic:
+            buckets = np.floor(fraction * self.n_buckets) % self.n_buckets
+        else:
+            # the range is cut into n_buckets - 1 equal subintervals, closed on the left, and the maximum gets the
+            # last bucket, as numeric_encoder always did; values outside a fixed range go to the first or last bucket
+            buckets = np.floor(np.clip(fraction, 0, 1) * (self.n_buckets - 1))
+
+        return np.where(np.isnan(values), -1, buckets).astype(np.int64)
+
+    def encode(self, data, as_sdr=False):
+        #
+        # a function that encodes a whole sequence of real numbers in one vectorized call
+        #
+        # arguments:
+        #       data = a list or an ndarray containing the elements of a numeric sequence
+        #       as_sdr = a logical operator, default is False; if True return a list of SDRs
+        #
+        # returns:
+        #       output = an ndarray of shape (len(data), m, n) of 0's and 1's, which is what Spatial_Pooler.transform
+        #               takes, or a list of SDRs with dimensions shape if as_sdr is True
+        #
+        values = np.asarray(data, dtype=float).reshape(-1)
+        self.update_range(values)
+
+        output = np.zeros((len(values), self.shape[0] * self.shape[1]), dtype=np.int8)
+        buckets = self.get_buckets(values)
+        rows = np.flatnonzero(buckets >= 0)
+        bits = buckets[rows, None] + self.run[None, :]
+        if self.periodic:
+            bits %= self.size
+        output[rows[:, None], bits] = 1
+
+        if as_sdr:
+            return [SDR(self.shape, dense=row) for row in output]
+        return output.reshape((len(values),) + self.shape)
+
+    def encode_stream(self, stream, as_sdr=False):
+        #
+        # a generator that encodes an unbounded stream of real numbers one value at a time
+        #
+        # arguments:
+        #       stream = any iterable of real numbers
+        #       as_sdr = a logical operator, default is False; if True yield SDRs
+        #
+        # yields:
+        #       the encoding of every value, an ndarray with shape shape or an SDR
+        #
+        for value in stream:
+            values = np.array([value], dtype=float)
+            self.update_range(values)
+            bucket = self.get_buckets(values)[0]
+
+            if bucket < 0:
+                sparse = []
+            elif self.periodic:
+                sparse = (bucket + self.run) % self.size
+            else:
+                sparse = bucket + self.run
+
+            encoding = SDR(self.shape, sparse)
+            yield encoding if as_sdr else encoding.get_dense()
+
+
+#
+# a function that takes a sequence of real numbers and encodes it into a sparse, binary matrix
+#
+# arguments: data, a list containing the elements of a numeric sequence
+#
+# returns: output_ls, a list containing the sparse, binary encoding of the elements of a numeric sequence:
+#          one list of 11 bits per element, with a 1 in the subinterval of the sequence's range the element falls in
+#
+def numeric_encoder(data):
+
+    # break the range of the numeric sequence up into 11 subintervals, one bit each
+    encoder = Scalar_Encoder(n_buckets=11, active_bits=1, shape=None)
+    output_ls = encoder.encode(data).reshape(len(data), encoder.size).tolist()
+
+    return output_ls
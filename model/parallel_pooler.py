@@ -0,0 +1,170 @@
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from spatial_pooler import Spatial_Pooler
+from permanences import Dense_Permanences
+
+#
+# object: Shared_Dense_Permanences, a Dense_Permanences store whose arrays live in shared memory and whose
+#         columns are split into contiguous shards, one per worker process
+#
+# every worker attaches to the same shared memory, scores overlaps for its shard and learns on its shard in place,
+# so nothing but the active input indices and the overlap counts of a shard travel between processes; the
+# arithmetic per element is the same as Dense_Permanences, so results are bit-identical to the serial store
+#
+# attributes (besides those of Dense_Permanences):
+#           workers = an integer, the number of worker processes
+#           shards = a list of (start, stop) column ranges, one per worker
+#           memory = the multiprocessing.shared_memory.SharedMemory holding values and connected
+#           pool = the multiprocessing pool of workers, None once closed: the store then works serially, as a
+#                   Dense_Permanences, on its own copy of the arrays
+#           finalizer = a weakref.finalize that stops the workers and frees the shared memory if the store is
+#                   garbage collected (or the interpreter exits) without being closed
+#
+# functions:
+#           __init__(., values, connect_threshold, workers)
+#           overlap(., active_inputs)
+#           overlap_batch(., inputs)
+#           adapt(., columns, active_inputs, inc_val, dec_val)
+#           close(.)
+#
+# object: Parallel_Spatial_Pooler, a Spatial_Pooler whose permanences are a Shared_Dense_Permanences store;
+#         it takes the same arguments as Spatial_Pooler plus workers, and should be closed (or used in a with
+#         block) to stop the workers and free the shared memory; once closed it goes on serially
+#
+# functions:
+#           __init__(., workers, **kwargs)
+#           close(.)
+#
+# functions outside the objects:
+#           attach_shared_memory(name, shape, connect_threshold)
+#           shard_overlap(task), shard_overlap_batch(task), shard_adapt(task)
+#           release(pool, memory)
+#
+
+# the shared arrays of the current worker process, set by attach_shared_memory
+worker_state = {}
+
+
+def attach_shared_memory(name, shape, connect_threshold):
+    #
+    # a function that runs once in every worker process and maps the shared permanence arrays
+    #
+    memory = shared_memory.SharedMemory(name=name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    connected = np.ndarray(shape, dtype=bool, buffer=memory.buf, offset=values.nbytes)
+    worker_state.update(memory=memory, values=values, connected=connected, connect_threshold=connect_threshold)
+
+
+def shard_overlap(task):
+    start, stop, active_inputs = task
+    return worker_state["connected"][start:stop, active_inputs].sum(axis=1)
+
+
+def shard_overlap_batch(task):
+    start, stop, inputs = task
+    return inputs.astype(np.int32) @ worker_state["connected"][start:stop].T.astype(np.int32)
+
+
+def shard_adapt(task):
+    columns, active_inputs, inc_val, dec_val = task
+    values = worker_state["values"]
+    delta = np.full(values.shape[1], -dec_val)
+    delta[active_inputs] = inc_val
+    values[columns] += delta
+    worker_state["connected"][columns] = values[columns] >= worker_state["connect_threshold"]
+
+
+def release(pool, memory):
+    #
+    # a function that stops a pool of workers and frees its shared memory; it holds no reference to the store, so
+    # it can run as the store's finalizer
+    #
+    pool.terminate()
+    pool.join()
+    try:
+        memory.close()
+    except BufferError:
+        # arrays made from the shared memory are still around, the block is freed when they go
+        pass
+    memory.unlink()
+
+
+class Shared_Dense_Permanences(Dense_Permanences):
+    def __init__(self, values, connect_threshold, workers=None):
+        num_columns, num_inputs = values.shape
+        self.workers = max(1, min(workers or os.cpu_count() or 1, num_columns))
+
+        # one block of shared memory: the float permanences followed by the boolean connected matrix
+        self.memory = shared_memory.SharedMemory(create=True, size=values.nbytes + values.size)
+        shared_values = np.ndarray(values.shape, dtype=np.float64, buffer=self.memory.buf)
+        shared_values[:] = values
+        Dense_Permanences.__init__(self, shared_values, connect_threshold)
+        shared_connected = np.ndarray(values.shape, dtype=bool, buffer=self.memory.buf, offset=shared_values.nbytes)
+        shared_connected[:] = self.connected
+        self.connected = shared_connected
+
+        bounds = np.linspace(0, num_columns, self.workers + 1).astype(int)
+        self.shards = [(int(bounds[w]), int(bounds[w + 1])) for w in range(self.workers)]
+        self.pool = multiprocessing.Pool(self.workers, initializer=attach_shared_memory,
+                                         initargs=(self.memory.name, values.shape, connect_threshold))
+        self.finalizer = weakref.finalize(self, release, self.pool, self.memory)
+
+    def overlap(self, active_inputs):
+        if self.pool is None:
+            return Dense_Permanences.overlap(self, active_inputs)
+        tasks = [(start, stop, active_inputs) for start, stop in self.shards]
+        return np.concatenate(self.pool.map(shard_overlap, tasks))
+
+    def overlap_batch(self, inputs):
+        if self.pool is None:
+            return Dense_Permanences.overlap_batch(self, inputs)
+        tasks = [(start, stop, inputs) for start, stop in self.shards]
+        return np.hstack(self.pool.map(shard_overlap_batch, tasks))
+
+    def adapt(self, columns, active_inputs, inc_val, dec_val):
+        if self.pool is None:
+            return Dense_Permanences.adapt(self, columns, active_inputs, inc_val, dec_val)
+        # every worker only writes the rows of its own shard
+        tasks = []
+        for start, stop in self.shards:
+            shard_columns = columns[(columns >= start) & (columns < stop)]
+            if len(shard_columns) > 0:
+                tasks.append((shard_columns, active_inputs, inc_val, dec_val))
+        self.pool.map(shard_adapt, tasks)
+
+    def close(self):
+        #
+        # a function that stops the workers and frees the shared memory; the permanences are copied out first
+        # so the store goes on working serially afterwards
+        #
+        if self.pool is None:
+            return
+        self.pool = None
+        self.values = self.values.copy()
+        self.connected = self.connected.copy()
+        self.finalizer()
+
+
+class Parallel_Spatial_Pooler(Spatial_Pooler):
+    def __init__(self, workers=None, **kwargs):
+        Spatial_Pooler.__init__(self, **kwargs)
+        if not isinstance(self.permanences, Dense_Permanences):
+            raise ValueError("Parallel_Spatial_Pooler needs dense permanences (potential_pct=1.0, potential_radius=None)")
+
+        # the serial pooler already drew the permanences from the seed, so both start from the same values
+        self.permanences = Shared_Dense_Permanences(self.permanences.values, self.perm_connect_threshold, workers)
+        self.workers = self.permanences.workers
+
+    def close(self):
+        self.permanences.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
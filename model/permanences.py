@@ -0,0 +1,222 @@
+import numpy as np
+
+#
+# Permanence stores for the Spatial_Pooler: every store holds the permanence values between the spatial pooler
+# elements (columns) and the input cells, and knows how to score overlaps and learn on them.
+#
+# object: Dense_Permanences, every column is connected to every input cell
+#
+# attributes:
+#           values = an ndarray of shape (num_columns, num_inputs) of permanence values
+#           connected = a boolean ndarray with the shape of values, True where a permanence is at or above connect_threshold
+#           connect_threshold = a float between 0 and 1, the permanence at which a connection counts as active
+#           num_columns, num_inputs = integers, the shape of values
+#
+# object: Sparse_Permanences, every column is connected to its potential pool only, stored in compressed sparse rows
+#
+# attributes:
+#           indptr = an ndarray of length num_columns+1, the entries of column c are indptr[c]:indptr[c+1]
+#           indices = an int32 ndarray, the input cell of every entry, sorted within each column
+#           data = an ndarray, the permanence value of every entry
+#           rows = an int32 ndarray, the column of every entry
+#           connected = a boolean ndarray, True where data is at or above connect_threshold
+#           input_indptr, input_order = the same entries grouped by input cell (a compressed sparse column view),
+#                       the entries of input cell i are input_order[input_indptr[i]:input_indptr[i+1]]
+#           connect_threshold, num_columns, num_inputs = as for Dense_Permanences
+#
+# functions for both objects:
+#           overlap(., active_inputs)
+#           overlap_batch(., inputs)
+#           adapt(., columns, active_inputs, inc_val, dec_val)
+#           get_dense(.)
+#           get_nbytes(.)
+#
+# functions outside the objects:
+#           get_ranges(starts, lengths)
+#           get_potential_pools(pooler_size, input_size, potential_pct, potential_radius, rng)
+
+class Dense_Permanences():
+    def __init__(self, values, connect_threshold):
+        self.values = values
+        self.connect_threshold = connect_threshold
+        self.num_columns, self.num_inputs = values.shape
+        self.connected = self.values >= self.connect_threshold
+
+    def overlap(self, active_inputs):
+        #
+        # a function that counts, for every column, the active connections that line up with an active input cell
+        #
+        # arguments:
+        #       active_inputs = an ndarray of the flat indices of the active input cells
+        #
+        # returns:
+        #       overlaps = an ndarray of length num_columns
+        #
+        return self.connected[:, active_inputs].sum(axis=1)
+
+    def overlap_batch(self, inputs):
+        #
+        # a function that computes the overlaps for a stack of inputs in one matrix multiplication
+        #
+        # arguments:
+        #       inputs = a boolean ndarray of shape (T, num_inputs)
+        #
+        # returns:
+        #       overlaps = an ndarray of shape (T, num_columns)
+        #
+        return inputs.astype(np.int32) @ self.connected.T.astype(np.int32)
+
+    def adapt(self, columns, active_inputs, inc_val, dec_val):
+        #
+        # a function that increases the permanences of the given columns at the active input cells and
+        # decreases them everywhere else
+        #
+        # arguments:
+        #       columns = an ndarray of the columns that learn
+        #       active_inputs = an ndarray of the flat indices of the active input cells
+        #       inc_val, dec_val = floats, how much to increase and decrease permanences by
+        #
+        delta = np.full(self.num_inputs, -dec_val)
+        delta[active_inputs] = inc_val
+        self.values[columns] += delta
+        self.connected[columns] = self.values[columns] >= self.connect_threshold
+
+    def get_dense(self):
+        return self.values
+
+    def get_nbytes(self):
+        return self.values.nbytes + self.connected.nbytes
+
+
+class Sparse_Permanences():
+    def __init__(self, indptr, indices, data, num_inputs, connect_threshold):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=float)
+        self.num_columns = len(self.indptr) - 1
+        self.num_inputs = num_inputs
+        self.connect_threshold = connect_threshold
+
+        self.rows = np.repeat(np.arange(self.num_columns, dtype=np.int32), np.diff(self.indptr))
+        self.connected = self.data >= self.connect_threshold
+
+        # group the entries by input cell so an overlap only visits the pools of the active input cells
+        self.input_order = np.argsort(self.indices, kind='stable').astype(np.int64)
+        self.input_indptr = np.zeros(self.num_inputs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=self.num_inputs), out=self.input_indptr[1:])
+
+    def overlap(self, active_inputs):
+        #
+        # see Dense_Permanences.overlap, only the pool entries of the active input cells are visited
+        #
+        active_inputs = np.asarray(active_inputs, dtype=np.int64)
+        starts = self.input_indptr[active_inputs]
+        entries = self.input_order[get_ranges(starts, self.input_indptr[active_inputs + 1] - starts)]
+        entries = entries[self.connected[entries]]
+
+        return np.bincount(self.rows[entries], minlength=self.num_columns)
+
+    def overlap_batch(self, inputs):
+        #
+        # see Dense_Permanences.overlap_batch
+        #
+        overlaps = np.zeros((len(inputs), self.num_columns), dtype=np.int64)
+        if len(self.data) == 0:
+            return overlaps
+
+        # work through the stack in chunks so the (T, entries) intermediate stays bounded
+        chunk = max(1, (1 << 24) // len(self.data))
+        for start in range(0, len(inputs), chunk):
+            hits = inputs[start:start + chunk][:, self.indices] & self.connected
+            totals = np.zeros((hits.shape[0], len(self.data) + 1), dtype=np.int64)
+            np.cumsum(hits, axis=1, out=totals[:, 1:])
+            overlaps[start:start + chunk] = totals[:, self.indptr[1:]] - totals[:, self.indptr[:-1]]
+
+        return overlaps
+
+    def adapt(self, columns, active_inputs, inc_val, dec_val):
+        #
+        # see Dense_Permanences.adapt, only the pool entries of the given columns change
+        #
+        columns = np.asarray(columns, dtype=np.int64)
+        entries = get_ranges(self.indptr[columns], self.indptr[columns + 1] - self.indptr[columns])
+        is_active = np.zeros(self.num_inputs, dtype=bool)
+        is_active[active_inputs] = True
+
+        self.data[entries] += np.where(is_active[self.indices[entries]], inc_val, -dec_val)
+        self.connected[entries] = self.data[entries] >= self.connect_threshold
+
+    def get_dense(self):
+        #
+        # a function that builds the (num_columns, num_inputs) permanence matrix, 0 outside the potential pools
+        #
+        dense = np.zeros((self.num_columns, self.num_inputs))
+        dense[self.rows, self.indices] = self.data
+        return dense
+
+    def get_nbytes(self):
+        return (self.indptr.nbytes + self.indices.nbytes + self.data.nbytes + self.rows.nbytes
+                + self.connected.nbytes + self.input_order.nbytes + self.input_indptr.nbytes)
+
+
+def get_ranges(starts, lengths):
+    #
+    # a function that concatenates the ranges starts[r]:starts[r]+lengths[r], without a python loop; the
+    # Connections store of the Temporal_Memory uses it too
+    #
+    # arguments:
+    #       starts = an ndarray of the first position of every range
+    #       lengths = an ndarray of the length of every range
+    #
+    # returns:
+    #       positions = an int64 ndarray of all positions covered by the ranges, in order
+    #
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum(), dtype=np.int64)
+
+
+def get_potential_pools(pooler_size, input_size, potential_pct=1.0, potential_radius=None, rng=None):
+    #
+    # a function that picks, for every spatial pooler element, the subset of input cells it can connect to
+    #
+    # arguments:
+    #       pooler_size = a pair (m,n), the size of the spatial pooler
+    #       input_size = a pair (m,n), the size of an input element
+    #       potential_pct = a float between 0 and 1, the fraction of the candidate input cells in each pool
+    #       potential_radius = an integer or None; if None, the candidates are all input cells (random pools),
+    #                       otherwise the input cells at most potential_radius rows and columns away from where
+    #                       the element sits when the pooler is laid over the input (topological pools)
+    #       rng = a numpy.random.Generator used to pick the pools, default is a freshly seeded one
+    #
+    # returns:
+    #       indptr, indices = the pools in compressed sparse rows: the pool of element c is indices[indptr[c]:indptr[c+1]]
+    #
+    m, n = pooler_size
+    input_m, input_n = input_size
+    num_inputs = input_m * input_n
+    if rng is None:
+        rng = np.random.default_rng()
+
+    indptr = [0]
+    pools = []
+    for i in range(m):
+        for j in range(n):
+            if potential_radius is None:
+                candidates = np.arange(num_inputs)
+            else:
+                # center of this element on the input grid
+                center_i = int((i + 0.5) * input_m / m)
+                center_j = int((j + 0.5) * input_n / n)
+                rows = np.arange(max(0, center_i - potential_radius), min(input_m, center_i + potential_radius + 1))
+                cols = np.arange(max(0, center_j - potential_radius), min(input_n, center_j + potential_radius + 1))
+                candidates = (rows[:, None] * input_n + cols[None, :]).reshape(-1)
+
+            size = max(1, int(round(potential_pct * len(candidates))))
+            pool = np.sort(rng.choice(candidates, size, replace=False))
+            pools.append(pool)
+            indptr.append(indptr[-1] + size)
+
+    return np.array(indptr, dtype=np.int64), np.concatenate(pools).astype(np.int32)
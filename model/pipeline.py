@@ -0,0 +1,290 @@
+import asyncio
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# object: HTM_Pipeline, chains an encoder, a Spatial_Pooler and a Temporal_Memory as streaming stages
+#
+# every value of the input stream goes through the three stages one record at a time and comes out as a
+# Pipeline_Record as soon as the Temporal_Memory has seen it, so the stream is never held whole (the models still
+# grow with what they learn, the label and prediction tables of the Temporal_Memory with every new pattern):
+#       encode = the encoder turns the value into an encoded matrix
+#       pool = the Spatial_Pooler turns the encoding into the positions (i,j) of its active columns
+#       remember = the Temporal_Memory learns the value's columns as its label (see add_input_label), then goes
+#                  through a step on them
+#
+# the stages run in one of three modes:
+#       inline = all stages in the calling thread, one record after the other
+#       thread = every stage in its own thread, with bounded queues of queue_size records between them, so the
+#                stages overlap where they release the GIL (numpy work does)
+#       process = every stage in its own process, with bounded queues between them, so the stages overlap fully;
+#                 the stages work on copies of the encoder, Spatial_Pooler and Temporal_Memory made when the
+#                 processes start, so the objects given to the pipeline do not learn in this mode
+# run takes any iterable; arun takes any iterable or async iterable and is an async generator over run, in the same
+# mode and with the same queues
+#
+# attributes:
+#           encoder = a callable from a value to its encoding, or an object whose encode method encodes a list of
+#                       values (such as Scalar_Encoder)
+#           spatial_pooler = a Spatial_Pooler
+#           temporal_memory = a Temporal_Memory
+#           mode = a string, 'inline' (default), 'thread' or 'process'
+#           queue_size = an integer, default is 16, the most records waiting between two stages
+#           learn = a boolean, default is True, whether the Spatial_Pooler and the Temporal_Memory learn
+#           stages = a list of the Encode_Stage, Pool_Stage and Remember_Stage, each holding only its own object
+#
+# functions:
+#           __init__(., encoder, spatial_pooler, temporal_memory, mode, queue_size, learn)
+#           process_one(., index, value)
+#           run(., stream)
+#           arun(., stream)
+#           run_stages(., stream, queue_type, worker_type)
+#
+# functions outside the object:
+#           from_async(stream, loop)
+#           put(outbox, item, stop)
+#           feed(stream, outbox, stop)
+#           run_stage(stage, inbox, outbox, stop)
+#
+# objects: Encode_Stage, Pool_Stage, Remember_Stage, the stages as callables from the item of one queue to the item
+#          of the next, (index, value) to (index, value, encoding) to (index, value, active_columns) to a
+#          Pipeline_Record; they are picklable so they can be sent to a process
+#
+# object: Pipeline_Record, what came out of the pipeline for one value of the stream
+#
+# attributes:
+#           index = an integer, the position of the value in the stream
+#           value = the value
+#           active_columns = a list of the positions (i,j) of the active Spatial_Pooler columns
+#           result = the TM_Result of the Temporal_Memory step
+#
+
+# what goes down the queues after the last record, and what wraps an exception raised by a stage
+END = "end"
+ERROR = "error"
+
+MODES = ('inline', 'thread', 'process')
+
+
+class HTM_Pipeline():
+    def __init__(self, encoder, spatial_pooler, temporal_memory, mode='inline', queue_size=16, learn=True):
+        if mode not in MODES:
+            raise ValueError("mode must be 'inline', 'thread' or 'process', got " + repr(mode))
+
+        self.encoder = encoder
+        self.spatial_pooler = spatial_pooler
+        self.temporal_memory = temporal_memory
+        self.mode = mode
+        self.queue_size = queue_size
+        self.learn = learn
+        self.stages = [Encode_Stage(encoder), Pool_Stage(spatial_pooler, learn), Remember_Stage(temporal_memory, learn)]
+
+    def process_one(self, index, value):
+        #
+        # a function that takes one value through every stage
+        #
+        # returns: record = a Pipeline_Record
+        #
+        item = (index, value)
+        for stage in self.stages:
+            item = stage(item)
+
+        return item
+
+    def run(self, stream):
+        #
+        # a generator that takes every value of a stream through the pipeline, as it arrives
+        #
+        # arguments:
+        #           stream = any iterable of values
+        #
+        # yields: a Pipeline_Record for every value, in order
+        #
+        if self.mode == 'inline':
+            for index, value in enumerate(stream):
+                yield self.process_one(index, value)
+        elif self.mode == 'thread':
+            yield from self.run_stages(stream, queue.Queue, threading.Thread)
+        else:
+            yield from self.run_stages(stream, multiprocessing.Queue, multiprocessing.Process)
+
+    async def arun(self, stream):
+        #
+        # an async generator that takes every value of a stream through the pipeline, as it arrives; run is driven
+        # from a worker thread of its own, so the event loop is never blocked by a step or by waiting on a stage
+        #
+        # arguments:
+        #           stream = any iterable or async iterable of values
+        #
+        # yields: a Pipeline_Record for every value, in order
+        #
+        loop = asyncio.get_running_loop()
+        if hasattr(stream, '__aiter__'):
+            stream = from_async(stream, loop)
+        records = self.run(stream)
+
+        # one thread, so the generator is never stepped and closed at the same time
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            while True:
+                record = await loop.run_in_executor(executor, next, records, END)
+                if record is END:
+                    break
+                yield record
+        finally:
+            # stops the stages if the consumer ends early
+            await loop.run_in_executor(executor, records.close)
+            executor.shutdown(wait=False)
+
+    def run_stages(self, stream, queue_type, worker_type):
+        #
+        # a generator that runs every stage in its own worker, with bounded queues between them, and feeds the
+        # stream in from a thread of the calling process
+        #
+        # arguments:
+        #           stream = any iterable of values
+        #           queue_type = queue.Queue or multiprocessing.Queue
+        #           worker_type = threading.Thread or multiprocessing.Process
+        #
+        # yields: a Pipeline_Record for every value, in order
+        #
+        queues = [queue_type(self.queue_size) for q in range(4)]
+        stop = threading.Event() if worker_type is threading.Thread else multiprocessing.Event()
+        workers = [worker_type(target=run_stage, args=(stage, queues[s], queues[s + 1], stop), daemon=True)
+                   for s, stage in enumerate(self.stages)]
+        feeder = threading.Thread(target=feed, args=(stream, queues[0], stop), daemon=True)
+        for worker in workers:
+            worker.start()
+        feeder.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item == END:
+                    break
+                if isinstance(item, tuple) and item[0] == ERROR:
+                    raise item[1]
+                yield item
+        finally:
+            # the consumer may stop early: the workers are told to drop what they hold and end (the feeder may be
+            # waiting on the stream, it is left to end with the process)
+            stop.set()
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive() and hasattr(worker, 'terminate'):
+                    worker.terminate()
+
+
+def from_async(stream, loop):
+    #
+    # a generator over the values of an async iterable, for a thread other than the one running its event loop
+    #
+    iterator = stream.__aiter__()
+    while True:
+        try:
+            value = asyncio.run_coroutine_threadsafe(iterator.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
+        yield value
+
+
+def put(outbox, item, stop):
+    #
+    # a function that puts an item on a bounded queue, giving up if the pipeline is stopped
+    #
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def feed(stream, outbox, stop):
+    #
+    # a function that puts every value of a stream, with its index, on the queue of the first stage, then END
+    #
+    try:
+        for item in enumerate(stream):
+            if not put(outbox, item, stop):
+                return
+    except Exception as error:
+        put(outbox, (ERROR, error), stop)
+        return
+    put(outbox, END, stop)
+
+
+def run_stage(stage, inbox, outbox, stop):
+    #
+    # a function that runs a stage: it takes items from inbox until END, and puts what stage makes of them on
+    # outbox; END and errors are passed on
+    #
+    while not stop.is_set():
+        try:
+            item = inbox.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item == END or (isinstance(item, tuple) and item[0] == ERROR):
+            put(outbox, item, stop)
+            return
+        try:
+            item = stage(item)
+        except Exception as error:
+            put(outbox, (ERROR, error), stop)
+            return
+        if not put(outbox, item, stop):
+            break
+
+    # a process stopped early does not wait for the records it left on a multiprocessing queue to be read
+    if hasattr(outbox, 'cancel_join_thread'):
+        outbox.cancel_join_thread()
+
+class Encode_Stage():
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def __call__(self, item):
+        # the encoder is a callable, or encodes a list of values
+        index, value = item
+        if callable(self.encoder):
+            return index, value, self.encoder(value)
+        return index, value, self.encoder.encode([value])[0]
+
+
+class Pool_Stage():
+    def __init__(self, spatial_pooler, learn):
+        self.spatial_pooler = spatial_pooler
+        self.learn = learn
+
+    def __call__(self, item):
+        index, value, encoding = item
+        matrix_ls, mapping = self.spatial_pooler.transform([encoding], learn=self.learn)
+        return index, value, matrix_ls[0]
+
+
+class Remember_Stage():
+    def __init__(self, temporal_memory, learn):
+        self.temporal_memory = temporal_memory
+        self.learn = learn
+
+    def __call__(self, item):
+        # the value is the label of its columns, so the predictions of the Temporal_Memory decode to values
+        index, value, active_columns = item
+        if self.learn:
+            self.temporal_memory.add_input_label(value, active_columns)
+        return Pipeline_Record(index, value, active_columns, self.temporal_memory.compute(active_columns, self.learn))
+
+
+class Pipeline_Record():
+    def __init__(self, index, value, active_columns, result):
+        self.index = index
+        self.value = value
+        self.active_columns = active_columns
+        self.result = result
+
+    def __repr__(self):
+        return "Pipeline_Record(index=%d, value=%r, active_columns=%d, result=%r)" % (
+            self.index, self.value, len(self.active_columns), self.result)
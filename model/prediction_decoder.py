@@ -0,0 +1,105 @@
+import numpy as np
+
+#
+# object: Prediction_Decoder, maps the predictive cell configurations the Temporal_Memory has learned back to the
+#         spatial pooler outputs they predicted, and scores a new configuration against all of them at once
+#
+# every configuration is kept as a bitset over the cell numbers, one row of a matrix of packed bits, so decoding is
+# a single AND and bit count over the matrix, with no python loop over the stored configurations or their cells;
+# the score of a configuration is the number of shared cells as a percentage of the larger of the two
+# configurations
+#
+# attributes:
+#           num_cells = an integer, the number of cells of the TM space
+#           keys = a list of the key (spatial pooler output, as a tuple of positions) of every pattern id
+#           ids = a dictionary {key: pattern id}
+#           bits = a uint8 ndarray of shape (capacity, ceil(num_cells / 8)), the bitset of every pattern id
+#           sizes = an int64 ndarray of shape (capacity,), the number of cells of every pattern id
+#
+# functions:
+#           __init__(., num_cells)
+#           get_bits(., cells)
+#           add(., key, cells)
+#           decode(., cells, k)
+#           __len__(.)
+
+# the number of set bits of every byte, for numpy versions without bitwise_count
+BYTE_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int64)
+
+
+def count_bits(bits):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    return BYTE_COUNTS[bits].sum(axis=-1)
+
+
+class Prediction_Decoder():
+    def __init__(self, num_cells):
+        self.num_cells = num_cells
+        self.keys = []
+        self.ids = {}
+        self.bits = np.zeros((16, (num_cells + 7) // 8), dtype=np.uint8)
+        self.sizes = np.zeros(16, dtype=np.int64)
+
+    def get_bits(self, cells):
+        #
+        # a function that packs cell numbers into a bitset
+        #
+        # returns: bits = a uint8 ndarray of ceil(num_cells / 8) bytes
+        #
+        mask = np.zeros(self.bits.shape[1] * 8, dtype=bool)
+        mask[np.asarray(cells, dtype=np.int64)] = True
+        return np.packbits(mask)
+
+    def add(self, key, cells):
+        #
+        # a function that stores the predictive cells that came before a spatial pooler output, replacing what
+        # was stored for it before
+        #
+        # arguments:
+        #       key = a tuple of the positions (i,j) of the spatial pooler output
+        #       cells = an ndarray (or list) of cell numbers
+        #
+        pattern_id = self.ids.get(key)
+        if pattern_id is None:
+            pattern_id = len(self.keys)
+            if pattern_id == len(self.sizes):
+                self.bits = np.concatenate([self.bits, np.zeros_like(self.bits)])
+                self.sizes = np.concatenate([self.sizes, np.zeros_like(self.sizes)])
+            self.keys.append(key)
+            self.ids[key] = pattern_id
+
+        self.bits[pattern_id] = self.get_bits(cells)
+        self.sizes[pattern_id] = len(np.unique(np.asarray(cells, dtype=np.int64)))
+
+    def decode(self, cells, k=1):
+        #
+        # a function that finds the stored configurations most similar to some predictive cells
+        #
+        # arguments:
+        #       cells = an ndarray (or list) of cell numbers
+        #       k = an integer, default is 1, how many matches to return
+        #
+        # returns: matches = a list of up to k (key, percentage) pairs, best first, percentage between 0 and 100;
+        #                    only configurations sharing a cell with cells are matches, and ties go to the
+        #                    configuration stored last
+        #
+        num_cells = len(np.unique(np.asarray(cells, dtype=np.int64)))
+        if len(self.keys) == 0 or num_cells == 0:
+            return []
+
+        overlaps = count_bits(self.bits[:len(self.keys)] & self.get_bits(cells))
+        ids = np.flatnonzero(overlaps)
+        percentages = overlaps[ids] * 100 / np.maximum(self.sizes[ids], num_cells)
+        if len(ids) > k:
+            # only the k best (and those tied with the k-th) need sorting
+            kth = -np.partition(-percentages, k - 1)[k - 1]
+            keep = percentages >= kth
+            ids, percentages = ids[keep], percentages[keep]
+        best = np.lexsort((-ids, -percentages))[:k]
+
+        return [(self.keys[pattern_id], float(percentage))
+                for pattern_id, percentage in zip(ids[best].tolist(), percentages[best].tolist())]
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,103 @@
+import numpy as np
+
+#
+# object: SDR, a sparse distributed representation that only stores the positions of its active bits
+#
+# attributes:
+#           dimensions = a tuple, the shape of the dense matrix this SDR stands for, e.g. (7,7)
+#           size = an integer, the total number of bits
+#           sparse = a sorted, read-only ndarray of the flat (row-major) indices of the active bits
+#
+# functions:
+#           __init__(., dimensions, sparse, dense)
+#           get_dense(.)
+#           get_flat_dense(.)
+#           overlap(., other)
+#           __len__(.), __eq__(., other), __hash__(.)
+#
+# functions outside the object:
+#           as_sdr(data, dimensions)
+
+class SDR():
+    def __init__(self, dimensions, sparse=None, dense=None):
+        if np.isscalar(dimensions):
+            dimensions = (dimensions,)
+        self.dimensions = tuple(int(d) for d in dimensions)
+        self.size = int(np.prod(self.dimensions))
+
+        # the active bits either come as flat indices or are read off a dense 0/1 matrix
+        if dense is not None:
+            sparse = np.flatnonzero(np.asarray(dense).reshape(self.size))
+        elif sparse is None:
+            sparse = []
+
+        self.sparse = np.unique(np.asarray(sparse, dtype=np.int64))
+        if len(self.sparse) > 0 and (self.sparse[0] < 0 or self.sparse[-1] >= self.size):
+            raise ValueError("SDR index out of range for dimensions " + str(self.dimensions))
+        self.sparse.flags.writeable = False
+
+    def get_dense(self):
+        #
+        # a function that builds the dense 0/1 view of this SDR on demand
+        #
+        # returns:
+        #       dense = an ndarray of 0's and 1's with shape dimensions
+        #
+        return self.get_flat_dense().reshape(self.dimensions)
+
+    def get_flat_dense(self):
+        #
+        # a function that builds the flattened dense 0/1 view of this SDR on demand
+        #
+        # returns:
+        #       dense = an ndarray of 0's and 1's of length size
+        #
+        dense = np.zeros(self.size, dtype=np.int8)
+        dense[self.sparse] = 1
+        return dense
+
+    def overlap(self, other):
+        #
+        # a function that counts the active bits this SDR shares with another one
+        #
+        # arguments:
+        #       other = an SDR with the same size
+        #
+        # returns:
+        #       count = an integer, the number of shared active bits
+        #
+        return len(np.intersect1d(self.sparse, other.sparse, assume_unique=True))
+
+    def __len__(self):
+        return len(self.sparse)
+
+    def __eq__(self, other):
+        if not isinstance(other, SDR):
+            return NotImplemented
+        return self.dimensions == other.dimensions and np.array_equal(self.sparse, other.sparse)
+
+    def __hash__(self):
+        return hash((self.dimensions, self.sparse.tobytes()))
+
+    def __repr__(self):
+        return "SDR(" + str(self.dimensions) + ", " + str(self.sparse.tolist()) + ")"
+
+
+def as_sdr(data, dimensions=None):
+    #
+    # a function that turns a dense 0/1 matrix (a list of lists or an ndarray) into an SDR,
+    # SDRs are passed through unchanged
+    #
+    # arguments:
+    #       data = an SDR, or a list or an ndarray of an encoded sequence element
+    #       dimensions = a tuple, default is the shape of data, the dimensions to give the SDR
+    #
+    # returns:
+    #       sdr = an SDR with the same active bits as data
+    #
+    if isinstance(data, SDR):
+        return data
+    dense = np.asarray(data)
+    if dimensions is None:
+        dimensions = dense.shape
+    return SDR(dimensions, dense=dense)
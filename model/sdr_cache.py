@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+#
+# object: SDR_Cache, a bounded least-recently-used cache from an encoded input (an SDR) to the spatial pooler
+#         elements it activates
+#
+# every entry remembers the version of the permanences it was computed with; the Spatial_Pooler bumps its version
+# whenever learning changes the permanences, so an entry from an older version is never returned; as learning
+# changes them at every step, the cache is only used for inference
+#
+# attributes:
+#           capacity = an integer, the maximum number of entries kept
+#           entries = an OrderedDict {SDR: (version, active columns)}, least recently used first
+#           hits = an integer, the number of lookups that found a current entry
+#           misses = an integer, the number of lookups that did not
+#
+# functions:
+#           __init__(., capacity)
+#           get(., key, version)
+#           put(., key, version, value)
+#           invalidate(.)
+#           get_stats(.)
+
+class SDR_Cache():
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        #
+        # a function that looks up the active columns of an input
+        #
+        # arguments:
+        #       key = an SDR, the encoded input
+        #       version = an integer, the current version of the permanences
+        #
+        # returns:
+        #       value = the cached active columns, or None if there is no entry for this version
+        #
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            if entry is not None:
+                # computed before the permanences last changed
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, value):
+        #
+        # a function that stores the active columns of an input, evicting the least recently used entry when full
+        #
+        # arguments:
+        #       key = an SDR, the encoded input
+        #       version = an integer, the version of the permanences the value was computed with
+        #       value = an ndarray of the active columns
+        #
+        if self.capacity <= 0:
+            return
+        value.flags.writeable = False
+        self.entries[key] = (version, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def invalidate(self):
+        #
+        # a function that drops every entry
+        #
+        self.entries.clear()
+
+    def get_stats(self):
+        #
+        # returns: a dictionary with the hit and miss counters, the hit rate and the number of entries
+        #
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries), "capacity": self.capacity}
+
+    def __len__(self):
+        return len(self.entries)
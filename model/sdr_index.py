@@ -0,0 +1,106 @@
+from itertools import chain
+import numpy as np
+
+#
+# object: SDR_Index, maps SDRs (by a hash of their active indices) to labels and labels back to SDRs
+#
+# exact lookups are one hash lookup; nearest-match lookups only visit the patterns that share an active bit
+# with the query, through an inverted index from bit to patterns, so neither grows with the number of
+# distinct patterns stored
+#
+# attributes:
+#           patterns = a list of the stored SDRs, a pattern's position in the list is its id
+#           pattern_labels = a list of the label of every pattern id
+#           ids = a dictionary {SDR: pattern id}
+#           label_ids = a dictionary {label: pattern id of the SDR most recently added with that label}
+#           postings = a dictionary {bit: list of the ids of the patterns with that bit active}
+#
+# functions:
+#           __init__(.)
+#           add(., sdr, label)
+#           lookup(., sdr)
+#           nearest(., sdr, min_overlap)
+#           get_sdr(., label)
+#           __len__(.), __contains__(., sdr)
+
+class SDR_Index():
+    def __init__(self):
+        self.patterns = []
+        self.pattern_labels = []
+        self.ids = {}
+        self.label_ids = {}
+        self.postings = {}
+
+    def add(self, sdr, label):
+        #
+        # a function that maps an SDR to a label, replacing the label if the SDR is already stored
+        #
+        # arguments:
+        #       sdr = an SDR
+        #       label = any hashable value, for example the input element the SDR stands for
+        #
+        pattern_id = self.ids.get(sdr)
+        if pattern_id is None:
+            pattern_id = len(self.patterns)
+            self.patterns.append(sdr)
+            self.pattern_labels.append(label)
+            self.ids[sdr] = pattern_id
+            for bit in sdr.sparse.tolist():
+                self.postings.setdefault(bit, []).append(pattern_id)
+        else:
+            self.pattern_labels[pattern_id] = label
+        self.label_ids[label] = pattern_id
+
+    def lookup(self, sdr):
+        #
+        # a function that finds the label of an SDR that is stored exactly
+        #
+        # returns: label = the label, or None if the SDR is not stored
+        #
+        pattern_id = self.ids.get(sdr)
+        if pattern_id is None:
+            return None
+        return self.pattern_labels[pattern_id]
+
+    def nearest(self, sdr, min_overlap=1):
+        #
+        # a function that finds the stored SDR sharing the most active bits with sdr, for noisy patterns
+        #
+        # arguments:
+        #       sdr = an SDR
+        #       min_overlap = an integer, default is 1, the fewest shared bits that still count as a match
+        #
+        # returns:
+        #       label = the label of the best match, or None if no stored SDR shares min_overlap bits
+        #       overlap = an integer, the number of shared bits
+        #
+        pattern_id = self.ids.get(sdr)
+        if pattern_id is not None:
+            return self.pattern_labels[pattern_id], len(sdr)
+
+        candidates = np.fromiter(chain.from_iterable(self.postings.get(bit, ()) for bit in sdr.sparse.tolist()),
+                                 dtype=np.int64)
+        if len(candidates) == 0:
+            return None, 0
+        counts = np.bincount(candidates)
+        best = int(np.argmax(counts))
+        if counts[best] < min_overlap:
+            return None, 0
+        return self.pattern_labels[best], int(counts[best])
+
+    def get_sdr(self, label):
+        #
+        # a function that finds the SDR most recently added with a label
+        #
+        # returns: sdr = the SDR, or None if the label is unknown
+        #
+        pattern_id = self.label_ids.get(label)
+        if pattern_id is None:
+            return None
+        return self.patterns[pattern_id]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __contains__(self, sdr):
+        return sdr in self.ids
@@ -1,10 +1,13 @@
-
 import random
+import numpy as np
 from synapse import Synapse
+from connections import Connections
 
 #
 # Object is Segment: a singular cell (the focus) and a list of synapses to other cells (the secondary)
 #
+# a Segment is a view onto one segment of a Connections store, where its synapses and permanence values live
+#
 # attributes:
 #           initiator = a tuple describing the location of focus cell in TM space
 #           x = an integer, default is 10, representing the number of rows in TM space
@@ -13,7 +16,10 @@ from synapse import Synapse
 #           max_synapses_count = an integer, default is 7, for the maximum number of synapses per cell
 #           perm_value_range = a tuple representing the min and max value permanences for each synapse can be
 #           connected_cells = a list containing the location of cells that are connected to focus cell
-#           connections = a dictionary containing synapses
+#           store = the Connections store holding this segment (a new one of size (x,y,z) if none is given)
+#           cell = an integer, the cell number of the focus cell in store
+#           segment = an integer, the id of this segment in store (a new segment of the focus cell if none is given)
+#           connections = a dictionary {Synapse: permanence value} built from store on demand
 
 # functions:
 #           initialize_cells(. , this_Segments, temporal_memory_space)
@@ -22,10 +28,12 @@ from synapse import Synapse
 #           initialize_perm_value(.)
 #           sum_perm_values(.)
 #           get_overlap_cells(., active_cells_dict)
+#           get_active_mask(., active_cells_dict)
 #           search_and_adjust(., cells_ls, inc_val, dec_val)
 #           get_connections(.)
 class Segment():
-    def __init__(self, i, j, k, x= 10, y= 10, z= 5, max_synapses_count = 7,connected_cells = [], perm_value_range = (0,1)):
+    def __init__(self, i, j, k, x= 10, y= 10, z= 5, max_synapses_count = 7,connected_cells = [], perm_value_range = (0,1),
+                 connections = None, segment = None):
         self.initiator = (i,j,k)
         self.x = x
         self.y = y
@@ -33,7 +41,28 @@ class Segment():
         self.max_synapses_count = max_synapses_count
         self.perm_value_range = perm_value_range
         self.connected_cells = connected_cells
-        self.connections = {}
+
+        if connections is None:
+            connections = Connections(x, y, z)
+        self.store = connections
+        self.cell = self.store.cell_index(self.initiator)
+        if segment is None:
+            segment = self.store.create_segment(self.cell)
+        self.segment = segment
+
+    @property
+    def connections(self):
+        from segment_ls import Segments
+
+        slots = self.store.get_synapses(self.segment)
+        focus = Segments(*self.initiator, self.x, self.y, self.z, self.max_synapses_count, connections=self.store)
+        output_dict = {}
+        for presyn, perm in zip(self.store.synapse_presyn[slots].tolist(), self.store.synapse_perm[slots].tolist()):
+            other = Segments(*self.store.cell_position(presyn), self.x, self.y, self.z, self.max_synapses_count,
+                             connections=self.store)
+            output_dict[Synapse(focus, other, perm)] = perm
+
+        return output_dict
 
     def initialize_cells(self, this_Segments, temporal_memory_space):
         #
@@ -41,62 +70,49 @@ class Segment():
         #
         # arguments:
         #       this_Segments = the list of segments associated with this focus cell
-        #       temporal_memory_space = a dictionary, listing all cells in TM space by location 
-        #
-
-        # if the connections dictionary is empty, fill it up
-        if len(self.connections) == 0:
-            for i in range(random.randint(1,self.max_synapses_count)):
-                # select a cell at random
-                cell = (random.randint(0,self.x-1), random.randint(0,self.y-1), random.randint(0,self.z-1))
-                # if the randomly selected cell does not match the initiator index for this Segment object
-                if cell != self.initiator:
-                    # then create a synapse between the random cell in TM space and this_Segments dictionary
-                    end_2 = temporal_memory_space[cell[0], cell[1]][cell[2]]
-                    s = Synapse(this_Segments, end_2, self.initialize_perm_value())
-                    # add a connection if one does not already exist in the connections dictionary
-                    if s not in self.connections:
-                        s.complete_connection()
-                        self.connections[s] = s.perm_val
-        # if the connections dictionary is not empty
+        #       temporal_memory_space = a dictionary, listing all cells in TM space by location
+        #
+
+        # if the segment is empty, fill it up
+        if self.store.segment_size[self.segment] == 0:
+            count = random.randint(1,self.max_synapses_count)
+        # if the segment is not empty, randomly done to simulate the description in HTM papers
         else:
-            # randomly done to simulate the description in HTM papers
-            while len(self.connections) < random.randint(1,self.max_synapses_count):
-                cell = (random.randint(0, self.x - 1), random.randint(0, self.y - 1), random.randint(0, self.z - 1))
-                if cell != self.initiator:
-                    end_2 = temporal_memory_space[cell[0], cell[1]][cell[2]]
-                    s = Synapse(this_Segments, end_2, self.initialize_perm_value())
-                    if s not in self.connections:
-                        s.complete_connection()
-                        self.connections[s] = s.perm_val
+            count = max(0, random.randint(1,self.max_synapses_count) - int(self.store.segment_size[self.segment]))
+
+        cells = []
+        for i in range(count):
+            # select a cell at random
+            cell = (random.randint(0,self.x-1), random.randint(0,self.y-1), random.randint(0,self.z-1))
+            # if the randomly selected cell does not match the initiator index for this Segment object
+            if cell != self.initiator:
+                cells.append(self.store.cell_index(cell))
+
+        # then create a synapse between the random cells in TM space and this segment
+        self.store.connect(self.segment, cells, [self.initialize_perm_value() for c in cells])
 
     def fill_segment(self, this_Segments, temporal_memory_space, connecting_cells):
         #
-        # 
+        #
         # arguments:
         #           this_Segments = the list of segments associated with this focus cell
         #           temporal_memory_space = a TM object (a hypercube representing cortical columns and neurons in brain)
-        #           connecting_cells = a list of segments objects (a list of a list of segments associated with this focus)
+        #           connecting_cells = a list of positions (i,j,k) of the cells to connect to
         #
-        for cell in connecting_cells:
-            # if cell (the index of the cell in 3d space) is not the current segments index
-            if cell != self.initiator:
-                # create a synapse between the this_Segments cell and the cell in TM space 
-                end_2 = temporal_memory_space[cell[0], cell[1]][cell[2]]
-                s = Synapse(this_Segments, end_2, self.initialize_perm_value())
-                # and if the synapse is not already in the connections dictionary, add it
-                if s not in self.connections:
-                    s.complete_connection()
-                    self.connections[s] = s.perm_val
+        # if cell (the index of the cell in 3d space) is not the current segments index,
+        # create a synapse between the this_Segments cell and the cell in TM space
+        cells = [self.store.cell_index(cell) for cell in connecting_cells if cell != self.initiator]
+        self.store.connect(self.segment, cells, [self.initialize_perm_value() for c in cells])
 
     def add_synapse(self, synapse):
         #
-        # a function that adds a synapse to the current segment's connections dictionary
-        # 
+        # a function that adds a synapse to the current segment's connections
+        #
         # arguments:
         #           synapse = a synapse object
         #
-        self.connections[synapse] = synapse.perm_val
+        other = synapse.end_1 if synapse.end_1.initiator != self.initiator else synapse.end_2
+        self.store.add_synapses(self.segment, [self.store.cell_index(other.initiator)], [synapse.perm_val])
 
     def initialize_perm_value(self):
         #
@@ -112,39 +128,30 @@ class Segment():
         # returns:
         #
         #       sum = a float, representing the total permanence value for this segment of connections
-        sum = 0
-        for synapse in self.connections:
-            sum += self.connections[synapse]
+        return float(self.store.segment_perm_sum[self.segment])
 
-        return sum
-    
     def get_overlap_cells(self, active_cells_dict):
         #
         # a function that determines how many cells in this segment are active
         #
         # arguments:
-        #           active_cells_dict = a dictionary of cells in TM space that are active
+        #           active_cells_dict = a dictionary of cells in TM space that are active, or a boolean ndarray
+        #                               (see get_active_mask) that is True for every active cell number
         #
         # returns:
         #           score = an integer that represents the number of cells that are active and in this segment
         #
-        score = 0
-
-        active_cells_ls = []
+        if isinstance(active_cells_dict, dict):
+            active_cells_dict = self.get_active_mask(active_cells_dict)
 
-        for i in active_cells_dict:
-            # print(active_cells_dict[i])i
-            for j in active_cells_dict[i]:
-                active_cells_ls.append(j.initiator)
+        return int(self.store.get_overlap_scores([self.segment], active_cells_dict)[0])
 
-        for cell in self.connections:
-            if cell.end_1.initiator in active_cells_ls or cell.end_2.initiator in active_cells_ls:
-                score +=1
-            # if (cell[0], cell[1]) in active_cells_dict:
-            #     if cell[2] in active_cells_dict[(cell[0], cell[1])]:
-            #         score +=1
-
-        return score
+    def get_active_mask(self, active_cells_dict):
+        #
+        # a function that turns a dictionary of active cells into a boolean ndarray over the cell numbers
+        #
+        cells = [self.store.cell_index(j.initiator) for i in active_cells_dict for j in active_cells_dict[i]]
+        return self.store.get_active_mask(cells)
 
     def search_and_adjust(self, cells_ls, inc_val, dec_val):
         #
@@ -158,26 +165,26 @@ class Segment():
         #
         # returns:
         #          connections = the updated permanence values for the connections of this segment
-        for i in self.connections:
-            ends = i.initiators
-            if ends[0] in cells_ls or ends[1] in cells_ls:
-                self.connections[i] += inc_val
-                i.perm_val = self.connections[i]
-            else:
-                self.connections[i] -= inc_val
-                i.perm_val = self.connections[i]
+        cells = [self.store.cell_index(cell) for cell in cells_ls]
+        slots = self.store.get_synapses(self.segment)
+        if self.cell in cells:
+            matched = np.ones(slots.stop - slots.start, dtype=bool)
+        else:
+            matched = np.isin(self.store.synapse_presyn[slots], cells)
+        self.store.update_perms(slots, np.where(matched, inc_val, -dec_val))
 
         return self.connections
 
     def get_connections(self):
         #
-        # a function that retrieves the dictionary containing the synapses for this segment object
+        # a function that retrieves the synapses for this segment object
         #
         # returns:
         #       output_ls = a list of tuples describing which cells are connected based on location in TM space
         #
+        slots = self.store.get_synapses(self.segment)
         output_ls = []
-        for i in self.connections:
-            output_ls.append(i.initiator)
+        for presyn in self.store.synapse_presyn[slots].tolist():
+            output_ls.append((self.initiator, self.store.cell_position(presyn)))
 
         return output_ls
@@ -1,17 +1,23 @@
-
+import random
 from segment import Segment
+from connections import Connections
 
 #
 # Object called Segments - list of all the segments for focus cell
 #
+# a Segments is a view onto the segments of one cell of a Connections store; making or reading it never changes the
+# store, the segments of a cell are made by the learning paths (initialize_segment, add_segment, add_synapse)
+#
 # attributes:
 #           initiator = a tuple for location of focus cell in TM space
-#           segment_ls = a list of segment objects for focus cell
-#           current_segment = an integer, keeping track of which segment in the list we are analyzing
+#           segment_ls = a list of segment objects for focus cell, built from store on demand
+#           current_segment = an integer, keeping track of which segment in the list we are analyzing (the newest)
 #           x = an integer, default is 10, representing the number of rows in TM space
 #           y = an integer, default is 10, representing the number of columns in TM space
 #           z = an integer, default is 5, representing the height of TM space
 #           max_synapses_count = an integer, default is 7, for the maximum number of synapses per cell
+#           store = the Connections store holding the segments (a new one of size (x,y,z) if none is given)
+#           cell = an integer, the cell number of the focus cell in store
 
 # functions:
 #           initialize_segment(., memory_space)
@@ -22,26 +28,41 @@ from segment import Segment
 #           update_perm(., cell_ls, add_val, dec_val)
 #           get_segments_as_list(.)
 class Segments():
-    def __init__(self,i, j, k, x, y, z, max_synapses_count):
+    def __init__(self,i, j, k, x, y, z, max_synapses_count, connections = None):
         self.initiator = (i, j, k)
-        self.segment_ls = [Segment(i, j, k, x, y, z, max_synapses_count)]
-        self.current_segment = 0
         self.accept_add = True
         self.x = x
         self.y = y
         self.z = z
         self.max_synapses_count = max_synapses_count
 
+        if connections is None:
+            connections = Connections(x, y, z)
+        self.store = connections
+        self.cell = self.store.cell_index(self.initiator)
+
+    @property
+    def segment_ls(self):
+        return [Segment(*self.initiator, self.x, self.y, self.z, self.max_synapses_count, connections=self.store,
+                        segment=segment) for segment in self.store.get_segments(self.cell)]
+
+    @property
+    def current_segment(self):
+        return len(self.store.get_segments(self.cell)) - 1
+
     def initialize_segment(self, memory_space):
         #
         # a function that initializes the list of segments for focus cell based on the entirety of TM space
         #
         # arguments:
         #           memory_space = a dictionary containing cell information for TM space
-        # 
+        #
         self.memory_space = memory_space
+        # every cell starts with one segment
+        if len(self.store.get_segments(self.cell)) == 0:
+            self.store.create_segment(self.cell)
         self.segment_ls[0].initialize_cells(self, self.memory_space)
-        
+
     def add_segment(self, connecting_cells = []):
         #
         # a function that adds a segment to this segment list for the focus cell
@@ -49,15 +70,15 @@ class Segments():
         # arguments:
         #           connecting_cells = a list of the cells that are actually connected to focus cell
         #
-        
-        self.segment_ls.append(Segment(self.initiator[0], self.initiator[1], self.initiator[2], self.x, self.y, self.z, self.max_synapses_count))
-        self.current_segment += 1
-        self.segment_ls[self.current_segment].fill_segment(self, self.memory_space, connecting_cells)
+        cells = [self.store.cell_index(cell) for cell in connecting_cells if cell != self.initiator]
+        self.store.grow_segment(self.cell, cells, [random.uniform(0, 1) for c in cells])
 
     def add_synapse(self, synapse):
         #
         # a function that adds a synapse to a segment object for the focus cell
         #
+        if len(self.store.get_segments(self.cell)) == 0:
+            self.store.create_segment(self.cell)
         self.segment_ls[self.current_segment].add_synapse(synapse)
 
     def get_max_overlap_score(self, active_cells_dict):
@@ -65,24 +86,25 @@ class Segments():
         # a function that gets the overlap score between active cells and every segment in focus cell's list
         #
         # arguments:
-        #           active_cells_dict = a dictionary of cells in TM space that are active
+        #           active_cells_dict = a dictionary of cells in TM space that are active, or a boolean ndarray over the
+        #                               cell numbers (see Segment.get_active_mask)
         #
-        # returns: 
-        #           max_score = an integer that represents the maximum number of cells that are active and 
-        #  
-        max_score = 0
-        for i in self.segment_ls:
-            if i.get_overlap_cells(active_cells_dict) > max_score:
-                max_score = i.get_overlap_cells(active_cells_dict)
+        # returns:
+        #           max_score = an integer that represents the maximum number of cells that are active and
+        #
+        segments = self.store.get_segments(self.cell)
+        if isinstance(active_cells_dict, dict):
+            active_cells_dict = self.store.get_active_mask([self.store.cell_index(j.initiator) for i in active_cells_dict
+                                                            for j in active_cells_dict[i]])
 
-        return max_score
+        return int(self.store.get_overlap_scores(segments, active_cells_dict).max(initial=0))
 
     def perm_above_pred_state_threshold(self, pred_state_threshold):
         #
         # a function that determines if any of the segments for the focus cell are above a threshold
         #
         # arguments:
-        #           pred_state_threshold = a float, between 0 and 1, representing the threshold between 
+        #           pred_state_threshold = a float, between 0 and 1, representing the threshold between
         #                                   predictive state and active state
         # returns:
         #           above = a logical operator, true if there is a segment that meets the threshold, false if not
@@ -99,8 +121,8 @@ class Segments():
         #
         # arguments:
         #           cell_ls = a list of the active cells in TM space
-        #           add_val = a float, between 0 and 1, the amount to add to the permanence for segments 
-        #           dec_val = a float, between 0 and 1, the amount to remove from permanence for segments 
+        #           add_val = a float, between 0 and 1, the amount to add to the permanence for segments
+        #           dec_val = a float, between 0 and 1, the amount to remove from permanence for segments
         for i in self.segment_ls:
             # checks whether the focus cell's segment connections are contained in the list of active cells
             # if yes, then increases the permanence values; if not, then decreases the permanence values
@@ -0,0 +1,487 @@
+import multiprocessing
+import weakref
+
+import numpy as np
+
+from connections import Connections
+from permanences import get_ranges
+
+#
+# object: Sharded_Connections, a Connections store whose synapses are split across worker processes, every process
+#         holding the segments of a contiguous range of columns (all the cells of a column are in the same shard)
+#
+# the store in the calling process keeps what decides the segment ids: the segment lists of every cell, the cell and
+# last activity of every segment, the free ids and the counters, but no synapses. The shards hold the same segments
+# under the same ids, with their synapses, and do the work on them: every shard scores and adapts the segments of
+# its cells, finds which of them the active cells activate, and grows the new segments of its cells along with the
+# other ends of new synapses that fall in its cells. connect_cells hands out the ids of the new segments (and evicts
+# the least recently active ones) in the calling process first, in cell order, exactly as Connections does; then
+# every shard replays the growth on its own cells. So a step only sends cell numbers, the active cells and the new
+# synapses to the workers, and the segments, ids and results are those of one Connections store
+#
+# the synapses are gathered back into the calling process to write a state (get_state), and for good by close; a
+# state that is loaded (set_state, load_segments) is split across the shards again. While the workers hold them,
+# the synapse arrays of the store in the calling process are empty, so Segment views onto it show no synapses
+#
+# attributes (besides those of Connections):
+#           workers = an integer, the number of worker processes
+#           bounds = an int64 ndarray of workers + 1 cell numbers, shard w holds the cells bounds[w] to bounds[w+1]
+#           pipes = a list of multiprocessing connections to the workers, None once closed: the store then works
+#                   serially, as a Connections, with every synapse gathered back
+#           processes = a list of the worker processes
+#           gathered = a boolean, True while the synapses of the shards are copied into this store
+#           finalizer = a weakref.finalize that stops the workers if the store is garbage collected (or the
+#                   interpreter exits) without being closed
+#
+# functions:
+#           __init__(., x, y, z, workers, **kwargs)
+#           allocate_slots(., count)
+#           call_shards(., function, tasks)
+#           split_cells(., cells)
+#           gather(.)
+#           scatter(.)
+#           drop_synapses(.)
+#           load_segments(., cells, sizes, presyn, perms)
+#           connect_cells(., cells, presyn_ls, perms_ls, new_segments)
+#           get_best_overlaps(., cells, active_mask)
+#           adapt_segments(., cells, active_mask, inc_val, dec_val, perm_floor)
+#           activate_segments(., active_cells, threshold)
+#           get_num_synapses(.)
+#           get_counts(.)
+#           check_consistency(.)
+#           get_state(., delta)
+#           set_state(., state)
+#           close(.)
+#
+# functions outside the object:
+#           split_state(state, low, high)
+#           serve_shard(pipe)
+#           shard_load(shape, limits, state, perm_sums), shard_overlaps(cells, active_mask),
+#           shard_adapt(cells, active_mask, inc_val, dec_val, perm_floor), shard_grow(iteration, events),
+#           shard_activate(iteration, active_cells, threshold), shard_export(), shard_counts(), shard_check(low, high)
+#           release(pipes, processes)
+#
+
+# the Connections store of the shard held by the current worker process, set by shard_load
+worker_state = {}
+
+
+def split_state(state, low, high):
+    #
+    # a function that keeps, from a full state written by Connections.get_state, the segments of the cells low to high
+    #
+    # returns: state = a dictionary of ndarrays, a full state for a store holding those cells only
+    #
+    own = (state['segment_cell'] >= low) & (state['segment_cell'] < high)
+    synapses = np.repeat(own, state['segment_size'])
+    listed = (state['list_cells'] >= low) & (state['list_cells'] < high)
+    counters = state['counters'].copy()
+    counters[2:] = 0
+
+    return dict(state, counters=counters, free_segments=np.zeros(0, dtype=np.int64),
+                segments=state['segments'][own], segment_cell=state['segment_cell'][own],
+                segment_size=state['segment_size'][own], synapse_presyn=state['synapse_presyn'][synapses],
+                synapse_perm=state['synapse_perm'][synapses], list_cells=state['list_cells'][listed],
+                list_lengths=state['list_lengths'][listed],
+                list_segments=state['list_segments'][np.repeat(listed, state['list_lengths'])])
+
+
+def serve_shard(pipe):
+    #
+    # a function that runs in every worker process: it calls the functions sent by the calling process and sends
+    # back what they return (or the exception they raise), until it gets None
+    #
+    while True:
+        task = pipe.recv()
+        if task is None:
+            break
+        function, args = task
+        try:
+            result = function(*args)
+        except Exception as error:
+            result = error
+        pipe.send(result)
+    pipe.close()
+
+
+def shard_load(shape, limits, state, perm_sums):
+    store = Connections(*shape, *limits)
+    store.set_state(state)
+    # the totals kept by the calling process, rather than totals added up again, so the threshold sees the same ones
+    store.segment_perm_sum[state['segments']] = perm_sums
+    worker_state['store'] = store
+
+
+def shard_overlaps(cells, active_mask):
+    return worker_state['store'].get_best_overlaps(cells, active_mask)
+
+
+def shard_adapt(cells, active_mask, inc_val, dec_val, perm_floor):
+    worker_state['store'].adapt_segments(cells, active_mask, inc_val, dec_val, perm_floor)
+
+
+def shard_grow(iteration, events):
+    #
+    # a function that replays the growth of connect_cells on the cells of the shard, in the same order
+    #
+    # arguments:
+    #           iteration = an integer, the current time step
+    #           events = a list of (cell, segment, capacity, presyn, perms, firsts, ends, end_perms) tuples, one per
+    #                    connected cell that touches the shard: segment is the id of the segment the cell connects
+    #                    from (None if the cell is not in the shard), to be created with capacity slots unless
+    #                    capacity is None, and presyn, perms its synapses; firsts lists the (cell, segment) first
+    #                    segments of the other ends in the shard; ends and end_perms are the other ends in the shard
+    #
+    store = worker_state['store']
+    store.iteration = iteration
+    # the other ends are queued as in connect_cells, see append_queued
+    queued_segments, queued_presyn, queued_perms = [], [], []
+    queued_cells = set()
+    for cell, segment, capacity, presyn, perms, firsts, ends, end_perms in events:
+        if segment is not None:
+            if cell in queued_cells:
+                store.append_queued(queued_segments, queued_presyn, queued_perms)
+                queued_cells.clear()
+            # a new segment may get the id of the one it evicts, so it is created whether or not the id is listed
+            if capacity is not None:
+                store.create_segment(cell, capacity, segment)
+            if len(presyn) > 0:
+                store.add_synapses(segment, presyn, perms)
+        for other, first in firsts:
+            store.create_segment(other, 0, first)
+        if len(ends) > 0:
+            queued_segments.append(np.array([store.cell_segments[c][-1] for c in ends.tolist()], dtype=np.int64))
+            queued_presyn.append(np.full(len(ends), cell, dtype=np.int64))
+            queued_perms.append(end_perms)
+            queued_cells.update(ends.tolist())
+    store.append_queued(queued_segments, queued_presyn, queued_perms)
+    # the ids are handed out by the calling process, evicted ones are not reused here
+    store.free_segments = []
+
+
+def shard_activate(iteration, active_cells, threshold):
+    store = worker_state['store']
+    store.iteration = iteration
+    segments = store.get_active_segments(active_cells)
+    store.record_activity(segments)
+
+    return segments, segments[store.get_segment_perm_sums(segments) > threshold]
+
+
+def shard_export():
+    #
+    # a function that sends the synapses of every segment of the shard, the segments changed since the last export
+    # and the synapses removed since then
+    #
+    store = worker_state['store']
+    segments = np.flatnonzero(store.segment_cell[:store.num_segments] >= 0)
+    sizes = store.segment_size[segments]
+    slots = get_ranges(store.segment_start[segments], sizes)
+    dirty = np.flatnonzero(store.dirty_segments[:store.num_segments])
+    removed = store.num_removed_synapses
+    store.dirty_segments[:] = False
+    store.dirty_cells = set()
+    store.num_removed_synapses = 0
+
+    return (segments, sizes, store.synapse_presyn[slots], store.synapse_perm[slots],
+            store.segment_perm_sum[segments], dirty, removed)
+
+
+def shard_counts():
+    store = worker_state['store']
+    removed = store.num_removed_synapses
+    store.num_removed_synapses = 0
+
+    return store.get_num_synapses(), removed, store.get_nbytes()
+
+
+def shard_check(low, high):
+    store = worker_state['store']
+    store.check_consistency()
+    segments = np.flatnonzero(store.segment_cell[:store.num_segments] >= 0)
+
+    return ({cell: segments for cell, segments in store.cell_segments.items() if low <= cell < high and segments},
+            segments, store.segment_last_active[segments])
+
+
+def release(pipes, processes):
+    #
+    # a function that stops the workers; it holds no reference to the store, so it can run as the store's finalizer
+    #
+    for pipe in pipes:
+        try:
+            pipe.send(None)
+            pipe.close()
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+
+class Sharded_Connections(Connections):
+    def __init__(self, x, y, z, workers, **kwargs):
+        Connections.__init__(self, x, y, z, **kwargs)
+        self.workers = max(1, min(workers, x * y))
+
+        bounds = np.linspace(0, x * y, self.workers + 1).astype(np.int64) * z
+        self.bounds = bounds
+        self.pipes = []
+        self.processes = []
+        self.gathered = True
+        for w in range(self.workers):
+            pipe, worker_pipe = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shard, args=(worker_pipe,), daemon=True)
+            process.start()
+            worker_pipe.close()
+            self.pipes.append(pipe)
+            self.processes.append(process)
+        self.finalizer = weakref.finalize(self, release, self.pipes, self.processes)
+        self.scatter()
+
+    def allocate_slots(self, count):
+        # while the workers hold the synapses, the segments of this store get no slots
+        if self.pipes is not None and not self.gathered:
+            return 0
+        return Connections.allocate_slots(self, count)
+
+    def call_shards(self, function, tasks):
+        #
+        # a function that calls function(*task) in the worker of every shard with a task, all at once
+        #
+        # arguments:
+        #           function = one of the shard_ functions
+        #           tasks = a list of argument tuples, one per shard, None for the shards with nothing to do
+        #
+        # returns: results = a list of what function returned in every shard (None where there was no task)
+        #
+        for pipe, task in zip(self.pipes, tasks):
+            if task is not None:
+                pipe.send((function, task))
+        results = [pipe.recv() if task is not None else None for pipe, task in zip(self.pipes, tasks)]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        return results
+
+    def split_cells(self, cells):
+        #
+        # a function that gives, for every shard, the positions in cells of the cells it holds
+        #
+        cells = np.asarray(cells, dtype=np.int64)
+        shards = np.searchsorted(self.bounds, cells, side='right') - 1
+        return [np.flatnonzero(shards == w) for w in range(self.workers)]
+
+    def gather(self):
+        #
+        # a function that copies the synapses of every shard into this store, packed, with the segments changed in
+        # the shards marked as changed here
+        #
+        exports = self.call_shards(shard_export, [()] * self.workers)
+        segments, sizes, presyn, perms, sums, dirty = [np.concatenate([export[i] for export in exports])
+                                                       for i in range(6)]
+        sizes = sizes.astype(np.int64)
+        capacities = np.maximum(sizes, self.min_segment_capacity)
+        starts = np.cumsum(capacities) - capacities
+        total = int(capacities.sum())
+
+        self.synapse_presyn = np.full(max(total, 256), -1, dtype=np.int32)
+        self.synapse_perm = np.zeros(len(self.synapse_presyn), dtype=np.float32)
+        self.synapse_segment = np.full(len(self.synapse_presyn), -1, dtype=np.int32)
+        slots = get_ranges(starts, sizes)
+        owners = np.repeat(segments, sizes)
+        self.synapse_presyn[slots] = presyn
+        self.synapse_perm[slots] = perms
+        self.synapse_segment[slots] = owners
+        self.synapse_top = total
+        self.free_slots = 0
+        self.segment_start[segments] = starts
+        self.segment_size[segments] = sizes
+        self.segment_capacity[segments] = capacities
+        self.segment_perm_sum[segments] = sums
+
+        changed = self.dirty_segments.copy()
+        changed[dirty.astype(np.int64)] = True
+        self.presyn_segments = {}
+        self.index_synapses(owners, presyn)
+        self.dirty_segments = changed
+        self.num_removed_synapses += sum(export[6] for export in exports)
+        self.gathered = True
+
+    def scatter(self):
+        #
+        # a function that loads every shard with the segments of its cells, as this store holds them, and empties
+        # the synapse arrays of this store
+        #
+        changed, changed_cells = self.dirty_segments.copy(), set(self.dirty_cells)
+        state = Connections.get_state(self)
+        # writing the state is no save, what changed since the last one still has to go in the next
+        self.dirty_segments, self.dirty_cells = changed, changed_cells
+
+        shape = (self.x, self.y, self.z)
+        limits = (self.min_segment_capacity, self.max_segments_per_cell, self.max_synapses_per_segment)
+        tasks = []
+        for w in range(self.workers):
+            shard = split_state(state, self.bounds[w], self.bounds[w + 1])
+            tasks.append((shape, limits, shard, self.segment_perm_sum[shard['segments']]))
+        self.call_shards(shard_load, tasks)
+        self.drop_synapses()
+
+    def drop_synapses(self):
+        #
+        # a function that empties the synapse arrays of this store, once the shards hold the synapses
+        #
+        self.synapse_presyn = np.full(256, -1, dtype=np.int32)
+        self.synapse_perm = np.zeros(256, dtype=np.float32)
+        self.synapse_segment = np.full(256, -1, dtype=np.int32)
+        self.synapse_top = 0
+        self.free_slots = 0
+        self.segment_start[:] = 0
+        self.segment_size[:] = 0
+        self.segment_perm_sum[:] = 0
+        self.presyn_segments = {}
+        self.gathered = False
+
+    def load_segments(self, cells, sizes, presyn, perms):
+        if self.pipes is None:
+            return Connections.load_segments(self, cells, sizes, presyn, perms)
+        self.gather()
+        segments = Connections.load_segments(self, cells, sizes, presyn, perms)
+        self.scatter()
+
+        return segments
+
+    def connect_cells(self, cells, presyn_ls, perms_ls, new_segments=True):
+        if self.pipes is None:
+            return Connections.connect_cells(self, cells, presyn_ls, perms_ls, new_segments)
+
+        # the segment ids, in the order Connections hands them out: the segment of every cell, then the first
+        # segments of the other ends that have none
+        events = []
+        for cell, presyn, perms in zip(cells, presyn_ls, perms_ls):
+            cell = int(cell)
+            segments = self.get_segments(cell)
+            capacity = len(presyn) if new_segments else 0
+            if new_segments or not segments:
+                segment = self.create_segment(cell, capacity)
+            else:
+                segment, capacity = segments[0], None
+            presyn = np.asarray(presyn, dtype=np.int64)
+            perms = np.asarray(perms)
+            keep = presyn != cell
+            presyn, perms = presyn[keep], perms[keep]
+            firsts = []
+            if len(presyn) > 0:
+                firsts = [(other, self.create_segment(other)) for other in np.unique(presyn).tolist()
+                          if not self.cell_segments.get(other)]
+            events.append((cell, segment, capacity, presyn, perms, firsts))
+
+        tasks = []
+        for w in range(self.workers):
+            low, high = self.bounds[w], self.bounds[w + 1]
+            shard_events = []
+            for cell, segment, capacity, presyn, perms, firsts in events:
+                own = low <= cell < high
+                ends = (presyn >= low) & (presyn < high)
+                shard_firsts = [(other, first) for other, first in firsts if low <= other < high]
+                if own or ends.any():
+                    shard_events.append((cell, segment if own else None, capacity, presyn if own else None,
+                                         perms if own else None, shard_firsts, presyn[ends], perms[ends]))
+            tasks.append((self.iteration, shard_events) if shard_events else None)
+        self.call_shards(shard_grow, tasks)
+
+    def get_best_overlaps(self, cells, active_mask):
+        if self.pipes is None:
+            return Connections.get_best_overlaps(self, cells, active_mask)
+        cells = np.asarray(cells, dtype=np.int64)
+        positions = self.split_cells(cells)
+        results = self.call_shards(shard_overlaps, [(cells[shard], active_mask) if len(shard) > 0 else None
+                                                    for shard in positions])
+        scores = np.zeros(len(cells), dtype=np.int64)
+        for shard, result in zip(positions, results):
+            if result is not None:
+                scores[shard] = result
+
+        return scores
+
+    def adapt_segments(self, cells, active_mask, inc_val, dec_val, perm_floor):
+        if self.pipes is None:
+            return Connections.adapt_segments(self, cells, active_mask, inc_val, dec_val, perm_floor)
+        cells = np.asarray(cells, dtype=np.int64)
+        self.call_shards(shard_adapt, [(cells[shard].tolist(), active_mask, inc_val, dec_val, perm_floor)
+                                       if len(shard) > 0 else None for shard in self.split_cells(cells)])
+
+    def activate_segments(self, active_cells, threshold):
+        if self.pipes is None:
+            return Connections.activate_segments(self, active_cells, threshold)
+        results = self.call_shards(shard_activate, [(self.iteration, active_cells, threshold)] * self.workers)
+        self.record_activity(np.concatenate([active for active, picked in results]))
+
+        return np.sort(np.concatenate([picked for active, picked in results]))
+
+    def get_num_synapses(self):
+        if self.pipes is None:
+            return Connections.get_num_synapses(self)
+        return self.get_counts()['synapses']
+
+    def get_counts(self):
+        if self.pipes is None:
+            return Connections.get_counts(self)
+        counts = self.call_shards(shard_counts, [()] * self.workers)
+        self.num_removed_synapses += sum(removed for synapses, removed, nbytes in counts)
+
+        return {'segments': self.get_num_segments(), 'synapses': sum(synapses for synapses, removed, nbytes in counts),
+                'evicted_segments': self.num_evicted_segments, 'removed_synapses': self.num_removed_synapses,
+                'nbytes': self.get_nbytes() + sum(nbytes for synapses, removed, nbytes in counts)}
+
+    def check_consistency(self):
+        #
+        # a function that checks every shard as Connections.check_consistency does, and that the shards hold the
+        # segments this store lists, with the same last activity
+        #
+        # raises: RuntimeError, naming the first structure that does not match
+        #
+        if self.pipes is None:
+            return Connections.check_consistency(self)
+        segments = np.flatnonzero(self.segment_cell[:self.num_segments] >= 0)
+        listed = sorted(segment for cell_segments in self.cell_segments.values() for segment in cell_segments)
+        if listed != segments.tolist():
+            raise RuntimeError("cell_segments does not match segment_cell")
+
+        results = self.call_shards(shard_check, [(self.bounds[w], self.bounds[w + 1]) for w in range(self.workers)])
+        for w, (cell_segments, shard_segments, last_active) in enumerate(results):
+            low, high = self.bounds[w], self.bounds[w + 1]
+            own = {cell: segments for cell, segments in self.cell_segments.items() if low <= cell < high and segments}
+            if cell_segments != own:
+                raise RuntimeError("the segments of shard %d do not match cell_segments" % w)
+            if not np.array_equal(last_active, self.segment_last_active[shard_segments]):
+                raise RuntimeError("segment_last_active of shard %d does not match" % w)
+
+    def get_state(self, delta=False):
+        if self.pipes is None:
+            return Connections.get_state(self, delta)
+        self.gather()
+        state = Connections.get_state(self, delta)
+        self.drop_synapses()
+
+        return state
+
+    def set_state(self, state):
+        if self.pipes is None:
+            return Connections.set_state(self, state)
+        self.gather()
+        Connections.set_state(self, state)
+        self.scatter()
+
+    def close(self):
+        #
+        # a function that gathers every synapse back into this store and stops the workers; the store goes on
+        # working serially afterwards
+        #
+        if self.pipes is None:
+            return
+        self.gather()
+        self.pipes = None
+        self.finalizer()
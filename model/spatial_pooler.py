@@ -1,110 +1,351 @@
-
 from spatial_pooler_neuron import *
+from sdr import SDR, as_sdr
+from permanences import *
+from sdr_cache import SDR_Cache
+from sdr_index import SDR_Index
 import numpy as np
 
 #
 # object: Spatial_Pooler
-# 
+#
 # attributes:
-#           perm_connect_threshold = a float between 0 and 1, default is 0.5, that represents strength of connection 
-#                                   between input and spatial pooler element 
-#           perm_inc_val = a float between 0 and 1, default is 0.3, which represents how much to increase strength 
+#           perm_connect_threshold = a float between 0 and 1, default is 0.5, that represents strength of connection
+#                                   between input and spatial pooler element
+#           perm_inc_val = a float between 0 and 1, default is 0.3, which represents how much to increase strength
 #                                   of connection during learning
-#           perm_dec_val = a float between 0 and 1, default is 0.1, which represents how much to decrease 
+#           perm_dec_val = a float between 0 and 1, default is 0.1, which represents how much to decrease
 #                                   strength of connection during learning
-#           activate_threshold = a positive integer, default is 4, that represents the number of connections 
+#           activate_threshold = a positive integer, default is 4, that represents the number of connections
 #                                   with permanence value above perm_connect_threshold in order for a column to become active
-#           cells_dict = a dictionary, which will contain the spatial pooler neurons, keys are indices of where those neurons live
-#           m, n = integers, representing the number of rows and columns of the spatial pooler -- 
-#                                   the spatial pooler size can be different than the input elements of the sequence; 
+#           inhibition = a string, default is 'threshold', how active columns are selected among the ones reaching
+#                                   activate_threshold: 'threshold' keeps all of them, 'global' keeps the
+#                                   num_active_columns with the highest overlap, 'local' keeps the highest overlaps
+#                                   within each column's neighborhood
+#           sparsity = a float between 0 and 1, default is 0.02, the target fraction of active columns for the
+#                                   'global' and 'local' inhibition modes
+#           inhibition_radius = an integer, default is 2, how many rows/columns away a neighbor can be for 'local' inhibition
+#           num_active_columns = an integer, the number of winners kept by 'global' inhibition
+#           local_active_columns = an integer, the number of winners kept per neighborhood by 'local' inhibition
+#           neighborhoods = an ndarray of shape (num_columns, neighborhood size), the neighbors of every column, padded
+#                                   with num_columns where a neighborhood runs off the edge of the pooler
+#           seed = an integer or None, default is None, the seed of the random generator used to build the pooler
+#           rng = a numpy.random.Generator, the random generator used to build the pooler
+#           cache_size = an integer, default is 0, how many inputs to remember the activated elements of (0 turns the
+#                                   cache off); the cache only serves inference (infer, transform with learn=False):
+#                                   every learning step changes the permanences, so a result cached while learning
+#                                   could never be used again
+#           cache = an SDR_Cache, or None when cache_size is 0
+#           version = an integer, bumped every time learning changes the permanences, so cached results
+#                                   computed with older permanences are never used
+#           tie_breaker = an ndarray of small random values, added to the overlaps so that winners are always unique
+#           m, n = integers, representing the number of rows and columns of the spatial pooler --
+#                                   the spatial pooler size can be different than the input elements of the sequence;
 #                                   often it is bigger
-#           input_output_mapping = a dictionary, which will contain the information that maps each input to certain 
+#           input_size = a pair (m,n) describing the size of an element in the sequential data input
+#           num_columns = an integer, m*n, the number of spatial pooler elements
+#           num_inputs = an integer, the number of cells in one input element
+#           potential_pct = a float between 0 and 1, default is 1.0, the fraction of the candidate input cells
+#                                   each spatial pooler element can connect to (its potential pool)
+#           potential_radius = an integer or None, default is None; if None, the potential pools are drawn at random
+#                                   from the whole input, otherwise from the input cells around each element
+#           permanences = a Dense_Permanences store (every element connects to every input cell) or, when the
+#                                   potential pools are a subset of the input, a Sparse_Permanences store;
+#                                   element c (row-major position) is row c of the store
+#           column_positions = a list of (i,j) tuples, the position of every spatial pooler element by row of permanences
+#           input_output_mapping = a dictionary, which will contain the information that maps each input to certain
 #                                   elements in the spatial pooler
+#           input_index = an SDR_Index from every distinct input seen by transform to the labels (rows with an
+#                                   active bit) it is recorded under in input_output_mapping
 #
 # functions:
-#        __init__(., pooler_size, input_size, perm_connect_threshold, perm_inc_val, perm_dec_val, activate_threshold)
+#        __init__(., pooler_size, input_size, perm_connect_threshold, perm_inc_val, perm_dec_val, activate_threshold,
+#                   inhibition, sparsity, inhibition_radius, potential_pct, potential_radius, seed, cache_size)
+#       get_neighborhoods(.)
+#       get_overlap_scores(., input_matrix)
+#       inhibit(., overlaps)
 #       learn_one_input(., input_matrix)
-#       transform(., sequence_of_matrix)
+#       get_chunk_size(.)
+#       infer(., input_stack, return_indices)
+#       infer_cached(., input_stack, return_indices)
+#       transform(., sequence_of_matrix, learn)
+
+# about how many values the largest per-chunk intermediate of infer holds, see get_chunk_size
+INFER_CHUNK_ELEMENTS = 1 << 22
 
 class Spatial_Pooler():
-    def __init__(self, pooler_size = (10,10),input_size = (7,7), perm_connect_threshold=0.5, perm_inc_val=0.3, perm_dec_val=0.1, activate_threshold=4):
+    def __init__(self, pooler_size = (10,10),input_size = (7,7), perm_connect_threshold=0.5, perm_inc_val=0.3, perm_dec_val=0.1, activate_threshold=4,
+                 inhibition='threshold', sparsity=0.02, inhibition_radius=2, potential_pct=1.0, potential_radius=None,
+                 seed=None, cache_size=0):
+
+        if inhibition not in ('threshold', 'global', 'local'):
+            raise ValueError("inhibition must be 'threshold', 'global' or 'local', got " + repr(inhibition))
 
         self.perm_connect_threshold = perm_connect_threshold
         self.perm_inc_val = perm_inc_val
         self.perm_dec_val = perm_dec_val
         self.activate_threshold = activate_threshold
+        self.inhibition = inhibition
+        self.sparsity = sparsity
+        self.inhibition_radius = inhibition_radius
+        self.potential_pct = potential_pct
+        self.potential_radius = potential_radius
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
 
-        self.cells_dict = {}
         self.m,self.n = pooler_size
-        
-        # initialize the cells_dict with spatial pooler neurons
-        for i in range(self.m):
-            for j in range(self.n):
-                self.cells_dict[(i,j)] = Spatial_Pooler_Neuron((i,j),input_size)
+        self.input_size = input_size
+        self.num_columns = self.m * self.n
+        self.num_inputs = input_size[0] * input_size[1]
+
+        # one row of permanence values per spatial pooler element, drawn in a single call from the same
+        # distribution the per-column Spatial_Pooler_Neuron objects use
+        if self.potential_pct >= 1.0 and self.potential_radius is None:
+            values = get_normal_distribution(self.num_columns * self.num_inputs, self.rng)
+            values = values.reshape(self.num_columns, self.num_inputs)
+            self.permanences = Dense_Permanences(values, self.perm_connect_threshold)
+        else:
+            # memory and overlap cost follow the size of the potential pools instead of the input area
+            indptr, indices = get_potential_pools(pooler_size, input_size, self.potential_pct, self.potential_radius,
+                                                  self.rng)
+            self.permanences = Sparse_Permanences(indptr, indices, get_normal_distribution(len(indices), self.rng),
+                                                  self.num_inputs, self.perm_connect_threshold)
+        self.column_positions = [(i,j) for i in range(self.m) for j in range(self.n)]
+
+        # winner counts and neighborhoods for the k-winners-take-all inhibition modes
+        self.num_active_columns = max(1, int(round(self.sparsity * self.num_columns)))
+        self.neighborhoods = self.get_neighborhoods()
+        self.local_active_columns = max(1, int(round(self.sparsity * self.neighborhoods.shape[1])))
+        self.tie_breaker = 0.01 * self.rng.random(self.num_columns)
+
+        # memo of the activated elements for inputs seen before
+        self.cache_size = cache_size
+        self.cache = SDR_Cache(cache_size) if cache_size > 0 else None
+        self.version = 0
 
         self.input_output_mapping = {}
+        self.input_index = SDR_Index()
+
+    def get_neighborhoods(self):
+        #
+        # a function that lists, for every spatial pooler element, the elements at most inhibition_radius rows and
+        # columns away from it (itself included)
+        #
+        # returns:
+        #       neighborhoods = an ndarray of shape (num_columns, (2*inhibition_radius+1)**2) of column indices,
+        #                       positions that fall outside the pooler hold num_columns
+        #
+        r = self.inhibition_radius
+        offsets = np.arange(-r, r + 1)
+        rows = np.arange(self.m)[:, None, None, None] + offsets[None, None, :, None]
+        cols = np.arange(self.n)[None, :, None, None] + offsets[None, None, None, :]
+        rows, cols = np.broadcast_arrays(rows, cols)
+        inside = (rows >= 0) & (rows < self.m) & (cols >= 0) & (cols < self.n)
+        neighborhoods = np.where(inside, rows * self.n + cols, self.num_columns)
+
+        return neighborhoods.reshape(self.num_columns, -1)
+
+    def get_overlap_scores(self, input_sdr):
+        #
+        # a function that computes the overlap score of every spatial pooler element for one input
+        #
+        # arguments:
+        #       input_sdr, an SDR (or a list or an ndarray) of the encoded sequence element
+        #
+        # returns:
+        #       overlaps = an ndarray of length num_columns, the number of active connections that line up
+        #                   with a 1 in the input for each element
+
+        input_sdr = as_sdr(input_sdr, self.input_size)
+
+        # only gather the connections at the active input bits, so the cost follows the number of active bits
+        return self.permanences.overlap(input_sdr.sparse)
+
+    def inhibit(self, overlaps):
+        #
+        # a function that selects the activated spatial pooler elements from their overlap scores
+        #
+        # arguments:
+        #       overlaps = an ndarray of shape (num_columns,) or (T, num_columns) of overlap scores
+        #
+        # returns:
+        #       active = a boolean ndarray with the shape of overlaps, True for the activated elements
+        #
+        eligible = overlaps >= self.activate_threshold
+        if self.inhibition == 'threshold':
+            return eligible
+
+        # break ties between equal overlaps and push the columns below activate_threshold out of the competition
+        scores = np.where(eligible, overlaps + self.tie_breaker, -np.inf)
+
+        if self.inhibition == 'global':
+            k = self.num_active_columns
+            if k >= self.num_columns:
+                return eligible
+            # partial selection of the k highest scores, no full sort needed
+            winners = np.argpartition(scores, self.num_columns - k, axis=-1)[..., self.num_columns - k:]
+            active = np.zeros(scores.shape, dtype=bool)
+            np.put_along_axis(active, winners, True, axis=-1)
+            return active & eligible
+
+        # local: a column wins if its score is among the local_active_columns highest of its neighborhood
+        padding = np.full(scores.shape[:-1] + (1,), -np.inf)
+        neighbor_scores = np.concatenate([scores, padding], axis=-1)[..., self.neighborhoods]
+        size = self.neighborhoods.shape[1]
+        k = min(self.local_active_columns, size)
+        kth_highest = np.partition(neighbor_scores, size - k, axis=-1)[..., size - k]
+
+        return eligible & (scores >= kth_highest)
 
     def learn_one_input(self, input_matrix):
-        # 
+        #
         # a function that has the spatial pooler learn from one input at a time
         #
         # arguments:
-        #       input_matrix, a list or an ndarray of the encoded sequence element
-        #
-        # returns: 
-        #       selected_columns_ls, a list of the activated elements of the spatial pooler based on thresholds
-        
-        selected_columns_ls = []
-
-        # get active connections for each cell 
-        for cell in self.cells_dict:
-            
-            col_matrix = self.cells_dict[cell].get_active_connections(self.perm_connect_threshold)
-            result_matrix = np.multiply(col_matrix, input_matrix)
-            
-            # overlap score for each cell using matrix multiplication
-            ones_count = sum(sum(result_matrix))
-            
-            # select activated columns
-            if ones_count >= self.activate_threshold:
-                selected_columns_ls.append(self.cells_dict[cell])
-
-        # update perm value
-        for col in selected_columns_ls:
-            col.update_permenance(self.perm_inc_val, self.perm_dec_val, input_matrix)
-
-        return selected_columns_ls
-
-    def transform(self, sequence_of_matrix):
-        # 
+        #       input_matrix, an SDR, or a list or an ndarray of the encoded sequence element
+        #
+        # returns:
+        #       selected_columns = an ndarray of the indices (rows of permanences) of the activated elements
+        #                           of the spatial pooler based on thresholds
+
+        input_sdr = as_sdr(input_matrix, self.input_size)
+
+        # select activated columns; the cache is not looked at, the permanences change at every step
+        overlaps = self.get_overlap_scores(input_sdr)
+        selected_columns = np.flatnonzero(self.inhibit(overlaps))
+
+        # update perm value: increase where the input has a 1, decrease everywhere else
+        if len(selected_columns) > 0:
+            self.permanences.adapt(selected_columns, input_sdr.sparse, self.perm_inc_val, self.perm_dec_val)
+            self.version += 1
+
+        return selected_columns
+
+    def get_chunk_size(self):
+        #
+        # a function that gives how many inputs infer scores together: as many as keep the (inputs, columns,
+        # neighborhood) scores of local inhibition, or the (inputs, columns) overlaps otherwise, near
+        # INFER_CHUNK_ELEMENTS values
+        #
+        # returns: chunk = an integer, at least 1
+        #
+        width = self.num_columns
+        if self.inhibition == 'local':
+            width *= self.neighborhoods.shape[1]
+
+        return max(1, INFER_CHUNK_ELEMENTS // width)
+
+    def infer(self, input_stack, return_indices=False):
+        #
+        # a function that finds the activated spatial pooler elements for a whole stack of inputs at once, without learning
+        #
+        # arguments:
+        #       input_stack = a list of SDRs, or a list or an ndarray of shape (T, m, n) (or (T, m*n)) holding T encoded
+        #                       sequence elements
+        #       return_indices = a logical operator, default is False; if True, return one index array per input
+        #                       instead of the boolean matrix
+        #
+        # returns:
+        #       active = a boolean ndarray of shape (T, num_columns), True where an element is activated by an input,
+        #               or a list of T ndarrays of active column indices if return_indices is True
+
+        if self.cache is not None:
+            return self.infer_cached(input_stack, return_indices)
+
+        sdr_inputs = len(input_stack) > 0 and isinstance(input_stack[0], SDR)
+        if sdr_inputs:
+            inputs = input_stack
+        else:
+            inputs = np.asarray(input_stack).reshape(-1, self.num_inputs)
+
+        # the stack is scored a fixed number of inputs at a time, so the overlap scores and the local inhibition
+        # neighborhoods of a chunk are all that is held, however long the stack is
+        chunk = self.get_chunk_size()
+        results = []
+        for start in range(0, len(inputs), chunk):
+            rows = inputs[start:start + chunk]
+            if sdr_inputs:
+                rows = np.stack([x.get_flat_dense() for x in rows])
+            # overlap score for every (input, column) pair of the chunk at once; permanences are left untouched
+            active = self.inhibit(self.permanences.overlap_batch(rows != 0))
+            if return_indices:
+                results.extend(np.flatnonzero(row) for row in active)
+            else:
+                results.append(active)
+
+        if return_indices:
+            return results
+        if len(results) == 0:
+            return np.zeros((0, self.num_columns), dtype=bool)
+        return np.concatenate(results)
+
+    def infer_cached(self, input_stack, return_indices=False):
+        #
+        # a function that does what infer does, but only scores the distinct inputs that are not in the cache
+        #
+        # arguments and returns: see infer
+        #
+        input_sdrs = [as_sdr(x, self.input_size) for x in input_stack]
+        results = [self.cache.get(x, self.version) for x in input_sdrs]
+
+        # batched overlaps over the distinct inputs that missed, a chunk at a time (see infer)
+        missing = {}
+        for t in range(len(results)):
+            if results[t] is None:
+                missing.setdefault(input_sdrs[t], []).append(t)
+        keys = list(missing.keys())
+        chunk = self.get_chunk_size()
+        for start in range(0, len(keys), chunk):
+            rows = np.stack([x.get_flat_dense() for x in keys[start:start + chunk]])
+            for key, row in zip(keys[start:start + chunk], self.inhibit(self.permanences.overlap_batch(rows != 0))):
+                columns = np.flatnonzero(row)
+                self.cache.put(key, self.version, columns)
+                for t in missing[key]:
+                    results[t] = columns
+
+        if return_indices:
+            return results
+        active = np.zeros((len(results), self.num_columns), dtype=bool)
+        for t in range(len(results)):
+            active[t, results[t]] = True
+        return active
+
+    def transform(self, sequence_of_matrix, learn=True):
+        #
         # a function that takes in a sequence of encoded data and transforms them to a spatial pooler, one element at a time
         #
         # arguments:
-        #       sequence_of_matrix, a list or an ndarray of the encoded sequence element
+        #       sequence_of_matrix, a list of SDRs, or a list or an ndarray of the encoded sequence element
+        #       learn = a logical operator, default is True; if False, the permanences stay frozen and the whole
+        #               sequence is scored in one batched call to infer
         #
-        # returns: 
+        # returns:
         #       matrix_ls = a list of lists containing the corresponding spatial pooler elements that are activated by a particular sequence element
         #       self.input_output_mapping = a dictionary containing the mapping of elements in input to elements in SP
-        
+
         matrix_ls = []
-        
+
+        if not learn:
+            inferred_columns = self.infer(sequence_of_matrix, return_indices=True)
+
         # figure out which spatial pooler elements are activated after each element in the sequence
         for i in range(len(sequence_of_matrix)):
-            activated_cells = self.learn_one_input(sequence_of_matrix[i])
-
-            if sequence_of_matrix[i] not in list(self.input_output_mapping.keys()):
-                for row in range(len(sequence_of_matrix[i])):
-                    if 1 in sequence_of_matrix[i][row]:
-                        self.input_output_mapping[row] = []
-
-            tmp_ls = []
-            # exporting the position of activated cells 
-            for cell in activated_cells:                
-                tmp_ls.append(cell.position)
-                
-            for row in range(len(sequence_of_matrix[i])):
-                if 1 in sequence_of_matrix[i][row]:
-                    self.input_output_mapping[row] = tmp_ls
+            input_sdr = as_sdr(sequence_of_matrix[i], self.input_size)
+            if learn:
+                activated_columns = self.learn_one_input(input_sdr)
+            else:
+                activated_columns = inferred_columns[i]
+
+            # exporting the position of activated cells
+            tmp_ls = [self.column_positions[c] for c in activated_columns]
+
+            # every input row with an active bit maps to the activated elements, the rows of an input
+            # are only worked out the first time it is seen
+            labels = self.input_index.lookup(input_sdr)
+            if labels is None:
+                labels = tuple(np.unique(input_sdr.sparse // self.input_size[1]).tolist())
+                self.input_index.add(input_sdr, labels)
+            for row in labels:
+                self.input_output_mapping[row] = tmp_ls
             matrix_ls.append(tmp_ls)
-            
+
         return matrix_ls, self.input_output_mapping
@@ -1,5 +1,5 @@
 
-from scipy import stats
+from sdr import SDR
 import numpy as np
 
 # object: Spatial_Pooler_Neuron
@@ -10,18 +10,21 @@ import numpy as np
 #           input_size = an integer or a pair (m,n) describing the size of an element in the sequential data input
 #          
 # functions:
-#          __init__(self, pos, input_size)
+#          __init__(self, pos, input_size, rng)
 #          get_active_connections(self, threshold)
 #          update_permenance(self, inc_val, dec_val, change_pos_matrix)
+#
+# functions outside the object:
+#          get_normal_distribution(size, rng)
 
 class Spatial_Pooler_Neuron:
-    def __init__(self, pos, input_size):
+    def __init__(self, pos, input_size, rng=None):
         self.position = pos
         self.connections = {}
         self.input_size = input_size
         m, n = input_size
         # initialize permanence values
-        perm_ls = get_normal_distribution(m*n)
+        perm_ls = get_normal_distribution(m*n, rng)
         
         # for every element in the input, add a key to connections dictionary that is the location of that element
         # and give the dictionary value there a permenance
@@ -63,31 +66,55 @@ class Spatial_Pooler_Neuron:
         # arguments:
         #           inc_val = a float that determines how much to increase a permanence 
         #           dec_val = a float that determines how much to decrease a permanence
-        #           change_pos_matrix = a list or an ndarray of the encoded sequence element
+        #           change_pos_matrix = an SDR, or a list or an ndarray of the encoded sequence element
         #
         # returns:
         #        connections = the updated permanence values
         
         m, n = self.input_size
+        if isinstance(change_pos_matrix, SDR):
+            active = set(change_pos_matrix.sparse.tolist())
+        else:
+            active = set(i*n+j for i in range(m) for j in range(n) if change_pos_matrix[i][j] == 1)
+
         for i in range(m):
             for j in range(n):
                 # if the input has a 1 at this element, then increase the permanence
                 # if not, then decrease permanence
-                if change_pos_matrix[i][j] == 1:
+                if i*n+j in active:
                     self.connections[(i, j)] = self.connections[(i, j)] + inc_val
                 else:
                     self.connections[(i, j)] = self.connections[(i, j)] - dec_val
 
         return self.connections
 
-def get_normal_distribution(size):
+def get_normal_distribution(size, rng=None):
+    #
+    # a function that draws initial permanence values from a normal distribution with mean 0.3 and
+    # standard deviation 0.5, truncated to [mean + low*stddev, mean + high*stddev] = [0.3, 0.8]
+    #
+    # arguments:
+    #       size = an integer, how many values to draw
+    #       rng = a numpy.random.Generator, default is a freshly seeded one; pass a seeded generator for
+    #             reproducible values
+    #
+    # returns:
+    #       number = an ndarray of length size
+    #
     low = 0
     high = 1
     mean = 0.3
     stddev = 0.5
-    num_pop = size
-    number = stats.truncnorm.rvs(low, high,
-                            loc = mean, scale = stddev,
-                            size = num_pop)
+    if rng is None:
+        rng = np.random.default_rng()
+
+    # rejection sampling of standard normal draws in bulk: about a third of them fall inside [low, high]
+    number = np.empty(size)
+    filled = 0
+    while filled < size:
+        draws = rng.standard_normal(min(3 * (size - filled) + 16, 1 << 22))
+        draws = draws[(draws >= low) & (draws <= high)][:size - filled]
+        number[filled:filled + len(draws)] = draws
+        filled += len(draws)
 
-    return number
\ No newline at end of file
+    return mean + stddev * number
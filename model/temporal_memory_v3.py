@@ -1,7 +1,15 @@
-import random
+import json
+import time
+import numpy as np
 from spatial_pooler import *
 from segment import *
 from segment_ls import Segments
+from connections import Connections
+from sharded_connections import Sharded_Connections
+from sdr import SDR
+from sdr_index import SDR_Index
+from prediction_decoder import Prediction_Decoder
+from anomaly import raw_anomaly_score
 
 
 #
@@ -10,13 +18,48 @@ from segment_ls import Segments
 # attributes are:
 #       x, y, z = integers representing size of temporal memory space
 #       max_synapses_counts = integer for the maximum number of synapses per cell during initialization
-#       memory_space = a list of segments objects, representing the TM space
+#       rng = a numpy.random.Generator, seeded with the seed argument, used for every random choice
+#       connections = a Connections store, the flat arrays holding every segment, synapse and permanence value of TM space
+#       memory_space = a dictionary of Segments objects, views onto connections representing the TM space
+#       lazy = boolean, if True nothing is built up front: the Segments views of a column are made the first time
+#                       the column is used, and the random first segments of its cells are drawn the first time the
+#                       column becomes active while learning
+#       initialized_columns = a set of the columns whose cells have their random first segments (lazy mode only)
 #       pred_state_threshold = float, between 0 and 1, the threshold of total permanences that determine whether
 #                           a cell is in predictive state or not
 #       learn_inc_values = float, between 0 and 1, by how much connection permanences are increased during learning
 #       learn_dec_values = float, between 0 and 1, by how much connection permanences are decreased during learning
+#       max_segments_per_cell = integer, the most segments a cell holds, the least recently active one is evicted
+#                       to make room for a new one
+#       max_synapses_per_segment = integer, the most synapses a segment holds, the weakest ones are removed to make
+#                       room for new ones
+#       perm_floor = float, synapses whose permanence value falls to perm_floor or below are removed
+#       workers = integer or None, the number of worker processes the synapses are split across; None (the
+#                       default) keeps them all in connections, in the calling process. With workers, connections is
+#                       a Sharded_Connections: every process holds the segments of a range of columns and scores,
+#                       adapts, grows and activates them, while the random choices and the segment ids stay in the
+#                       calling process, so a seed gives the same results with or without workers
+#       anomaly_likelihood = an Anomaly_Likelihood the raw anomaly score of every step is fed to, or None
+#       instrument = boolean, if True every step times its phases (see PHASES) and counts the live segments,
+#                       synapses, active and predictive cells; the metrics go out with the TM_Result of the step
+#                       (so the reporter gets them) and add up into the totals of get_metrics. If False, the
+#                       only cost is a check per phase
+#       phase_totals = a dictionary {phase: seconds spent in it over the instrumented steps}
+#       instrumented_steps = an integer, the number of instrumented steps
+#       last_metrics = a dictionary, the metrics of the last instrumented step, None before the first one
+#       reporter = a function called with the TM_Result of every step, or None
+#       logger = a logging.Logger the result of every step is logged to at DEBUG level, or None
+#       check_consistency = boolean, debug mode: after every step, the segment permanence totals and the other
+#                       incrementally kept structures of connections are recomputed from scratch and compared
 #       spatial_pooler_output_input_mapping = a dictionary mapping spatial pooler elements back to input elements
+#       output_index = an SDR_Index mapping spatial pooler elements (as an SDR of shape (x,y)) back to input elements,
+#                       for constant-time exact lookups and nearest-match lookups of noisy patterns
 #       input_output_mapping = a dictionary mapping the input elements to spatial pooler elements
+#       decoder = a Prediction_Decoder holding the predictive cell configurations of input_output_mapping as
+#                       bitsets, so a prediction is scored against all of them in one pass
+#       changed_labels, changed_configs = sets of the keys of spatial_pooler_output_input_mapping and
+#                       input_output_mapping added or changed since the last save or save_delta
+#       saved_decoder_keys = integer, how many keys the decoder held at the last save or save_delta
 #       predictive_cells = a dictionary listing all the TM cells that are in the predictive state at time T
 #       active_cells = a dictionary listing all the TM cells that are in the active state at time T
 #                       (a subset of the predictive_cells)
@@ -29,19 +72,78 @@ from segment_ls import Segments
 
 # functions for this object are:
 #           __init__(., spatial_pooler_input_output_mapping, spatial_pooler_dim, cells_per_column, max_synapses_count,
-#                   pred_state_threshold, learn_inc_val, learn_dec_val)
+#                   pred_state_threshold, learn_inc_val, learn_dec_val, seed, max_segments_per_cell,
+#                   max_synapses_per_segment, perm_floor, check_consistency, reporter, logger, lazy, workers,
+#                   anomaly_likelihood, instrument)
 #           initialize_space(.)
+#           initialize_connections(.)
+#           get_column(., col)
+#           initialize_column(., col)
+#           get_cells_dict(., cells)
 #           initialize_input_output_mapping(.)
 #           reverse_mapping(., mapping)
-#           check_similarities_between_predictive_cells(., dict_1, dict_2)
+#           index_mapping(., mapping)
+#           add_input_label(., label, columns)
+#           get_input_label(., matrix)
+#           get_cell_numbers(., cells_dict)
+#           get_top_predictions(., k)
+#           get_predictive_cells(., active_cells)
+#           get_counts(.)
+#           record_metrics(., timer, active_cells, predictive_cells)
+#           get_metrics(.)
+#           report(., result)
+#           run_step(., learn)
 #           learn_one_input(.)
+#           compute(., active_columns, learn)
+#           run(., stream, learn)
 #           learn(., matrix_ls)
+#           get_state(., delta)
+#           save(., path)
+#           save_delta(., path)
+#           set_state(., meta)
+#           close(.)
+#
+# functions outside the object:
+#           load_temporal_memory(path, deltas, **kwargs)
+#           to_json(value)
+#
+# object: Memory_Space, the memory_space dictionary of a lazy Temporal_Memory: looking up a column it does not hold
+#         yet makes the column's Segments views with get_column and keeps them
+#
+# object: Phase_Timer, the clock of one instrumented step: every call of lap(phase) adds the time since the last
+#         call to phase
+#
+# object: TM_Result, what one step of the temporal memory produced
+#
+# attributes:
+#       step = an integer, the entry_count of the step
+#       active_cells = an ndarray of the numbers of the cells active at this step
+#       predictive_cells = an ndarray of the numbers of the cells predicted for the next step
+#       predicted_label = the input data element the predictive cells of the previous step decode to, None if
+#                       there was no prediction
+#       actual_label = the input data element the prediction is scored against (that of the previous input), None
+#                       on the first step
+#       similarity = a float, between 0 and 100, how much the predictive cells matched the best stored configuration
+#       anomaly_score = a float, between 0 and 1, the fraction of the active columns without a predictive cell
+#       anomaly_likelihood = a float, between 0 and 1, the likelihood the Temporal_Memory's anomaly_likelihood gave
+#                       for anomaly_score, None if it has none
+#       metrics = a dictionary of the seconds spent in every phase and the live segment, synapse, active cell and
+#                       predictive cell counts of the step, None if the Temporal_Memory is not instrumented
+
+
+# the phases of a step, in order: decoding the previous prediction, activating cells, choosing the learning cells,
+# updating and pruning the permanence values of the previous learning cells, growing their new segments, and finding
+# the predictive cells
+PHASES = ('decode', 'activation', 'learning_cells', 'permanence_update', 'segment_growth', 'predictive')
 
 
 class Temporal_Memory():
     def __init__(self, spatial_pooler_input_output_mapping={}, spatial_pooler_dim=(10, 10),
                  cells_per_column=5, max_synapses_count=7,
-                 pred_state_threshold=0.7, learn_inc_val=0.1, learn_dec_val=0.2):
+                 pred_state_threshold=0.7, learn_inc_val=0.1, learn_dec_val=0.2, seed=None,
+                 max_segments_per_cell=16, max_synapses_per_segment=64, perm_floor=0.0,
+                 check_consistency=False, reporter=None, logger=None, lazy=False, workers=None,
+                 anomaly_likelihood=None, instrument=False):
 
         # define dimension of the cube
         self.x, self.y = spatial_pooler_dim
@@ -50,20 +152,56 @@ class Temporal_Memory():
         # how many cells to connect to when randomly initialize the first segment
         self.max_synapses_count = max_synapses_count
 
-        # the main ds for the data: {col_index: cell_index{Segments object that is a list of Segment objects}}
+        self.rng = np.random.default_rng(seed)
+
+        # the main ds for the data: flat arrays of segments and synapses, cell (i,j,k) is number (i*y + j)*z + k,
+        # split across worker processes if there are workers
+        self.workers = workers
+        if workers:
+            self.connections = Sharded_Connections(self.x, self.y, self.z, workers,
+                                                   max_segments_per_cell=max_segments_per_cell,
+                                                   max_synapses_per_segment=max_synapses_per_segment)
+        else:
+            self.connections = Connections(self.x, self.y, self.z, max_segments_per_cell=max_segments_per_cell,
+                                           max_synapses_per_segment=max_synapses_per_segment)
+
+        # views onto the data: {col_index: cell_index{Segments object that is a list of Segment objects}}
+        self.lazy = lazy
+        self.initialized_columns = set()
         self.memory_space = self.initialize_space()
 
         # values for updating the permanence values
         self.pred_state_threshold = pred_state_threshold
         self.learn_inc_val = learn_inc_val
         self.learn_dec_val = learn_dec_val
+        self.perm_floor = perm_floor
+        self.check_consistency = check_consistency
+
+        # where the result of every step goes, nothing is printed
+        self.reporter = reporter
+        self.anomaly_likelihood = anomaly_likelihood
+
+        # the phase timers and model size counters, if switched on
+        self.instrument = instrument
+        self.phase_totals = dict.fromkeys(PHASES, 0.0)
+        self.instrumented_steps = 0
+        self.last_metrics = None
+        self.logger = logger
 
         # get the dict: {spatial_pooler_encoder_of_the_number: the_number}
         self.spatial_pooler_output_input_mapping = self.reverse_mapping(spatial_pooler_input_output_mapping)
+        self.output_index = self.index_mapping(spatial_pooler_input_output_mapping)
 
         # get the dict: {spatial_pooler_encoder_of_the_number:
         # [list of predictive celln configuration predicting this number]}
         self.input_output_mapping = self.initialize_input_output_mapping()
+        self.decoder = Prediction_Decoder(self.connections.num_cells)
+
+        # the keys of the two mappings above added or changed since the last save or save_delta, the only entries a
+        # delta file holds
+        self.changed_labels = set(self.spatial_pooler_output_input_mapping)
+        self.changed_configs = set(self.input_output_mapping)
+        self.saved_decoder_keys = 0
 
         # predictive_cells dict: {col_index: [list of predictive cells in the column]}
         self.predictive_cells = {}
@@ -92,22 +230,92 @@ class Temporal_Memory():
         #
         # returns: output_dict = a dictionary with keys being the index of SP elements and values being lists of segment objects
 
+        # in lazy mode, columns are filled in as they are used
+        if self.lazy:
+            return Memory_Space(self.get_column)
+
+        # add values to the Segments
+        self.initialize_connections()
+
         output_dict = {}
 
         # initialize the memory space
         for i in range(self.x):
             for j in range(self.y):
-                output_dict[(i, j)] = {}
-                for k in range(self.z):
-                    # initialize the Segments object
-                    output_dict[(i, j)][k] = Segments(i, j, k, x=self.x, y=self.y, z=self.z,
-                                                      max_synapses_count=self.max_synapses_count)
+                output_dict[(i, j)] = self.get_column((i, j))
 
-        # add values to the Segments
-        for i in range(self.x):
-            for j in range(self.y):
-                for k in range(self.z):
-                    output_dict[(i, j)][k].initialize_segment(output_dict)
+        return output_dict
+
+    def get_column(self, col):
+        #
+        # a function that makes the Segments views of the cells of one column
+        #
+        # returns: output_dict = a dictionary {cell_index: Segments object}
+        #
+        i, j = col
+        output_dict = {}
+        for k in range(self.z):
+            # initialize the Segments object
+            output_dict[k] = Segments(i, j, k, x=self.x, y=self.y, z=self.z, max_synapses_count=self.max_synapses_count,
+                                      connections=self.connections)
+
+        return output_dict
+
+    def initialize_column(self, col):
+        #
+        # a function that gives every cell of a column (in lazy mode, the first time it becomes active while
+        # learning) random synapses in its first segment, as initialize_connections does for all cells at once
+        #
+        i, j = col
+        first_cell = (i * self.y + j) * self.z
+        counts = self.rng.integers(1, self.max_synapses_count + 1, size=self.z)
+        targets_ls, perms_ls = [], []
+        for k in range(self.z):
+            targets_ls.append(self.rng.integers(0, self.connections.num_cells, size=counts[k]))
+            perms_ls.append(self.rng.random(counts[k]))
+        # the synapses go to the first segment of every cell
+        self.connections.connect_cells(list(range(first_cell, first_cell + self.z)), targets_ls, perms_ls,
+                                       new_segments=False)
+
+        self.initialized_columns.add(col)
+
+    def initialize_connections(self):
+        #
+        # a function that gives every cell its first segment, connected to between 1 and max_synapses_count randomly
+        # selected cells, all in one go
+        #
+        num_cells = self.connections.num_cells
+        counts = self.rng.integers(1, self.max_synapses_count + 1, size=num_cells)
+        owners = np.repeat(np.arange(num_cells), counts)
+        targets = self.rng.integers(0, num_cells, size=len(owners))
+        perms = self.rng.random(len(owners))
+
+        # a cell does not connect to itself
+        keep = targets != owners
+        owners, targets, perms = owners[keep], targets[keep], perms[keep]
+
+        # every synapse is recorded in the segment of both of its ends
+        segment_cells = np.concatenate([owners, targets])
+        presyn = np.concatenate([targets, owners])
+        perms = np.concatenate([perms, perms])
+        order = np.argsort(segment_cells, kind='stable')
+        sizes = np.bincount(segment_cells, minlength=num_cells)
+
+        self.connections.load_segments(np.arange(num_cells), sizes, presyn[order], perms[order])
+
+    def get_cells_dict(self, cells):
+        #
+        # a function that groups cell numbers by column
+        #
+        # arguments:
+        #       cells = an ndarray of cell numbers
+        #
+        # returns: output_dict = a dictionary {col_index: [list of the Segments objects of the cells in the column]}
+        #
+        output_dict = {}
+        for cell in np.sort(cells).tolist():
+            i, j, k = self.connections.cell_position(cell)
+            output_dict.setdefault((i, j), []).append(self.memory_space[(i, j)][k])
 
         return output_dict
 
@@ -129,6 +337,53 @@ class Temporal_Memory():
 
         return output_dict
 
+    def index_mapping(self, mapping):
+        #
+        # a function that builds an SDR_Index over the reverse of the SP input-output mapping dictionary
+        #
+        # arguments:
+        #       mapping = a dictionary whose keys are the input data elements and whose values are the SP indices of the elements
+        #
+        # returns: index, an SDR_Index from the SP elements (an SDR of shape (x,y)) to the keys of the argument mapping
+        #
+        index = SDR_Index()
+        for i in list(mapping.keys()):
+            index.add(self.columns_to_sdr(mapping[i]), i)
+
+        return index
+
+    def add_input_label(self, label, columns):
+        #
+        # a function that adds one input data element to the SP output-input mapping, for a stream whose elements
+        # are not all known up front
+        #
+        # arguments:
+        #       label = the input data element
+        #       columns = a list of the positions (i,j) of the SP elements it activates
+        #
+        self.spatial_pooler_output_input_mapping[tuple(columns)] = label
+        self.output_index.add(self.columns_to_sdr(columns), label)
+        self.changed_labels.add(tuple(columns))
+
+    def columns_to_sdr(self, columns):
+        #
+        # a function that turns a list of SP element positions (i,j) into an SDR of shape (x,y)
+        #
+        return SDR((self.x, self.y), [i * self.y + j for (i, j) in columns])
+
+    def get_input_label(self, matrix):
+        #
+        # a function that finds which input data element a list of SP element positions stands for
+        #
+        # arguments:
+        #       matrix = a list of SP element positions (i,j)
+        #
+        # returns: label, the input data element of the exact match if there is one, otherwise of the stored SP
+        #          pattern sharing the most elements with matrix; None if nothing matches
+        #
+        label, overlap = self.output_index.nearest(self.columns_to_sdr(matrix))
+        return label
+
     def initialize_input_output_mapping(self):
         #
         # a function that initializes a dictionary which will contain the mapping of elements in the spatial pooler to the elements in TM,
@@ -143,123 +398,165 @@ class Temporal_Memory():
 
         return output_dict
 
-    def check_similarities_between_predictive_cells(self, dict_1, dict_2):
+    def get_cell_numbers(self, cells_dict):
+        #
+        # a function that lists the cell numbers of a dictionary of cells grouped by column (the reverse of
+        # get_cells_dict)
+        #
+        # returns: cells = an int64 ndarray of cell numbers
+        #
+        return np.array([cell.cell for col in cells_dict for cell in cells_dict[col]], dtype=np.int64)
+
+    def get_top_predictions(self, k=3):
         #
-        # a function that checks the overlap between two dictionaries
+        # a function that decodes the current predictive cells into the input data elements they most likely stand for
         #
         # arguments:
-        #           dict_1 = a dictionary
-        #           dict_2 = a dictionary
+        #       k = an integer, default is 3, how many predictions to return
         #
-        # returns:
-        #           TRUE/FALSE = a logical operator that states whether or not the dicts are similar based on prediction score
-        #           percentage = a float, between 0 and 1, reflects how much of the dicts are the same
+        # returns: predictions = a list of up to k (label, percentage) pairs, best first
         #
+        return [(self.get_input_label(list(key)), percentage)
+                for key, percentage in self.decoder.decode(self.get_cell_numbers(self.predictive_cells), k)]
 
-        ls_1 = []
-        ls_2 = []
+    def get_predictive_cells(self, active_cells):
+        #
+        # a function that finds the cells with at least one segment that is fed by an active cell and whose
+        # permanence values add up to more than pred_state_threshold; only the segments reached through the
+        # active cells' synapses are looked at
+        #
+        # unlike the usual HTM activation, the total permanence of the segment is compared with the threshold, not
+        # the permanence (or number) of its active synapses alone: this is the rule of the model (see
+        # Segments.perm_above_pred_state_threshold), and pred_state_threshold, which grows by 0.2 every learning
+        # step, is set for totals; compared with active synapses only, the toy sequence of test.py is predicted
+        # right in 3 to 5 of 59 steps instead of 25 to 28
+        #
+        # arguments:
+        #           active_cells = an ndarray of the active cell numbers
+        #
+        # returns: cells = an ndarray of cell numbers
+        #
+        segments = self.connections.activate_segments(active_cells, self.pred_state_threshold)
 
-        # check which dictionary has the most keys, the bigger one becomes ref_ls, and the other one becomes test_ls
-        for i in dict_1:
-            for cell in dict_1[i]:
-                # the initiator attribute is the position of the cell
-                ls_1.append(cell.initiator)
+        return np.unique(self.connections.segment_cell[segments])
 
-        for i in dict_2:
-            for cell in dict_2[i]:
-                # the initiator attribute is the position of the cell
-                ls_2.append(cell.initiator)
+    def get_counts(self):
+        #
+        # a function that reports how big TM space has grown
+        #
+        # returns: counts = a dictionary of the live segment and synapse counts, the evicted segment and removed
+        #                   synapse totals, and the bytes held by the connections arrays
+        #
+        return self.connections.get_counts()
 
-        if len(ls_1) >= len(ls_2):
-            ref_ls = ls_1
-            test_ls = ls_2
+    def record_metrics(self, timer, active_cells, predictive_cells):
+        #
+        # a function that puts together the metrics of an instrumented step and adds them to the totals
+        #
+        # arguments:
+        #           timer = the Phase_Timer of the step
+        #           active_cells, predictive_cells = ndarrays of the cell numbers of the step
+        #
+        # returns: metrics = a dictionary {'step', 'seconds': {phase: seconds}, 'segments', 'synapses',
+        #                    'active_cells', 'predictive_cells'}
+        #
+        for phase, seconds in timer.times.items():
+            self.phase_totals[phase] += seconds
+        self.instrumented_steps += 1
+        self.last_metrics = {'step': self.entry_count, 'seconds': dict(timer.times),
+                             'segments': self.connections.get_num_segments(),
+                             'synapses': self.connections.get_num_synapses(),
+                             'active_cells': len(active_cells), 'predictive_cells': len(predictive_cells)}
 
-        else:
-            ref_ls = ls_2
-            test_ls = ls_1
-
-        # get the number of overlap elements between the two dictionaries and if over 90%, return True
-        overlap_count = 0
-        for i in test_ls:
-            if i in ref_ls:
-                overlap_count += 1
-
-        percentage = overlap_count * 100 / len(ref_ls)
-        if percentage > 90:
-            return True, percentage
-        else:
-            return False, percentage
+        return self.last_metrics
 
-    def learn_one_input(self):
+    def get_metrics(self):
         #
-        # a function that goes through a learning phase after one singular input
+        # a function that takes a snapshot of the instrumentation, for export to monitoring
         #
-        # returns:
-        #       self.entry_count = an integer, an attribute for Temporal_Memory, which represents the index of this sequence element
-        #       predict_percentage = a float that describes how well the predictive cells cover the active cell set
+        # returns: snapshot = a dictionary of the number of instrumented steps, the total and mean seconds per
+        #                     phase over them, and the metrics of the last one (None if there was none)
+        #
+        steps = self.instrumented_steps
+        return {'steps': steps, 'total_seconds': dict(self.phase_totals),
+                'mean_seconds': {phase: seconds / steps if steps else 0.0
+                                 for phase, seconds in self.phase_totals.items()},
+                'last': self.last_metrics}
 
+    def report(self, result):
+        #
+        # a function that hands the result of a step to the reporter and the logger, if any
+        #
+        if self.reporter is not None:
+            self.reporter(result)
+        if self.logger is not None:
+            self.logger.debug("step %d: actual is %s, predicted as %s, percent similarity is %.2f, "
+                              "anomaly score is %.2f", result.step, result.actual_label, result.predicted_label,
+                              result.similarity, result.anomaly_score)
+
+    def run_step(self, learn=True):
+        #
+        # a function that goes through one step on current_learning_matrix: decodes the prediction made at the
+        # previous step, activates cells and, if learn is True, learns
+        #
+        # arguments:
+        #       learn = a boolean, default is True; if False, the permanences, the segments, the threshold and the
+        #               stored predictive configurations are left as they are
+        #
+        # returns: result = a TM_Result
+        #
         # The spatial pooler matrix has the activated cell positions instead of the entire binary matrix
         spatial_pooler_matrix = self.current_learning_matrix
+        timer = Phase_Timer() if self.instrument else None
 
         # initialize the memory dictionaries
         self.entry_count += 1
+        self.connections.iteration = self.entry_count
         self.active_cells = {}
         self.prev_learning_cells = self.learning_cells  # save previous time step of learning cells
         self.learning_cells = {}  # reset learning cells for this time step
         predict_percentage = 0
 
-        max_percentage = 0
-        outcome = None
+        predicted_label = None
+        actual_label = None
 
         # if we've already gone through a learning step
         if self.previous_learning_matrix != []:
             # reset the max_percentage and outcome
             # given the predictive cells config, predict what the input is at this step
             # by looking at the similarities between this predictive cells config and the already known active ones
+            predictive_cells = self.get_cell_numbers(self.predictive_cells)
+            matches = self.decoder.decode(predictive_cells, 1)
 
-            for i in self.input_output_mapping:
-                for j in self.input_output_mapping[i]:
-
-                    similar, percentage = self.check_similarities_between_predictive_cells(j, self.predictive_cells)
-
-                    if percentage >= max_percentage:
-                        max_percentage = percentage
-                        outcome = (i, j)
-
-                    predict_percentage = max_percentage
-
-            # print(
-            #     "Actual is: " + str(
-            #         self.spatial_pooler_output_input_mapping[tuple(self.current_learning_matrix)] + 1))
-
-            # print(outcome)
-            if outcome != None:
-                # print("True encoding: " + str(self.current_learning_matrix))
-                print(
-                    "Actual is: " + str(
-                        self.spatial_pooler_output_input_mapping[tuple(self.previous_learning_matrix)] + 1))
-                print("Predicted as: " + str(self.spatial_pooler_output_input_mapping[outcome[0]] + 1))
-                print("Percent Similarity is: " + str(max_percentage))
-
-            else:
-                print("undefined")
-                print("Actual is: " + str(
-                    self.spatial_pooler_output_input_mapping[tuple(self.previous_learning_matrix)] + 1))
+            actual_label = self.get_input_label(self.previous_learning_matrix)
+            if matches:
+                outcome, predict_percentage = matches[0]
+                predicted_label = self.get_input_label(list(outcome))
 
             # as long as this is not the first step, add the predictive cells config to be one of the values of the
             # input_output_mapping at key being the current spatial pooler matrix
-            add = True
-            # for i in self.input_output_mapping[tuple(self.current_learning_matrix)]:
-            #     similar, percentage = self.check_similarities_between_predictive_cells(i, self.predictive_cells)
-            #     if similar:
-            #         add = False
-            # if add:
-            #     self.input_output_mapping[tuple(self.current_learning_matrix)].append(self.predictive_cells)
-
-            if add:
+            if learn:
                 self.input_output_mapping[tuple(self.current_learning_matrix)] = [self.predictive_cells]
+                self.decoder.add(tuple(self.current_learning_matrix), predictive_cells)
+                self.changed_configs.add(tuple(self.current_learning_matrix))
+        if timer is not None:
+            timer.lap('decode')
 
         # get the active cells and the learning cells at this step
+        # (in lazy mode, a column first drawn while learning gets its random first segments; during inference it
+        # stays as it is and an uninitialized column bursts with no segments, so inference never grows the store)
+        if self.lazy and learn:
+            for col in spatial_pooler_matrix:
+                if col not in self.initialized_columns:
+                    self.initialize_column(col)
+
+        # how much of this input the previous step failed to predict
+        anomaly_score = raw_anomaly_score(spatial_pooler_matrix, self.predictive_cells)
+        anomaly_likelihood = None
+        if self.anomaly_likelihood is not None:
+            anomaly_likelihood = self.anomaly_likelihood.update(anomaly_score)
+
+        active_ls = []
         for col in spatial_pooler_matrix:
             # if there is a predictive cell in the activated column, then select that as active and as learning
             if col in self.predictive_cells:
@@ -268,7 +565,7 @@ class Temporal_Memory():
                 # if more than one predictive cell in that column, then randomly select
                 # assign this as winner cell
                 if len(potential_ls) > 1:
-                    self.active_cells[col] = [potential_ls[random.randint(0, len(potential_ls) - 1)]]
+                    self.active_cells[col] = [potential_ls[self.rng.integers(len(potential_ls))]]
                 # if there is none, add the list for learning winner(s)
                 else:
                     self.active_cells[col] = [potential_ls[0]]
@@ -277,84 +574,135 @@ class Temporal_Memory():
             else:
                 self.active_cells[col] = [self.memory_space[col][i] for i in range(self.z)]
 
+            active_ls.extend(cell.cell for cell in self.active_cells[col])
+
+        active_cells = np.array(active_ls, dtype=np.int64)
+        # one lookup table of the active cells for every overlap score and permanence update of this step
+        active_mask = self.connections.get_active_mask(active_cells)
+        if timer is not None:
+            timer.lap('activation')
+
         # Update perm value between prev learning cell and current active cells
+        if not learn:
+            spatial_pooler_matrix = []
+            self.prev_learning_cells = {}
+        # the overlap scores of the cells of the bursting columns, all scored together
+        bursting = [col for col in spatial_pooler_matrix if col not in self.predictive_cells]
+        column_scores = {}
+        if bursting:
+            cells = [self.memory_space[col][k].cell for col in bursting for k in range(self.z)]
+            scores = self.connections.get_best_overlaps(cells, active_mask).reshape(len(bursting), self.z)
+            column_scores = dict(zip(bursting, scores))
         for col in spatial_pooler_matrix:
             # If there is a predictive cell in the activated column, then select that as active and as learning
             if col in self.predictive_cells:
-                potential_ls = self.predictive_cells[col]
-
-                # if there is more than one cell in the list, randomly select for learning winner
-                if len(potential_ls) > 1:
-                    self.learning_cells[col] = self.active_cells[col][0]
-                # if there is none, add the list for learning winner(s)
-                else:
-                    self.learning_cells[col] = self.active_cells[col][0]
+                self.learning_cells[col] = self.active_cells[col][0]
 
             else:
-
                 # check the overlap_score and assign winner cell
-                max_overlap_cells = []
-                max_score = 0
-                for i in range(self.z):
-                    score = self.memory_space[col][i].get_max_overlap_score(self.active_cells)
-                    if score > max_score:
-                        max_score = score
-                        max_overlap_cells = [self.memory_space[col][i]]
-                    elif score == max_score:
-                        max_overlap_cells.append(self.memory_space[col][i])
-                    else:
-                        continue
+                scores = column_scores[col]
+                max_score = scores.max()
+                max_overlap_cells = [self.memory_space[col][i] for i in range(self.z) if scores[i] == max_score]
 
                 # if there is more than one cell in the list, randomly select for learning winner
                 if len(max_overlap_cells) > 1:
-                    self.learning_cells[col] = max_overlap_cells[random.randint(0, len(max_overlap_cells) - 1)]
+                    self.learning_cells[col] = max_overlap_cells[self.rng.integers(len(max_overlap_cells))]
 
                 # if there is none, add the list for learning winner(s)
                 else:
                     self.learning_cells[col] = max_overlap_cells[0]
+        if timer is not None:
+            timer.lap('learning_cells')
 
         # if there were any learning cells from the previous time step
         if len(self.prev_learning_cells) > 0:
-            for col in self.prev_learning_cells:
-                cell = self.prev_learning_cells[col]
-                connecting_cells = []
+            prev_cells = [self.prev_learning_cells[col].cell for col in self.prev_learning_cells]
+
+            # update the permanence for the cells: if connected to the learning cells from previous step, increase;
+            # update the permanence for the cells: if NOT connected to the learning cells from previous step, decrease;
+            # then drop the synapses that have decayed away
+            self.connections.adapt_segments(prev_cells, active_mask, self.learn_inc_val, self.learn_dec_val,
+                                            self.perm_floor)
+            if timer is not None:
+                timer.lap('permanence_update')
+
+            presyn_ls, perms_ls = [], []
+            for cell in prev_cells:
+                # add a segment connecting the cell to every active cell (a random sample of them if there are more
+                # than a segment can hold)
+                connecting_cells = active_cells
+                if len(connecting_cells) > self.connections.max_synapses_per_segment:
+                    connecting_cells = self.rng.choice(active_cells, self.connections.max_synapses_per_segment,
+                                                       replace=False)
+                presyn_ls.append(connecting_cells)
+                perms_ls.append(self.rng.random(len(connecting_cells)))
+            self.connections.connect_cells(prev_cells, presyn_ls, perms_ls)
+            if timer is not None:
+                timer.lap('segment_growth')
+
+        if learn:
+            self.pred_state_threshold += 0.2
+        #
+        # get the predictive cells config for this step
+        # any cell that has one Segment above a cetrain threshold
+        predictive_cells = self.get_predictive_cells(active_cells)
+        self.predictive_cells = self.get_cells_dict(predictive_cells)
+        metrics = None
+        if timer is not None:
+            timer.lap('predictive')
+            metrics = self.record_metrics(timer, active_cells, predictive_cells)
 
-                # determine their connecting cells and record position
-                for j in self.active_cells:
-                    active_cells_of_col = self.active_cells[j]
+        if self.check_consistency:
+            self.connections.check_consistency()
 
-                    for k in active_cells_of_col:
-                        # the initiator attribute is the position of the cell
-                        connecting_cells.append(k.initiator)
+        result = TM_Result(self.entry_count, active_cells, predictive_cells, predicted_label, actual_label,
+                           predict_percentage, anomaly_score, anomaly_likelihood, metrics)
+        self.report(result)
 
-                seg = cell
-                # update the permanence for the cells: if connected to the learning cells from previous step, increase;
-                # update the permanence for the cells: if NOT connected to the learning cells from previous step, decrease;
-                seg.update_perm(connecting_cells, self.learn_inc_val, self.learn_dec_val)
-                # add the list of connected cells to the segment object
-                seg.add_segment(connecting_cells=connecting_cells)
+        return result
 
-        self.pred_state_threshold += 0.2
+    def learn_one_input(self):
         #
-        # get the predictive cells config for this step
-        # any cell that has one Segment above a cetrain threshold
-        self.predictive_cells = {}
-        for col in self.memory_space:
-            for cell in self.memory_space[col]:
-                # check if any column cells have permanence above the threshold
-                above = self.memory_space[col][cell].perm_above_pred_state_threshold(self.pred_state_threshold)
-                # if True, then add those column cells to the list of predictive cells for next time step
-                if above:
-                    # if the column does not have any cells in the list of predictive cells
-                    if col not in self.predictive_cells:
-                        # then add the cells meeting the threshold to the list of predictive cells for the column
-                        self.predictive_cells[col] = [self.memory_space[col][cell]]
-                    # if the column does have cells in the list of predictive cells
-                    else:
-                        # then add them to the list of predictive cells
-                        self.predictive_cells[col].append(self.memory_space[col][cell])
-
-        return self.entry_count, predict_percentage
+        # a function that goes through a learning phase after one singular input
+        #
+        # returns:
+        #       self.entry_count = an integer, an attribute for Temporal_Memory, which represents the index of this sequence element
+        #       predict_percentage = a float that describes how well the predictive cells cover the active cell set
+        result = self.run_step()
+
+        return result.step, result.similarity
+
+    def compute(self, active_columns, learn=True):
+        #
+        # a function that takes the next spatial pooler output of a stream and goes through one step on it
+        #
+        # arguments:
+        #           active_columns = a list of the positions (i,j) of the active spatial pooler elements
+        #           learn = a boolean, default is True, whether this step learns (see run_step)
+        #
+        # returns: result = a TM_Result
+        #
+        # in other words, if we have information on the active cells at the time step T-1
+        if self.current_learning_matrix != []:
+            # save the time step info
+            self.previous_learning_matrix = self.current_learning_matrix
+        # set the current active cells list to the newly found active cells info
+        self.current_learning_matrix = active_columns
+
+        return self.run_step(learn)
+
+    def run(self, stream, learn=True):
+        #
+        # a function that goes through a step for each spatial pooler output of a stream, as it arrives
+        #
+        # arguments:
+        #           stream = any iterable of lists of active spatial pooler element positions (i,j)
+        #           learn = a boolean, default is True, whether the steps learn
+        #
+        # returns: a generator of TM_Result, one per element of stream
+        #
+        for active_columns in stream:
+            yield self.compute(active_columns, learn)
 
     def learn(self, matrix_ls):
         #
@@ -369,19 +717,204 @@ class Temporal_Memory():
 
         iter_ls = []
         percentage_ls = []
-        for i in matrix_ls:
-            # in other words, if we have information on the active cells at the time step T-1
-            if self.current_learning_matrix != []:
-                # save the time step info
-                self.previous_learning_matrix = self.current_learning_matrix
-            # set the current active cells list to the newly found active cells info
-            self.current_learning_matrix = i
-
-            # go through a learning process for time step T
-            iter, learn_percentage = self.learn_one_input()
-
-            if iter != 1:
-                iter_ls.append(iter)
-                percentage_ls.append(learn_percentage)
-
-        return iter_ls, percentage_ls
\ No newline at end of file
+        for result in self.run(matrix_ls):
+            if result.step != 1:
+                iter_ls.append(result.step)
+                percentage_ls.append(result.similarity)
+
+        return iter_ls, percentage_ls
+
+    def get_state(self, delta=False):
+        #
+        # a function that gathers everything needed to rebuild this Temporal_Memory as flat arrays: the connections
+        # (see Connections.get_state) plus the parameters, the mapping tables and the state between steps as JSON
+        #
+        # arguments:
+        #           delta = a boolean, default is False; if True only the connections, and the entries of the
+        #                   mapping tables, that changed since the last save are included
+        #
+        # returns: arrays = a dictionary of ndarrays, for numpy.savez
+        #
+        def cells_of(cells_dict):
+            return [cell.cell for col in cells_dict for cell in (cells_dict[col] if isinstance(cells_dict[col], list)
+                                                                 else [cells_dict[col]])]
+
+        meta = {
+            'spatial_pooler_dim': [self.x, self.y],
+            'cells_per_column': self.z,
+            'max_synapses_count': self.max_synapses_count,
+            'pred_state_threshold': self.pred_state_threshold,
+            'learn_inc_val': self.learn_inc_val,
+            'learn_dec_val': self.learn_dec_val,
+            'perm_floor': self.perm_floor,
+            'lazy': self.lazy,
+            'initialized_columns': sorted(self.initialized_columns),
+            'rng': self.rng.bit_generator.state,
+            'entry_count': self.entry_count,
+            'spatial_pooler_output_input_mapping': [[label, list(columns)] for columns, label
+                                                    in self.spatial_pooler_output_input_mapping.items()
+                                                    if not delta or columns in self.changed_labels],
+            'input_output_mapping': [[list(columns), [cells_of(config) for config in configs]]
+                                     for columns, configs in self.input_output_mapping.items()
+                                     if not delta or columns in self.changed_configs],
+            # the decoder breaks ties by the order its keys were first stored in, which is kept as it is
+            'decoder_keys': [list(key) for key in self.decoder.keys[self.saved_decoder_keys if delta else 0:]],
+            'predictive_cells': cells_of(self.predictive_cells),
+            'learning_cells': cells_of(self.learning_cells),
+            'current_learning_matrix': list(self.current_learning_matrix),
+            'previous_learning_matrix': list(self.previous_learning_matrix),
+        }
+
+        arrays = {'connections_' + key: value for key, value in self.connections.get_state(delta).items()}
+        # labels taken from numpy data are numpy scalars, which JSON knows nothing of
+        arrays['temporal_memory'] = np.array(json.dumps(meta, default=to_json))
+        self.changed_labels = set()
+        self.changed_configs = set()
+        self.saved_decoder_keys = len(self.decoder)
+
+        return arrays
+
+    def save(self, path):
+        #
+        # a function that writes the whole Temporal_Memory to a .npz file, see load_temporal_memory
+        #
+        np.savez(path, **self.get_state())
+
+    def save_delta(self, path):
+        #
+        # a function that writes to a .npz file only the segments and synapses that changed since the last save or
+        # save_delta, with the (small) rest of the state; it is loaded on top of the earlier files, see
+        # load_temporal_memory
+        #
+        np.savez(path, **self.get_state(delta=True))
+
+    def set_state(self, meta):
+        #
+        # a function that restores the state between steps from the JSON part written by get_state; the entries of
+        # the mapping tables are added to (or replace) those already held, so the JSON parts of a save and of the
+        # save_delta files after it are restored one after the other
+        #
+        def to_positions(columns):
+            return [tuple(col) for col in columns]
+
+        self.pred_state_threshold = meta['pred_state_threshold']
+        self.lazy = meta['lazy']
+        self.initialized_columns = set(to_positions(meta['initialized_columns']))
+        self.rng.bit_generator.state = meta['rng']
+        self.entry_count = meta['entry_count']
+        for label, columns in meta['spatial_pooler_output_input_mapping']:
+            self.add_input_label(label, to_positions(columns))
+        configs_of = {tuple(to_positions(columns)): configs for columns, configs in meta['input_output_mapping']}
+        # the keys new to the decoder first, in the order they were stored in, so ties are broken as before saving
+        for columns in meta['decoder_keys']:
+            key = tuple(to_positions(columns))
+            for cells in configs_of[key]:
+                self.decoder.add(key, cells)
+        for key, configs in configs_of.items():
+            self.input_output_mapping[key] = [self.get_cells_dict(np.array(cells, dtype=np.int64)) for cells in configs]
+            for cells in configs:
+                self.decoder.add(key, cells)
+        self.predictive_cells = self.get_cells_dict(np.array(meta['predictive_cells'], dtype=np.int64))
+        self.learning_cells = {col: cells[0] for col, cells in
+                               self.get_cells_dict(np.array(meta['learning_cells'], dtype=np.int64)).items()}
+        self.current_learning_matrix = to_positions(meta['current_learning_matrix'])
+        self.previous_learning_matrix = to_positions(meta['previous_learning_matrix'])
+
+    def close(self):
+        #
+        # a function that stops the worker processes, if any; the synapses are gathered back first, so the
+        # Temporal_Memory goes on learning in the calling process
+        #
+        if self.workers:
+            self.connections.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_temporal_memory(path, deltas=[], **kwargs):
+    #
+    # a function that rebuilds a Temporal_Memory from a file written by save and, on top of it, the files written
+    # by save_delta since, in order
+    #
+    # arguments:
+    #           path = the path of the .npz file written by save
+    #           deltas = a list of paths of .npz files written by save_delta, oldest first
+    #           kwargs = other arguments for Temporal_Memory, such as reporter or logger
+    #
+    # returns: tm = a Temporal_Memory
+    #
+    files = [np.load(path)] + [np.load(delta) for delta in deltas]
+    meta = json.loads(str(files[0]['temporal_memory']))
+    limits = files[0]['connections_limits'].tolist()
+
+    # a lazy Temporal_Memory draws nothing, its connections and mapping tables are filled in from the files
+    tm = Temporal_Memory(spatial_pooler_input_output_mapping={}, spatial_pooler_dim=tuple(meta['spatial_pooler_dim']),
+                         cells_per_column=meta['cells_per_column'], max_synapses_count=meta['max_synapses_count'],
+                         pred_state_threshold=meta['pred_state_threshold'], learn_inc_val=meta['learn_inc_val'],
+                         learn_dec_val=meta['learn_dec_val'], max_segments_per_cell=limits[1],
+                         max_synapses_per_segment=limits[2], perm_floor=meta['perm_floor'], lazy=True, **kwargs)
+
+    for arrays in files:
+        tm.connections.set_state({key[len('connections_'):]: arrays[key] for key in arrays.files
+                                  if key.startswith('connections_')})
+        tm.set_state(json.loads(str(arrays['temporal_memory'])))
+    # what was loaded is what the files hold, the next save_delta starts from here
+    tm.changed_labels = set()
+    tm.changed_configs = set()
+    tm.saved_decoder_keys = len(tm.decoder)
+
+    return tm
+
+
+def to_json(value):
+    #
+    # a function that turns what json cannot write by itself (numpy scalars and arrays) into python values
+    #
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError("cannot write " + type(value).__name__ + " to JSON")
+
+
+class Memory_Space(dict):
+    def __init__(self, get_column):
+        dict.__init__(self)
+        self.get_column = get_column
+
+    def __missing__(self, col):
+        self[col] = self.get_column(col)
+        return self[col]
+
+
+class Phase_Timer():
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+
+
+class TM_Result():
+    def __init__(self, step, active_cells, predictive_cells, predicted_label, actual_label, similarity,
+                 anomaly_score=0.0, anomaly_likelihood=None, metrics=None):
+        self.step = step
+        self.active_cells = active_cells
+        self.predictive_cells = predictive_cells
+        self.predicted_label = predicted_label
+        self.actual_label = actual_label
+        self.similarity = similarity
+        self.anomaly_score = anomaly_score
+        self.anomaly_likelihood = anomaly_likelihood
+        self.metrics = metrics
+
+    def __repr__(self):
+        return "TM_Result(step=%d, active_cells=%d, predictive_cells=%d, predicted_label=%r, actual_label=%r, " \
+               "similarity=%.2f, anomaly_score=%.2f)" % (self.step, len(self.active_cells), len(self.predictive_cells),
+                                                         self.predicted_label, self.actual_label, self.similarity,
+                                                         self.anomaly_score)
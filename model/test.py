@@ -1,9 +1,9 @@
 import random
-from cathy_encoder import *
 from numeric_encoder import *
 from spatial_pooler import *
 import matplotlib.pyplot as plt
 from temporal_memory_v3 import *
+from pipeline import HTM_Pipeline
 
 def test_case_1():
     input_ls = []
@@ -24,26 +24,22 @@ def test_case_1():
 #     return input_ls
 
 def run_HTM(input_ls):
-    
-    # Step 1: Encode the numeric sequence into a sequence of sparse, binary elements
-    encoded_ls = []
-    for elem in input_ls:
-        e = encode(elem)
-        encoded_ls.append(e) 
-    # print(encoded_ls) # outputs a sequence of sparse, binary representations just as expected
-
-    # Step 2: Determine the Spatial Pooler representation of the sequence of inputs (identifies the cortical columns activated)
-    pooler_ls, mapping = Spatial_Pooler().transform(encoded_ls)
-    #print(pooler_ls) # a list of lists of tuples representing the location of activated columns, as expected
-    #print("\n")
-    #print(mapping) # maps those list of tuples to the input elements, as expected
-    
-    # Step 3: Learning with Temporal Memory Loop
-    
-    # This is where we are getting output that we are not expecting.  Lines 224 to 239 are the output we're struggling with.
-    iter_ls, percentage_ls = Temporal_Memory(spatial_pooler_input_output_mapping=mapping).learn(pooler_ls)
+
+    # Every element of the sequence streams through the three steps as it comes, nothing is built up front:
+    # Step 1: Encode the numeric element into a sparse, binary element
+    # Step 2: Determine the Spatial Pooler representation of the element (identifies the cortical columns activated)
+    # Step 3: Learning with Temporal Memory, with the element as the label of its columns
+    pipeline = HTM_Pipeline(Scalar_Encoder(min_val=1, max_val=7), Spatial_Pooler(), Temporal_Memory())
+
+    iter_ls = []
+    percentage_ls = []
+    for record in pipeline.run(input_ls):
+        if record.result.step != 1:
+            iter_ls.append(record.result.step)
+            percentage_ls.append(record.result.similarity)
+
     plt.plot(iter_ls, percentage_ls)
     plt.show()
-    
+
 
 run_HTM(test_case_1())
\ No newline at end of file
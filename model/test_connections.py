@@ -0,0 +1,96 @@
+import numpy as np
+
+from connections import Connections
+
+#
+# behavior tests for the Connections store under bounded growth: the caps hold, segments and synapses are evicted,
+# and the kept-up-to-date structures (totals, reverse index, segment lists) still match the synapse arrays
+#
+
+
+def grow_randomly(connections, rng, steps, cells_per_step=6, synapses=8):
+    #
+    # a function that runs a random workload on a store: every step some cells grow a segment to random active
+    # cells, then the segments fed by the active cells are activated and adapted, as the temporal memory does
+    #
+    # returns: checked = an integer, the number of steps after which check_consistency passed
+    #
+    checked = 0
+    for step in range(steps):
+        connections.iteration = step
+        active_cells = np.unique(rng.integers(0, connections.num_cells, 40))
+        cells = rng.choice(connections.num_cells, cells_per_step, replace=False).tolist()
+        presyn_ls = [rng.choice(active_cells, synapses) for _ in cells]
+        perms_ls = [rng.uniform(0.1, 0.9, synapses) for _ in cells]
+        connections.connect_cells(cells, presyn_ls, perms_ls)
+
+        connections.activate_segments(active_cells, 1.0)
+        connections.adapt_segments(cells, connections.get_active_mask(active_cells), 0.1, 0.05, 0.0)
+        if step % 50 == 49:
+            connections.compact()
+        connections.check_consistency()
+        checked += 1
+
+    return checked
+
+
+def test_caps_hold_and_store_stays_consistent():
+    connections = Connections(4, 4, 2, max_segments_per_cell=3, max_synapses_per_segment=10)
+    assert grow_randomly(connections, np.random.default_rng(0), 200) == 200
+
+    counts = connections.get_counts()
+    assert counts['evicted_segments'] > 0 and counts['removed_synapses'] > 0
+    for cell, segments in connections.cell_segments.items():
+        assert len(segments) <= 3, cell
+    assert connections.segment_size[:connections.num_segments].max() <= 10
+
+
+def test_least_recently_active_segment_is_evicted():
+    connections = Connections(1, 1, 2, max_segments_per_cell=3)
+    segments = []
+    for iteration in range(3):
+        connections.iteration = iteration
+        segments.append(connections.create_segment(0))
+    connections.iteration = 5
+    connections.record_activity(np.array([segments[0]]))
+
+    # the evicted id is handed out again, to the new segment at the end of the list
+    new = connections.create_segment(0)
+    assert new == segments[1]
+    assert connections.get_segments(0) == [segments[0], segments[2], new]
+    assert connections.segment_last_active[new] == 5
+    assert connections.num_evicted_segments == 1
+
+
+def test_queued_growth_matches_growth_one_cell_at_a_time():
+    rng = np.random.default_rng(1)
+    batched = Connections(3, 3, 2, max_segments_per_cell=2, max_synapses_per_segment=6)
+    single = Connections(3, 3, 2, max_segments_per_cell=2, max_synapses_per_segment=6)
+    for step in range(60):
+        batched.iteration = single.iteration = step
+        cells = rng.choice(18, 5, replace=False).tolist()
+        presyn_ls = [rng.integers(0, 18, 6) for _ in cells]
+        perms_ls = [rng.uniform(0.1, 0.9, 6) for _ in cells]
+        batched.connect_cells(cells, presyn_ls, perms_ls)
+        for cell, presyn, perms in zip(cells, presyn_ls, perms_ls):
+            single.grow_segment(cell, presyn, perms)
+
+    batched.check_consistency()
+    batched_state, single_state = batched.get_state(), single.get_state()
+    for key in single_state:
+        assert np.array_equal(batched_state[key], single_state[key]), key
+
+
+def test_state_round_trip_after_evictions():
+    connections = Connections(4, 4, 2, max_segments_per_cell=3, max_synapses_per_segment=10)
+    grow_randomly(connections, np.random.default_rng(2), 80)
+    state = connections.get_state()
+
+    loaded = Connections(4, 4, 2)
+    loaded.set_state(state)
+    loaded.check_consistency()
+    assert loaded.get_counts()['segments'] == connections.get_counts()['segments']
+    assert loaded.get_counts()['synapses'] == connections.get_counts()['synapses']
+    loaded_state = loaded.get_state()
+    for key in state:
+        assert np.array_equal(loaded_state[key], state[key]), key
@@ -0,0 +1,25 @@
+import numpy as np
+
+from numeric_encoder import Scalar_Encoder, numeric_encoder
+
+#
+# behavior tests for the bucketing of Scalar_Encoder: values fall in subintervals closed on the left, as the
+# original numeric_encoder put them
+#
+
+
+def test_numeric_encoder_subintervals():
+    data = [0, 0.5, 0.99, 1, 4.5, 9.99, 10]
+    buckets = [row.index(1) for row in numeric_encoder(data)]
+    assert buckets == [0, 0, 0, 1, 4, 9, 10]
+
+
+def test_fixed_range_buckets_floor_and_clip():
+    encoder = Scalar_Encoder(n_buckets=5, active_bits=1, min_val=0, max_val=4, shape=None)
+    buckets = encoder.get_buckets(np.array([-1, 0, 0.9, 1, 2.5, 3.99, 4, 7, np.nan]))
+    assert buckets.tolist() == [0, 0, 0, 1, 2, 3, 4, 4, -1]
+
+
+def test_periodic_buckets_wrap():
+    encoder = Scalar_Encoder(n_buckets=24, active_bits=3, min_val=0, max_val=24, periodic=True, shape=None)
+    assert encoder.get_buckets(np.array([0, 0.9, 23.5, 24, 25])).tolist() == [0, 0, 23, 0, 1]
@@ -0,0 +1,52 @@
+import gc
+
+import numpy as np
+import pytest
+
+from numeric_encoder import Scalar_Encoder
+from parallel_pooler import Parallel_Spatial_Pooler
+from spatial_pooler import Spatial_Pooler
+
+#
+# behavior tests for Parallel_Spatial_Pooler: it gives the same outputs and permanences as the serial pooler,
+# before and after it is closed, and frees its workers when dropped without closing
+#
+
+
+def make_inputs(length=40):
+    return Scalar_Encoder(min_val=0, max_val=10).encode(np.resize([1, 5, 7, 3, 2, 9, 4], length))
+
+
+def test_results_match_serial_pooler():
+    inputs = make_inputs()
+    for workers in (1, 3):
+        with Parallel_Spatial_Pooler(workers=workers, seed=2) as parallel:
+            reference = Spatial_Pooler(seed=2)
+            assert parallel.transform(inputs) == reference.transform(inputs)
+            assert np.array_equal(parallel.permanences.values, reference.permanences.values)
+            assert parallel.transform(inputs, learn=False) == reference.transform(inputs, learn=False)
+
+
+def test_closed_pooler_goes_on_serially():
+    inputs = make_inputs()
+    parallel = Parallel_Spatial_Pooler(workers=2, seed=5)
+    serial = Spatial_Pooler(seed=5)
+    assert parallel.transform(inputs[:20]) == serial.transform(inputs[:20])
+
+    parallel.close()
+    assert parallel.permanences.pool is None
+    assert parallel.transform(inputs[20:]) == serial.transform(inputs[20:])
+    assert np.array_equal(parallel.permanences.values, serial.permanences.values)
+
+
+def test_dropped_pooler_frees_its_workers():
+    parallel = Parallel_Spatial_Pooler(workers=2, seed=0)
+    finalizer = parallel.permanences.finalizer
+    del parallel
+    gc.collect()
+    assert not finalizer.alive
+
+
+def test_sparse_permanences_are_refused():
+    with pytest.raises(ValueError):
+        Parallel_Spatial_Pooler(workers=2, potential_pct=0.5)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from spatial_pooler import Spatial_Pooler
+from temporal_memory_v3 import Temporal_Memory, load_temporal_memory
+
+#
+# behavior tests for Temporal_Memory with worker processes: the results, the counts and the checkpoints do not
+# depend on the number of workers
+#
+
+
+def make_stream(seed, length=60):
+    rng = np.random.default_rng(seed)
+    values = np.resize(rng.integers(1, 8, 20), length)
+    inputs = np.zeros((length, 7, 7), dtype=int)
+    inputs[np.arange(length), values - 1] = 1
+
+    return Spatial_Pooler(seed=seed).transform(inputs)
+
+
+def run_model(matrix_ls, mapping, workers, **kwargs):
+    #
+    # a function that runs a Temporal_Memory over a stream, learning then inferring, and closes it
+    #
+    # returns: rows = a list of (predicted label, similarity, predictive cells, segments, synapses, evicted)
+    #          tuples, one per step
+    #          state = a dictionary, the store of the model as get_state gives it
+    #
+    tm = Temporal_Memory(spatial_pooler_input_output_mapping=mapping, seed=3, workers=workers,
+                         check_consistency=True, **kwargs)
+    rows = []
+    for learn in (True, False):
+        for result in tm.run(matrix_ls, learn=learn):
+            counts = tm.get_counts()
+            rows.append((result.predicted_label, result.similarity, result.predictive_cells.tolist(),
+                         counts['segments'], counts['synapses'], counts['evicted_segments']))
+    state = tm.connections.get_state()
+    tm.close()
+
+    return rows, state
+
+
+def test_results_do_not_depend_on_workers():
+    matrix_ls, mapping = make_stream(0)
+    for kwargs in ({}, {'lazy': True, 'max_segments_per_cell': 3, 'max_synapses_per_segment': 10}):
+        rows, state = run_model(matrix_ls, mapping, None, **kwargs)
+        # the small caps evict segments, the replayed evictions have to match too
+        assert rows[-1][5] > 0 or not kwargs
+        for workers in (2, 3):
+            other_rows, other_state = run_model(matrix_ls, mapping, workers, **kwargs)
+            assert other_rows == rows, workers
+            for key in state:
+                assert np.array_equal(other_state[key], state[key]), (workers, key)
+
+
+def test_checkpoint_with_workers_loads_serially(tmp_path):
+    matrix_ls, mapping = make_stream(1)
+    tm = Temporal_Memory(spatial_pooler_input_output_mapping=mapping, seed=1, workers=2,
+                         max_segments_per_cell=4, max_synapses_per_segment=16)
+    list(tm.run(matrix_ls[:40]))
+    tm.save(tmp_path / "full.npz")
+    loaded = load_temporal_memory(tmp_path / "full.npz", check_consistency=True)
+
+    # closing the workers gathers the store back, the model goes on serially
+    tm.close()
+    for a, b in zip(tm.run(matrix_ls[40:]), loaded.run(matrix_ls[40:])):
+        assert a.predicted_label == b.predicted_label, a.step
+        assert np.array_equal(a.predictive_cells, b.predictive_cells), a.step
@@ -0,0 +1,23 @@
+import numpy as np
+
+from numeric_encoder import Scalar_Encoder
+from spatial_pooler import Spatial_Pooler
+
+#
+# behavior tests for the Spatial_Pooler cache: it serves inference only, and never changes what the pooler outputs
+#
+
+
+def test_cache_serves_inference_only():
+    inputs = Scalar_Encoder(min_val=0, max_val=10).encode(np.resize([1, 5, 7, 3, 2], 30))
+    cached = Spatial_Pooler(seed=0, cache_size=16)
+    plain = Spatial_Pooler(seed=0)
+
+    assert cached.transform(inputs)[0] == plain.transform(inputs)[0]
+    assert cached.cache.get_stats()['misses'] == 0 and len(cached.cache) == 0
+
+    assert cached.transform(inputs, learn=False)[0] == plain.transform(inputs, learn=False)[0]
+    assert len(cached.cache) == 5
+    hits = cached.cache.get_stats()['hits']
+    assert cached.transform(inputs, learn=False)[0] == plain.transform(inputs, learn=False)[0]
+    assert cached.cache.get_stats()['hits'] == hits + 30
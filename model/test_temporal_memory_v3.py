@@ -0,0 +1,75 @@
+import numpy as np
+
+from spatial_pooler import Spatial_Pooler
+from temporal_memory_v3 import Temporal_Memory, load_temporal_memory
+
+#
+# behavior tests for Temporal_Memory checkpoints: a model loaded from save (and save_delta) files goes on exactly
+# like the model that was saved
+#
+
+
+def make_stream(seed, length=120):
+    #
+    # a function that makes the spatial pooler outputs of a random sequence over 7 values, repeated, with the
+    # spatial pooler mapping known up front (so the mapping tables are not in first-seen order)
+    #
+    rng = np.random.default_rng(seed)
+    values = np.resize(rng.integers(1, 8, 30), length)
+    inputs = np.zeros((length, 7, 7), dtype=int)
+    inputs[np.arange(length), values - 1] = 1
+
+    return Spatial_Pooler(seed=seed).transform(inputs)
+
+
+def run_both(tm, loaded, matrix_ls):
+    for a, b in zip(tm.run(matrix_ls), loaded.run(matrix_ls)):
+        assert a.predicted_label == b.predicted_label, a.step
+        assert a.similarity == b.similarity, a.step
+        assert np.array_equal(a.predictive_cells, b.predictive_cells), a.step
+
+
+def test_full_checkpoint_predicts_like_saved_model(tmp_path):
+    for seed in range(4):
+        matrix_ls, mapping = make_stream(seed)
+        tm = Temporal_Memory(spatial_pooler_input_output_mapping=mapping, seed=seed)
+        list(tm.run(matrix_ls[:60]))
+        tm.save(tmp_path / "full.npz")
+
+        loaded = load_temporal_memory(tmp_path / "full.npz")
+        assert loaded.decoder.keys == tm.decoder.keys
+        run_both(tm, loaded, matrix_ls[60:])
+
+
+def test_delta_checkpoints_predict_like_saved_model(tmp_path):
+    for lazy in (False, True):
+        matrix_ls, mapping = make_stream(0)
+        tm = Temporal_Memory(spatial_pooler_input_output_mapping=mapping, seed=1, lazy=lazy,
+                             max_segments_per_cell=4, max_synapses_per_segment=16)
+        list(tm.run(matrix_ls[:40]))
+        tm.save(tmp_path / "full.npz")
+        list(tm.run(matrix_ls[40:60]))
+        tm.save_delta(tmp_path / "d1.npz")
+        list(tm.run(matrix_ls[60:80]))
+        tm.save_delta(tmp_path / "d2.npz")
+
+        loaded = load_temporal_memory(tmp_path / "full.npz", [tmp_path / "d1.npz", tmp_path / "d2.npz"],
+                                      check_consistency=True)
+        # the arrays may be allocated differently, what they hold is the same
+        for count in ('segments', 'synapses'):
+            assert loaded.get_counts()[count] == tm.get_counts()[count]
+        assert loaded.spatial_pooler_output_input_mapping == tm.spatial_pooler_output_input_mapping
+        run_both(tm, loaded, matrix_ls[80:])
+
+
+def test_checkpoint_with_numpy_labels(tmp_path):
+    matrix_ls, mapping = make_stream(2, length=40)
+    tm = Temporal_Memory(spatial_pooler_input_output_mapping={}, seed=0)
+    for label, active_columns in zip(np.resize(np.arange(1, 8), 40), matrix_ls):
+        tm.add_input_label(label, active_columns)
+        tm.compute(active_columns)
+    tm.save(tmp_path / "full.npz")
+
+    loaded = load_temporal_memory(tmp_path / "full.npz")
+    assert loaded.spatial_pooler_output_input_mapping == tm.spatial_pooler_output_input_mapping
+    run_both(tm, loaded, matrix_ls)